@@ -0,0 +1,160 @@
+"""
+Token and cost accounting for LLM calls.
+
+- After a call, billed tokens come from the provider's response.usage; nothing is re-tokenized.
+- Before a call, tokens are estimated from the text length. The characters-per-token ratio
+  and the output/input ratio are calibrated per model from the usage of earlier calls.
+- estimate_job predicts a job's input tokens and cost before it starts.
+- Budget caps the tokens and cost one job may spend.
+"""
+import threading
+from functools import lru_cache
+from assets import CHARS_PER_TOKEN, ESTIMATED_OUTPUT_RATIO, ESTIMATED_PAGE_TOKENS, PROMPT_OVERHEAD_TOKENS
+
+_calibration = {}
+_calibration_lock = threading.Lock()
+
+def _ratios(model: str):
+    with _calibration_lock:
+        return _calibration.get(model, (CHARS_PER_TOKEN, ESTIMATED_OUTPUT_RATIO))
+
+def observe(model: str, input_chars: int, input_tokens: int, output_tokens: int) -> None:
+    """
+    Calibrates the model's estimates with the usage of one call (exponential moving average).
+    """
+    if input_chars <= 0 or input_tokens <= 0:
+        return
+    with _calibration_lock:
+        chars_per_token, output_ratio = _calibration.get(model, (CHARS_PER_TOKEN, ESTIMATED_OUTPUT_RATIO))
+        chars_per_token = 0.8 * chars_per_token + 0.2 * (input_chars / input_tokens)
+        output_ratio = 0.8 * output_ratio + 0.2 * (output_tokens / input_tokens)
+        _calibration[model] = (chars_per_token, output_ratio)
+
+def estimate_tokens(text: str, model: str) -> int:
+    """Cheap token estimate for a text, from its length."""
+    chars_per_token, _ = _ratios(model)
+    return int(len(text or "") / chars_per_token) + 1
+
+def estimate_chars(tokens: int, model: str) -> int:
+    """Roughly how many characters of text make `tokens` tokens (the inverse of estimate_tokens)."""
+    chars_per_token, _ = _ratios(model)
+    return max(int(tokens * chars_per_token), 1)
+
+def message_chars(messages: list) -> int:
+    return sum(len(str(message.get("content") or "")) for message in messages)
+
+def estimate_messages_tokens(messages: list, model: str) -> int:
+    """Cheap token estimate for a list of chat messages (a few tokens of framing per message)."""
+    chars_per_token, _ = _ratios(model)
+    return int(message_chars(messages) / chars_per_token) + 4 * len(messages)
+
+def estimate_output_tokens(input_tokens: int, model: str) -> int:
+    _, output_ratio = _ratios(model)
+    return int(input_tokens * output_ratio)
+
+def usage_counts(response, estimated_input_tokens: int = 0, output_text: str = "", model: str = None) -> dict:
+    """
+    Returns {"input_tokens", "output_tokens"} from response.usage, falling back to
+    estimates when the provider did not report usage.
+    """
+    usage = getattr(response, "usage", None)
+    if isinstance(usage, dict):
+        input_tokens, output_tokens = usage.get("prompt_tokens"), usage.get("completion_tokens")
+    else:
+        input_tokens, output_tokens = getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+    if input_tokens is None:
+        input_tokens = estimated_input_tokens
+    if output_tokens is None:
+        output_tokens = estimate_tokens(output_text, model)
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens}
+
+@lru_cache(maxsize=None)
+def _token_prices(model: str):
+    """(input, output) price per token, looked up once per model. (0, 0) if unknown."""
+    from litellm import cost_per_token
+    try:
+        input_cost, _ = cost_per_token(model=model, prompt_tokens=1_000_000, completion_tokens=0)
+        _, output_cost = cost_per_token(model=model, prompt_tokens=0, completion_tokens=1_000_000)
+        return input_cost / 1_000_000, output_cost / 1_000_000
+    except Exception as e:
+        print(f"WARNING: No pricing for {model}: {e}")
+        return 0.0, 0.0
+
+def estimate_cost(input_tokens: int, output_tokens: int, model: str) -> float:
+    input_price, output_price = _token_prices(model)
+    return input_tokens * input_price + output_tokens * output_price
+
+def estimate_page(markdown: str, model: str, calls: int = 1) -> dict:
+    """
+    Predicts {"input_tokens", "output_tokens", "cost"} for sending one page `calls` times
+    (e.g. once for listings and once for pagination).
+    """
+    input_tokens = calls * (estimate_tokens(markdown, model) + PROMPT_OVERHEAD_TOKENS)
+    output_tokens = estimate_output_tokens(input_tokens, model)
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+            "cost": estimate_cost(input_tokens, output_tokens, model)}
+
+def estimate_job(urls: list, model: str, calls: int = 1) -> dict:
+    """
+    Predicts tokens and cost of a job before it starts. Pages in the fetch cache are
+    estimated from their markdown, the others at their average (or ESTIMATED_PAGE_TOKENS).
+    Returns {"pages", "cached_pages", "input_tokens", "output_tokens", "cost"}.
+    """
+    import fetch_cache
+    known = []
+    for url in urls:
+        entry = fetch_cache.lookup(url)
+        if entry:
+            known.append(estimate_tokens(entry["raw_data"], model))
+    page_tokens = sum(known) / len(known) if known else ESTIMATED_PAGE_TOKENS
+    page_tokens_total = sum(known) + page_tokens * (len(urls) - len(known))
+    input_tokens = int(calls * (page_tokens_total + PROMPT_OVERHEAD_TOKENS * len(urls)))
+    output_tokens = estimate_output_tokens(input_tokens, model)
+    return {"pages": len(urls), "cached_pages": len(known), "input_tokens": input_tokens,
+            "output_tokens": output_tokens, "cost": estimate_cost(input_tokens, output_tokens, model)}
+
+class Budget:
+    """
+    Token and cost cap for one job (None = no limit). Work reserves its estimate before
+    it starts and settles the actual usage afterwards, so concurrent calls can't overshoot
+    the cap by more than the estimation error.
+    """
+    def __init__(self, max_tokens: int = None, max_cost: float = None):
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.tokens = 0
+        self.cost = 0.0
+        self.lock = threading.Lock()
+
+    def _fits(self, tokens: int, cost: float) -> bool:
+        return ((self.max_tokens is None or self.tokens + tokens <= self.max_tokens)
+                and (self.max_cost is None or self.cost + cost <= self.max_cost))
+
+    def reserve(self, tokens: int, cost: float) -> bool:
+        """Reserves an estimate. Returns False if it would exceed the budget."""
+        with self.lock:
+            if not self._fits(tokens, cost):
+                return False
+            self.tokens += tokens
+            self.cost += cost
+            return True
+
+    def settle(self, reserved_tokens: int, reserved_cost: float, token_counts: dict, cost: float) -> None:
+        """Replaces a reservation with the usage that was actually billed."""
+        with self.lock:
+            self.tokens += token_counts.get("input_tokens", 0) + token_counts.get("output_tokens", 0) - reserved_tokens
+            self.cost += cost - reserved_cost
+
+    def charge(self, token_counts: dict, cost: float) -> None:
+        """Records usage that was not reserved in advance."""
+        self.settle(0, 0.0, token_counts, cost)
+
+    def exhausted(self) -> bool:
+        with self.lock:
+            return ((self.max_tokens is not None and self.tokens >= self.max_tokens)
+                    or (self.max_cost is not None and self.cost >= self.max_cost))
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {"max_tokens": self.max_tokens, "max_cost": self.max_cost, "tokens_used": self.tokens,
+                    "cost_used": self.cost}
@@ -0,0 +1,113 @@
+"""
+FastAPI app around the job service.
+
+Run with:  uvicorn api:app --port 8000
+"""
+import asyncio
+import json
+import os
+from typing import Dict, List, Optional
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from assets import MODELS_USED, OPENAI_MODEL_FULLNAME, CRAWL_MAX_PAGES, TRACE_DIR, FETCH_PROFILES
+from jobs import get_job_runner
+from tracing import render_prometheus
+
+app = FastAPI(title="TRAI SpiderMIND")
+
+class JobRequest(BaseModel):
+    urls: List[str]
+    model: str = OPENAI_MODEL_FULLNAME
+    fields: List[str] = []
+    use_pagination: bool = False
+    pagination_details: str = ""
+    follow_pagination: bool = False
+    max_pages: int = CRAWL_MAX_PAGES
+    use_templates: bool = False
+    fetch_profile: Optional[str] = None
+    distributed: bool = False
+    pack_pages: bool = False
+    batch_api: bool = False
+    max_tokens: Optional[int] = None
+    max_cost: Optional[float] = None
+    api_keys: Optional[Dict[str, str]] = None
+
+def _get_job_or_404(job_id: str) -> dict:
+    job = get_job_runner().store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+def _validate(request: JobRequest) -> None:
+    if request.model not in MODELS_USED:
+        raise HTTPException(status_code=400, detail=f"Unknown model {request.model}")
+    if not request.urls:
+        raise HTTPException(status_code=400, detail="Please enter at least one URL.")
+    if request.fetch_profile is not None and request.fetch_profile not in FETCH_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown fetch profile {request.fetch_profile}")
+
+@app.post("/jobs", status_code=202)
+def submit_job(request: JobRequest):
+    _validate(request)
+    params = request.model_dump(exclude={"api_keys"})
+    job_id = get_job_runner().submit(params, request.api_keys)
+    return {"id": job_id, "status": "pending"}
+
+@app.post("/estimate")
+def estimate(request: JobRequest):
+    """Predicted tokens and cost of a job, without running it."""
+    from accounting import estimate_job
+    _validate(request)
+    calls = bool(request.fields) + bool(request.use_pagination or request.follow_pagination)
+    return estimate_job(request.urls, request.model, max(calls, 1))
+
+@app.get("/jobs")
+def list_jobs(limit: int = 50):
+    return [{k: job[k] for k in ("id", "status", "progress", "created_at", "updated_at")}
+            for job in get_job_runner().store.list(limit)]
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    return _get_job_or_404(job_id)
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job(job_id: str, poll_interval: float = 1.0):
+    """Server-sent events with the job's status and progress until it finishes."""
+    _get_job_or_404(job_id)
+
+    async def events():
+        last = None
+        while True:
+            job = await asyncio.to_thread(get_job_runner().store.get, job_id)
+            snapshot = {"id": job_id, "status": job["status"], "progress": job["progress"], "error": job["error"]}
+            if snapshot != last:
+                yield f"data: {json.dumps(snapshot)}\n\n"
+                last = snapshot
+            if job["status"] in ("completed", "failed", "cancelled"):
+                break
+            await asyncio.sleep(poll_interval)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/jobs/{job_id}/trace")
+def get_job_trace(job_id: str):
+    """The job's trace in the OTLP/JSON format."""
+    _get_job_or_404(job_id)
+    path = os.path.join(TRACE_DIR, f"{job_id}.json")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="No trace recorded for this job yet")
+    with open(path) as f:
+        return json.load(f)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Per-stage metrics in the Prometheus text format."""
+    return render_prometheus()
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    _get_job_or_404(job_id)
+    if not get_job_runner().store.request_cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job already finished")
+    return {"id": job_id, "cancel_requested": True}
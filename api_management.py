@@ -1,26 +1,48 @@
 import streamlit as st
 import os
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dotenv import load_dotenv
-from supabase import create_client
 from assets import MODELS_USED
 
 load_dotenv()
 
+# Keys of the job running in the current context (env var name -> key), see jobs.JobRunner
+_job_api_keys = ContextVar("job_api_keys", default={})
+
+@contextmanager
+def job_api_keys(keys: dict):
+    """Makes `keys` (env var name -> key) the API keys of the code run inside the block, in this context only."""
+    token = _job_api_keys.set({name: value for name, value in (keys or {}).items() if value})
+    try:
+        yield
+    finally:
+        _job_api_keys.reset(token)
+
 def get_api_key(model):
     """
     Returns an API key for a given model by:
       1) Looking up the environment var name in MODELS_USED[model].
-      2) Returning the key from st.session_state if present; otherwise from os.environ.
+      2) Returning the key of the current job (job_api_keys) if set, else from st.session_state,
+         otherwise from os.environ.
     """
     env_var_name = list(MODELS_USED[model])[0]  # e.g., "GEMINI_API_KEY"
-    return st.session_state.get(env_var_name) or os.getenv(env_var_name)
+    return _job_api_keys.get().get(env_var_name) or st.session_state.get(env_var_name) or os.getenv(env_var_name)
+
+_supabase_clients = {}
 
 def get_supabase_client():
-    """Returns a Supabase client if credentials exist, otherwise returns None."""
+    """
+    Returns a Supabase client if credentials exist, otherwise returns None.
+    One client (and its connection pool) is shared per set of credentials.
+    """
     supabase_url = st.session_state.get('SUPABASE_URL') or os.getenv('SUPABASE_URL')
     supabase_key = st.session_state.get('SUPABASE_ANON_KEY') or os.getenv('SUPABASE_ANON_KEY')
 
     if not supabase_url or not supabase_key or "your-supabase-url-here" in supabase_url:
         return None
 
-    return create_client(supabase_url, supabase_key)
+    if (supabase_url, supabase_key) not in _supabase_clients:
+        from supabase import create_client  # imported on first use, it is slow to load
+        _supabase_clients[(supabase_url, supabase_key)] = create_client(supabase_url, supabase_key)
+    return _supabase_clients[(supabase_url, supabase_key)]
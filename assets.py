@@ -12,6 +12,147 @@ MODELS_USED = {
     DEEPSEEK_MODEL_FULLNAME: {"GROQ_API_KEY"},
 }
 
+# Per-provider rate limits (requests and tokens per minute) for async LLM extraction
+MODEL_RATE_LIMITS = {
+    OPENAI_MODEL_FULLNAME: {"rpm": 500, "tpm": 200000},
+    GEMINI_MODEL_FULLNAME: {"rpm": 15, "tpm": 1000000},
+    DEEPSEEK_MODEL_FULLNAME: {"rpm": 30, "tpm": 6000},
+}
+DEFAULT_RATE_LIMITS = {"rpm": 60, "tpm": 100000}
+
+# Concurrency and retry settings for LLM calls
+MAX_CONCURRENT_LLM_CALLS = 8
+LLM_MAX_RETRIES = 5
+LLM_BACKOFF_BASE = 2  # seconds, doubled on every 429, timeout, connection error or 5xx
+LLM_BACKOFF_MAX = 60  # seconds
+
+# Chunking of oversized pages: tokens kept free for the prompt, schema and answer,
+# and the chunk size used when LiteLLM does not know the model's limits
+CHUNK_RESERVED_TOKENS = 2000
+DEFAULT_CHUNK_TOKENS = 8000
+
+# Pre-LLM cleanup: blocks repeated on this share of a domain's pages (and on at least
+# BOILERPLATE_MIN_PAGES pages) are dropped, URLs this long are replaced by short tokens
+BOILERPLATE_MIN_PAGES = 3
+BOILERPLATE_RATIO = 0.6
+LINK_COMPACT_MIN_LENGTH = 60
+BOILERPLATE_WINDOW = 10  # pages per domain remembered when pages are streamed
+BOILERPLATE_MAX_DOMAINS = 200  # domains whose latest boilerplate is kept between runs
+
+# Local cache of LLM responses (SQLite), evicted by age and by entry count
+LLM_CACHE_PATH = ".cache/llm_cache.sqlite"
+LLM_CACHE_MAX_ENTRIES = 5000
+LLM_CACHE_MAX_AGE = 7 * 24 * 60 * 60  # seconds
+
+# Deterministic pagination detection: patterns at or above this confidence skip the LLM
+PAGINATION_CONFIDENCE_THRESHOLD = 0.7
+MAX_PAGINATION_PAGES = 500
+
+# Storage layer: write-behind batching, bulk read size and the local SQLite stand-in
+# (used when STORAGE_BACKEND=sqlite)
+STORAGE_BATCH_SIZE = 50
+STORAGE_FLUSH_INTERVAL = 2  # seconds
+STORAGE_READ_CHUNK = 100
+STORAGE_SQLITE_PATH = ".cache/scraped_data.sqlite"
+
+# Multi-page crawl frontier (following discovered pagination URLs)
+CRAWL_MAX_PAGES = 50
+CRAWL_MAX_DEPTH = 3
+CRAWL_DOMAIN_DELAY = 1.0  # seconds between requests to the same host
+CRAWL_MAX_PER_DOMAIN = 2
+
+# Background job service (jobs.py, api.py, cli.py)
+JOBS_DB_PATH = ".cache/jobs.sqlite"
+JOB_WORKERS = 2
+# Runners refresh their jobs' updated_at every JOB_HEARTBEAT_INTERVAL seconds; a pending or running
+# job not refreshed for JOB_STALE_SECONDS belongs to a process that exited (see JobRunner)
+JOB_HEARTBEAT_INTERVAL = 30
+JOB_STALE_SECONDS = 180
+
+# Streaming pipeline: capacity of the queues between fetch, preprocessing, extraction and saving
+PIPELINE_QUEUE_SIZE = 16
+
+# Token accounting: pre-call estimates (calibrated per model from provider-reported usage)
+# and per-job budgets (None = no limit)
+CHARS_PER_TOKEN = 4.0
+ESTIMATED_OUTPUT_RATIO = 0.2
+ESTIMATED_PAGE_TOKENS = 6000
+PROMPT_OVERHEAD_TOKENS = 400
+JOB_MAX_TOKENS = None
+JOB_MAX_COST = None
+
+# Structured output validation: retries of invalid responses (per page or chunk) with capped backoff
+VALIDATION_MAX_RETRIES = 2
+VALIDATION_BACKOFF_BASE = 1
+VALIDATION_BACKOFF_MAX = 10
+
+# Tracing: finished spans kept in memory, per-job trace files, Prometheus histogram buckets (seconds)
+TRACE_MAX_SPANS = 20000
+TRACE_DIR = ".cache/traces"
+TRACE_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Incremental re-extraction: only blocks that are new since the last extraction of the same URL
+# and fields are sent to the model; above this share of changed text the whole page is re-extracted
+INCREMENTAL_EXTRACTION = True
+INCREMENTAL_MAX_CHANGE_RATIO = 0.6
+INCREMENTAL_MATCH_RATIO = 0.5  # share of a previous listing's values that must still be on the page
+
+# Exports (export.py): pages read from storage per chunk, rows per Parquet row group, preview page size
+EXPORT_CHUNK_PAGES = 50
+EXPORT_BATCH_ROWS = 5000
+EXPORT_PREVIEW_ROWS = 50
+EXPORT_DIR = ".cache/exports"
+
+# Static fetch path: plain HTTP/2 GET + HTML-to-markdown before falling back to the browser
+# for pages that need JavaScript (decided per domain)
+STATIC_FETCH = True
+STATIC_FETCH_TIMEOUT = 15  # seconds
+STATIC_MIN_TEXT_CHARS = 200  # less visible text than this means the page renders client-side
+STATIC_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/124.0 Safari/537.36"
+)
+
+# Wrapper induction (wrappers.py): CSS selector templates learned per domain and field set
+WRAPPER_DB_PATH = ".cache/templates.sqlite"
+WRAPPER_MIN_AGREEMENT = 0.8  # recall and precision against the LLM's listings needed to keep a template
+WRAPPER_MIN_RECORD_SHARE = 0.6  # share of listings that must share the record selector
+WRAPPER_MIN_FILL_RATE = 0.7  # usually filled fields must be filled on this share of a page's records
+WRAPPER_MAX_INDUCTIONS = 3  # failed attempts per domain and run before pages stop waiting for a template
+
+# Distributed workers (worker.py): URLs claimed per batch, lease length and renewal, retries of
+# items whose lease expired or that failed, idle wait between claims (seconds)
+WORKER_BATCH_SIZE = 8
+WORKER_LEASE_SECONDS = 300
+WORKER_HEARTBEAT_INTERVAL = 60
+WORKER_MAX_ATTEMPTS = 3
+WORKER_POLL_INTERVAL = 2
+
+# Relevance filter (relevance.py): on pages above RELEVANCE_MIN_PAGE_TOKENS only the blocks that
+# score at least RELEVANCE_MIN_RELATIVE_SCORE of the page's top blocks for the requested fields are
+# sent, best first, up to RELEVANCE_TOKEN_BUDGET tokens
+RELEVANCE_FILTER = True
+RELEVANCE_MIN_PAGE_TOKENS = 2000
+RELEVANCE_TOKEN_BUDGET = 16000
+RELEVANCE_MIN_RELATIVE_SCORE = 0.2
+RELEVANCE_SHAPE_WEIGHT = 1.0  # per field value shape (price, date, link, ...) found in a block
+RELEVANCE_STRUCTURE_WEIGHT = 0.5  # list items, table rows and repeated block shapes
+RELEVANCE_MIN_REPEATS = 3  # blocks of one shape that make a repeated (listing) pattern
+
+# Prompt packing and batch API (batching.py): pages up to PACK_MAX_PAGE_TOKENS are extracted several
+# to a request (at most PACK_MAX_PAGES and PACK_TOKEN_BUDGET tokens), waiting up to PACK_LINGER seconds
+# for a pack to fill; batch jobs are polled every BATCH_POLL_INTERVAL seconds and cost BATCH_COST_FACTOR
+# of the interactive price
+PACK_MAX_PAGE_TOKENS = 1500
+PACK_TOKEN_BUDGET = 6000
+PACK_MAX_PAGES = 8
+PACK_LINGER = 0.5
+BATCH_BACKEND = "litellm"  # or "local" (in-process stand-in for tests)
+BATCH_DB_PATH = ".cache/batches.sqlite"
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_POLL_INTERVAL = 60
+BATCH_COST_FACTOR = 0.5
+
 # Timeout settings for web scraping
 TIMEOUT_SETTINGS = {
     "page_load": 30,
@@ -20,6 +161,31 @@ TIMEOUT_SETTINGS = {
 
 NUMBER_SCROLL = 2
 
+# Browser fetch profiles (fetch_profiles.py): resource types never downloaded, whether requests to
+# other sites are blocked, a CSS selector to wait for, adaptive scrolling, and optional "page_load" /
+# "script" timeouts (seconds, default TIMEOUT_SETTINGS). Jobs pick one with "fetch_profile";
+# DOMAIN_FETCH_PROFILES maps a host or site (e.g. "example.com") to the profile it always uses.
+FETCH_PROFILES = {
+    "standard": {"block": ["image", "media", "font"]},
+    "lean": {"block": ["image", "media", "font", "stylesheet"], "block_third_party": True},
+    "infinite_scroll": {"block": ["image", "media", "font"], "scroll": True, "script": 30},
+    "full": {},
+}
+FETCH_PROFILE = "standard"
+DOMAIN_FETCH_PROFILES = {}
+FETCH_MAX_SCROLLS = 30  # NUMBER_SCROLL is the number of scrolls without new content before stopping
+FETCH_SCROLL_DELAY = 0.75  # seconds between scrolls
+
+# Concurrency limits for page fetching (one shared browser, many pages)
+MAX_CONCURRENT_FETCHES = 8
+MAX_FETCHES_PER_DOMAIN = 2
+
+# Raw markdown cache: pages fetched within the TTL are reused without opening the browser,
+# older pages are revalidated with ETag/Last-Modified before being crawled again.
+RAW_DATA_CACHE_TTL = 6 * 60 * 60  # seconds
+RAW_DATA_CACHE_MAX_ENTRIES = 256
+REVALIDATION_TIMEOUT = 10  # seconds
+
 SYSTEM_MESSAGE = (
     "You are an intelligent text extraction and conversion assistant. Your task is to extract structured information "
     "from the given text and convert it into a pure JSON format. The JSON should contain only the structured data extracted, "
@@ -29,6 +195,13 @@ SYSTEM_MESSAGE = (
 
 USER_MESSAGE = "Extract the following information from the provided text:\nPage content:\n\n"
 
+PROMPT_PACKED_PAGES = (
+    "The text contains several web pages. Each page starts with a line like \"=== PAGE 1 ===\". "
+    "Extract the listings of every page separately and return them as "
+    "{\"pages\": [{\"page\": \"1\", \"listings\": [...]}, ...]}, with one entry per page (use the page number "
+    "from its line, and an empty list for pages without listings). Never move a listing to another page."
+)
+
 PROMPT_PAGINATION = """
 You are an assistant that extracts pagination URLs from markdown content of websites. 
 Your task is to identify and generate a list of pagination URLs based on a detected URL pattern where page numbers increment sequentially. Follow these instructions carefully:
@@ -0,0 +1,529 @@
+"""
+Prompt packing and offline batch extraction.
+
+Packing: small pages (up to PACK_MAX_PAGE_TOKENS) are extracted several at a time in one
+request, so the system message and schema are sent once per pack instead of once per page.
+Each page of a pack starts with a "=== PAGE <n> ===" line and the model returns the listings
+of every page separately ({"pages": [{"page": "<n>", "listings": [...]}]}), which are split
+back to their unique_names. PagePacker collects the pages of a running batch or pipeline for
+up to PACK_LINGER seconds (or until a pack is full); a pack that fails validation, and pages
+the model left out, are extracted on their own.
+
+Batch API: large low-priority jobs are submitted to the provider's batch endpoint (cheaper,
+outside the interactive rate limits), polled until done, and the results are validated and
+saved through save_formatted_data. Batches are recorded in BATCH_DB_PATH, so they can be
+collected from another process, e.g. after the job that submitted them was interrupted:
+
+    python cli.py batch <batch_id> --wait
+ The endpoint is behind BatchBackend: LiteLLMBatchBackend for
+the providers litellm supports batches for, LocalBatchBackend as a stand-in for tests.
+"""
+import abc
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from typing import List
+from pydantic import create_model
+import litellm
+import accounting
+from assets import (SYSTEM_MESSAGE, PROMPT_PACKED_PAGES, PACK_MAX_PAGE_TOKENS, PACK_TOKEN_BUDGET, PACK_MAX_PAGES,
+                    PACK_LINGER, BATCH_DB_PATH, BATCH_BACKEND, BATCH_COMPLETION_WINDOW, BATCH_COST_FACTOR,
+                    MAX_CONCURRENT_LLM_CALLS)
+from llm_calls import acall_llm_model, _prepare_request
+from api_management import get_api_key
+from chunking import chunk_budget, split_markdown
+from preprocess import preprocess_pages, restore_links
+from markdown import read_raw_data_many
+from storage import get_storage
+from scraper import create_dynamic_listing_model, create_listings_container_model, extract_page_async, \
+    merge_listings, plan_page, save_formatted_data
+from validation import InvalidResponse, add_token_counts, validate_response, with_retries
+
+PAGE_DELIMITER = "=== PAGE {} ==="
+
+def create_packed_container_model(fields: List[str]):
+    listing_model = create_dynamic_listing_model(fields)
+    page_model = create_model('PackedPage', page=(str, ...), listings=(List[listing_model], ...))
+    return create_model('PackedListingsContainer', pages=(List[page_model], ...))
+
+def packed_prompt(markdowns: List[str]) -> str:
+    """The pages of a pack, each under its PAGE_DELIMITER line (numbered from 1)."""
+    return "\n\n".join(f"{PAGE_DELIMITER.format(n)}\n{markdown.strip()}" for n, markdown in enumerate(markdowns, start=1))
+
+def unpack(parsed: dict, count: int) -> list:
+    """Listings per page of a pack, in pack order; None for pages the model left out."""
+    pages = [None] * count
+    for page in parsed.get("pages", []):
+        try:
+            n = int(str(page.get("page", "")).strip()) - 1
+        except ValueError:
+            continue
+        if 0 <= n < count:
+            pages[n] = (pages[n] or []) + list(page.get("listings", []))
+    return pages
+
+def _shares(markdowns: List[str]) -> List[float]:
+    """Each page's share of a pack's usage, by length."""
+    total = sum(len(markdown) for markdown in markdowns) or 1
+    return [len(markdown) / total for markdown in markdowns]
+
+def _count(run_stats: dict, key: str, amount: int = 1) -> None:
+    if run_stats is not None:
+        run_stats[key] = run_stats.get(key, 0) + amount
+
+class PagePacker:
+    """
+    Extracts the pages handed to extract() in packs (created per event loop and field set).
+    Counts are recorded in run_stats: packed_calls, packed_pages, pack_fallbacks.
+    """
+    def __init__(self, fields: List[str], selected_model: str, limit: asyncio.Semaphore = None, run_stats: dict = None):
+        self.container = create_listings_container_model(create_dynamic_listing_model(fields))
+        self.packed_container = create_packed_container_model(fields)
+        self.model = selected_model
+        self.limit = limit or asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+        self.run_stats = run_stats
+        self.pending = []
+        self.pending_tokens = 0
+        self.timer = None
+        self.tasks = set()  # the event loop only keeps weak references to running packs
+
+    async def extract(self, plan: dict, link_map: dict, label: str = "page"):
+        """Same contract as scraper.extract_page_async: returns (parsed, token_counts, cost)."""
+        tokens = accounting.estimate_tokens(plan["markdown"], self.model)
+        if not plan["markdown"].strip() or tokens > PACK_MAX_PAGE_TOKENS:
+            return await self._alone(plan, link_map, label)
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((plan, link_map, label, future))
+        self.pending_tokens += tokens
+        if len(self.pending) >= PACK_MAX_PAGES or self.pending_tokens >= PACK_TOKEN_BUDGET:
+            self._flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(PACK_LINGER, self._flush)
+        return await future
+
+    async def _alone(self, plan: dict, link_map: dict, label: str):
+        return await extract_page_async(plan, link_map, self.container, self.model, self.limit, self.run_stats, label)
+
+    def _flush(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        group, self.pending, self.pending_tokens = self.pending, [], 0
+        if group:
+            task = asyncio.ensure_future(self._run(group))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, group: list) -> None:
+        try:
+            if len(group) == 1:
+                plan, link_map, label, future = group[0]
+                results = [await self._alone(plan, link_map, label)]
+            else:
+                results = await self._run_pack(group)
+        except BaseException as e:
+            for *_, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (*_, future), result in zip(group, results):
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _run_pack(self, group: list) -> list:
+        markdowns = [plan["markdown"] for plan, *_ in group]
+        label = f"pack of {len(group)} pages"
+
+        def validator(content):
+            return validate_response(content, self.packed_container, self.run_stats)
+
+        async def attempt():
+            async with self.limit:
+                return await acall_llm_model(packed_prompt(markdowns), self.packed_container, self.model,
+                                             SYSTEM_MESSAGE + "\n" + PROMPT_PACKED_PAGES, validator=validator)
+        try:
+            parsed, token_counts, cost = await with_retries(attempt, label, self.run_stats)
+        except InvalidResponse as e:
+            print(f"WARNING: {label} failed validation, extracting its pages one by one")
+            _count(self.run_stats, "pack_fallbacks", len(group))
+            outcomes = await asyncio.gather(*(self._alone(plan, link_map, page_label)
+                                              for plan, link_map, page_label, _ in group), return_exceptions=True)
+            # The failed pack's usage is charged to its first page
+            first = outcomes[0]
+            if not isinstance(first, BaseException):
+                outcomes[0] = (first[0], add_token_counts(dict(first[1]), e.token_counts), first[2] + e.cost)
+            return outcomes
+        _count(self.run_stats, "packed_calls")
+        _count(self.run_stats, "packed_pages", len(group))
+
+        results, missing = [], []
+        for (plan, link_map, page_label, _), listings, share in zip(group, unpack(parsed, len(group)), _shares(markdowns)):
+            page_counts = {key: round(value * share) for key, value in token_counts.items()}
+            if listings is None:
+                missing.append(len(results))
+                results.append((self._alone(plan, link_map, page_label), page_counts, cost * share))
+                continue
+            page = restore_links({"listings": listings}, link_map)
+            if plan["carried"] is not None:
+                page = merge_listings([page, {"listings": plan["carried"]}])
+            results.append((page, page_counts, cost * share))
+        # Pages the model left out are extracted on their own, concurrently, and also pay their share of the pack
+        _count(self.run_stats, "pack_fallbacks", len(missing))
+        outcomes = await asyncio.gather(*(results[i][0] for i in missing), return_exceptions=True)
+        for i, outcome in zip(missing, outcomes):
+            _, page_counts, page_cost = results[i]
+            if isinstance(outcome, BaseException):
+                results[i] = outcome
+            else:
+                results[i] = (outcome[0], add_token_counts(dict(outcome[1]), page_counts), outcome[2] + page_cost)
+        return results
+
+class BatchBackend(abc.ABC):
+    """
+    A provider batch endpoint. Requests are {"custom_id", "body"}, where body holds the
+    completion parameters (model, messages, response_format as a JSON schema).
+    """
+    @abc.abstractmethod
+    def submit(self, requests: list, model: str) -> str:
+        """Submits the requests and returns the batch id."""
+
+    @abc.abstractmethod
+    def status(self, batch_id: str) -> str:
+        """One of "validating", "in_progress", "finalizing", "completed", "failed", "expired", "cancelled"."""
+
+    @abc.abstractmethod
+    def results(self, batch_id: str) -> dict:
+        """custom_id -> {"content", "usage"} or {"error"} for a completed batch."""
+
+    @abc.abstractmethod
+    def cancel(self, batch_id: str) -> None:
+        """Cancels a batch that is still running."""
+
+class LiteLLMBatchBackend(BatchBackend):
+    """Batches through litellm's files and batches APIs (OpenAI-compatible JSONL) for a model's provider."""
+    def __init__(self, model: str):
+        _, self.provider, _, _ = litellm.get_llm_provider(model)
+        api_key = get_api_key(model)
+        self.credentials = {"api_key": api_key} if api_key else {}
+
+    def submit(self, requests: list, model: str) -> str:
+        provider = self.provider
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False, encoding="utf-8") as f:
+            for request in requests:
+                f.write(json.dumps({"custom_id": request["custom_id"], "method": "POST",
+                                    "url": "/v1/chat/completions", "body": request["body"]}) + "\n")
+        try:
+            with open(f.name, "rb") as upload:
+                batch_file = litellm.create_file(file=upload, purpose="batch", custom_llm_provider=provider,
+                                                 **self.credentials)
+        finally:
+            os.remove(f.name)
+        batch = litellm.create_batch(completion_window=BATCH_COMPLETION_WINDOW, endpoint="/v1/chat/completions",
+                                     input_file_id=batch_file.id, custom_llm_provider=provider, **self.credentials)
+        return batch.id
+
+    def _retrieve(self, batch_id: str):
+        return litellm.retrieve_batch(batch_id=batch_id, custom_llm_provider=self.provider, **self.credentials)
+
+    def status(self, batch_id: str) -> str:
+        return self._retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> dict:
+        batch = self._retrieve(batch_id)
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = litellm.file_content(file_id=file_id, custom_llm_provider=self.provider, **self.credentials)
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                response = row.get("response") or {}
+                body = response.get("body") or {}
+                if row.get("error") or response.get("status_code", 200) >= 400 or not body.get("choices"):
+                    results[row["custom_id"]] = {"error": str(row.get("error") or body.get("error") or "no response")}
+                else:
+                    results[row["custom_id"]] = {"content": body["choices"][0]["message"]["content"],
+                                                 "usage": body.get("usage") or {}}
+        return results
+
+    def cancel(self, batch_id: str) -> None:
+        litellm.cancel_batch(batch_id=batch_id, custom_llm_provider=self.provider, **self.credentials)
+
+# Batches of LocalBatchBackend, shared by its instances in this process
+_local_batches = {}
+
+class LocalBatchBackend(BatchBackend):
+    """
+    In-process stand-in for a batch endpoint: requests are answered with litellm.completion
+    (or `respond(body)`, returning a completion response) once the batch has been polled
+    `polls` times.
+    """
+    def __init__(self, respond=None, polls: int = 1):
+        self.respond = respond or (lambda body: litellm.completion(**body))
+        self.polls = polls
+
+    def submit(self, requests: list, model: str) -> str:
+        batch_id = f"local-{uuid.uuid4().hex[:12]}"
+        _local_batches[batch_id] = {"requests": requests, "polls": 0, "status": "in_progress"}
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        batch = _local_batches[batch_id]
+        batch["polls"] += 1
+        if batch["status"] == "in_progress" and batch["polls"] >= self.polls:
+            batch["status"] = "completed"
+        return batch["status"]
+
+    def results(self, batch_id: str) -> dict:
+        results = {}
+        for request in _local_batches[batch_id]["requests"]:
+            try:
+                response = self.respond(request["body"])
+            except Exception as e:
+                results[request["custom_id"]] = {"error": str(e)}
+                continue
+            usage = getattr(response, "usage", None)
+            results[request["custom_id"]] = {
+                "content": response.choices[0].message.content,
+                "usage": {"prompt_tokens": getattr(usage, "prompt_tokens", 0), "completion_tokens": getattr(usage, "completion_tokens", 0)},
+            }
+        return results
+
+    def cancel(self, batch_id: str) -> None:
+        _local_batches[batch_id]["status"] = "cancelled"
+
+def get_batch_backend(name: str, model: str) -> BatchBackend:
+    """The batch backend `name` ("litellm" or "local") for a model."""
+    if name == "local":
+        return LocalBatchBackend()
+    if name == "litellm":
+        return LiteLLMBatchBackend(model)
+    raise ValueError(f"Unknown batch backend {name!r}, expected 'litellm' or 'local'")
+
+@contextmanager
+def _connect():
+    os.makedirs(os.path.dirname(BATCH_DB_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(BATCH_DB_PATH, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS batches (
+            batch_id TEXT PRIMARY KEY,
+            backend TEXT NOT NULL,
+            model TEXT NOT NULL,
+            fields TEXT NOT NULL,
+            pages TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def _load(batch_id: str) -> dict:
+    with _connect() as conn:
+        row = conn.execute("SELECT backend, model, fields, pages, status FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+    if row is None:
+        raise KeyError(f"Batch {batch_id} not found")
+    return {"backend": row[0], "model": row[1], "fields": json.loads(row[2]), "pages": json.loads(row[3]), "status": row[4]}
+
+def _set_status(batch_id: str, status: str) -> None:
+    with _connect() as conn:
+        conn.execute("UPDATE batches SET status = ?, updated_at = ? WHERE batch_id = ?", (status, time.time(), batch_id))
+
+def _request_body(data: str, response_format, model: str, system_message: str) -> dict:
+    params = _prepare_request(data, response_format, model, system_message)
+    params.pop("api_key", None)  # never written to the batch file
+    params["response_format"] = {"type": "json_schema", "json_schema": {
+        "name": response_format.__name__, "schema": response_format.model_json_schema()}}
+    # The batch file names the model without litellm's provider prefix
+    params["model"] = model.split("/", 1)[-1]
+    return params
+
+def submit_batch(unique_names: List[str], fields: List[str], selected_model: str, pack: bool = False,
+                 backend_name: str = None, run_stats: dict = None, budget=None) -> str:
+    """
+    Plans the extraction of stored pages (preprocessing, incremental and relevance as usual)
+    and submits it as one batch: one request per page or chunk, or, with `pack`, small pages
+    packed several to a request. Returns the batch id (see collect_batch).
+    With a budget, each page reserves its estimated usage (at batch prices) and is left out
+    of the batch if that doesn't fit; collect_batch settles the reservations.
+    """
+    container = create_listings_container_model(create_dynamic_listing_model(fields))
+    packed_container = create_packed_container_model(fields)
+    raw_pages = read_raw_data_many(unique_names)
+    page_urls = {name: row.get("url") for name, row in get_storage().read_many(unique_names, ["url"]).items()}
+    pages = preprocess_pages([(name, raw_pages[name]) for name in unique_names if raw_pages.get(name)], selected_model, run_stats)
+
+    records = {}  # unique_name -> plan and link map, to finish the pages when results arrive
+    requests = []
+    small = []
+    for name, markdown, link_map in pages:
+        plan = plan_page(page_urls.get(name), fields, raw_pages[name], markdown, selected_model, run_stats)
+        records[name] = {"key": plan["key"], "carried": plan["carried"], "link_map": link_map, "requests": [],
+                         "reserved": [0, 0.0], "error": None}
+        if not plan["markdown"].strip():
+            continue
+        if budget is not None:
+            estimate = accounting.estimate_page(plan["markdown"], selected_model)
+            reserved = [estimate["input_tokens"] + estimate["output_tokens"], estimate["cost"] * BATCH_COST_FACTOR]
+            if not budget.reserve(*reserved):
+                records[name]["error"] = "skipped: over budget"
+                _count(run_stats, "pages_skipped")
+                continue
+            records[name]["reserved"] = reserved
+        if pack and accounting.estimate_tokens(plan["markdown"], selected_model) <= PACK_MAX_PAGE_TOKENS:
+            small.append((name, plan["markdown"]))
+            continue
+        for chunk in split_markdown(plan["markdown"], chunk_budget(selected_model), selected_model):
+            custom_id = f"{len(requests)}"
+            requests.append({"custom_id": custom_id, "body": _request_body(chunk, container, selected_model, SYSTEM_MESSAGE)})
+            records[name]["requests"].append([custom_id, None])
+
+    group, group_tokens = [], 0
+    for i, (name, markdown) in enumerate(small):
+        group.append((name, markdown))
+        group_tokens += accounting.estimate_tokens(markdown, selected_model)
+        if len(group) >= PACK_MAX_PAGES or group_tokens >= PACK_TOKEN_BUDGET or i == len(small) - 1:
+            custom_id = f"{len(requests)}"
+            if len(group) == 1:
+                body = _request_body(group[0][1], container, selected_model, SYSTEM_MESSAGE)
+            else:
+                body = _request_body(packed_prompt([m for _, m in group]), packed_container, selected_model,
+                                     SYSTEM_MESSAGE + "\n" + PROMPT_PACKED_PAGES)
+            requests.append({"custom_id": custom_id, "body": body})
+            for n, (page_name, _) in enumerate(group, start=1):
+                records[page_name]["requests"].append([custom_id, n if len(group) > 1 else None])
+            group, group_tokens = [], 0
+
+    backend_name = (backend_name or os.getenv("BATCH_BACKEND") or BATCH_BACKEND).lower()
+    batch_id = get_batch_backend(backend_name, selected_model).submit(requests, selected_model) if requests else f"empty-{uuid.uuid4().hex[:12]}"
+    now = time.time()
+    with _connect() as conn:
+        conn.execute("INSERT INTO batches VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     (batch_id, backend_name, selected_model, json.dumps(fields), json.dumps(records),
+                      "in_progress" if requests else "completed", now, now))
+    print(f"INFO: Submitted batch {batch_id}: {len(requests)} requests for {len(records)} pages")
+    return batch_id
+
+def batch_status(batch_id: str) -> str:
+    """Polls the batch endpoint and records the status."""
+    batch = _load(batch_id)
+    if batch["status"] in ("completed", "failed", "expired", "cancelled", "collected"):
+        return batch["status"]
+    status = get_batch_backend(batch["backend"], batch["model"]).status(batch_id)
+    if status != batch["status"]:
+        _set_status(batch_id, status)
+    return status
+
+def cancel_batch(batch_id: str) -> None:
+    batch = _load(batch_id)
+    if batch["status"] not in ("completed", "failed", "expired", "cancelled", "collected"):
+        get_batch_backend(batch["backend"], batch["model"]).cancel(batch_id)
+        _set_status(batch_id, "cancelled")
+
+def wait_for_batch(batch_id: str, poll_interval: float, on_poll=None) -> str:
+    """Polls until the batch is finished, calling on_poll(status) each time. Returns the final status."""
+    while True:
+        status = batch_status(batch_id)
+        if on_poll:
+            on_poll(status)
+        if status in ("completed", "failed", "expired", "cancelled", "collected"):
+            return status
+        time.sleep(poll_interval)
+
+def _usage(model: str, usage: dict):
+    token_counts = {"input_tokens": usage.get("prompt_tokens", 0), "output_tokens": usage.get("completion_tokens", 0)}
+    try:
+        prompt_cost, completion_cost = litellm.cost_per_token(model=model, prompt_tokens=token_counts["input_tokens"],
+                                                              completion_tokens=token_counts["output_tokens"])
+        cost = (prompt_cost + completion_cost) * BATCH_COST_FACTOR
+    except Exception:
+        cost = 0.0
+    return token_counts, cost
+
+def collect_batch(batch_id: str, run_stats: dict = None, budget=None) -> list:
+    """
+    Validates the results of a completed batch, splits packed results back to their pages,
+    restores links, merges the listings carried over from earlier runs and saves every page
+    through save_formatted_data. Returns one {"unique_name", "parsed_data", "input_tokens",
+    "output_tokens", "cost", "error"} dict per page. Pages whose results failed, and pages
+    submit_batch skipped for the budget, are not saved. With the budget the batch was
+    submitted with, each page's reservation is settled with its actual usage.
+    """
+    batch = _load(batch_id)
+    fields, model = batch["fields"], batch["model"]
+    container = create_listings_container_model(create_dynamic_listing_model(fields))
+    packed_container = create_packed_container_model(fields)
+    needed = {custom_id for record in batch["pages"].values() for custom_id, _ in record["requests"]}
+    raw = get_batch_backend(batch["backend"], model).results(batch_id) if needed else {}
+
+    # Validate each response once; a pack's usage is split evenly between its pages
+    packed_ids = {custom_id for record in batch["pages"].values() for custom_id, n in record["requests"] if n is not None}
+    responses = {}
+    for custom_id in needed:
+        result = raw.get(custom_id) or {"error": "missing from the batch output"}
+        if "error" in result:
+            responses[custom_id] = (None, {"input_tokens": 0, "output_tokens": 0}, 0.0, result["error"])
+            continue
+        token_counts, cost = _usage(model, result["usage"])
+        try:
+            parsed = validate_response(result["content"], packed_container if custom_id in packed_ids else container, run_stats)
+            responses[custom_id] = (parsed, token_counts, cost, None)
+        except InvalidResponse as e:
+            responses[custom_id] = (None, token_counts, cost, f"invalid response: {e}")
+    pack_sizes = {}
+    for record in batch["pages"].values():
+        for custom_id, _ in record["requests"]:
+            pack_sizes[custom_id] = pack_sizes.get(custom_id, 0) + 1
+
+    pages = []
+    for name, record in batch["pages"].items():
+        page = {"unique_name": name, "parsed_data": None, "input_tokens": 0, "output_tokens": 0, "cost": 0.0,
+                "error": record.get("error")}
+        parts = []
+        for custom_id, n in record["requests"]:
+            parsed, token_counts, cost, error = responses[custom_id]
+            share = 1 / pack_sizes[custom_id]
+            page["input_tokens"] += round(token_counts["input_tokens"] * share)
+            page["output_tokens"] += round(token_counts["output_tokens"] * share)
+            page["cost"] += cost * share
+            if error:
+                page["error"] = error
+            elif n is None:
+                parts.append(parsed)
+            else:
+                listings = unpack(parsed, pack_sizes[custom_id])[n - 1]
+                if listings is None:
+                    page["error"] = "page missing from the packed response"
+                else:
+                    parts.append({"listings": listings})
+        if page["error"] is None:
+            parsed = restore_links(merge_listings(parts) if parts else {"listings": []}, record["link_map"])
+            if record["carried"] is not None:
+                parsed = merge_listings([parsed, {"listings": record["carried"]}])
+            save_formatted_data(name, parsed, record["key"])
+            page["parsed_data"] = parsed
+        elif run_stats is not None and not record.get("error"):
+            run_stats.setdefault("extraction_failures", {})[name] = page["error"]
+        if budget is not None:
+            reserved_tokens, reserved_cost = record.get("reserved", [0, 0.0])
+            budget.settle(reserved_tokens, reserved_cost, page, page["cost"])
+        for key in ("input_tokens", "output_tokens"):
+            _count(run_stats, key, page[key])
+        _count(run_stats, "total_cost", page["cost"])
+        pages.append(page)
+    get_storage().flush()
+    _set_status(batch_id, "collected")
+    return pages
@@ -0,0 +1,313 @@
+"""
+Offline throughput benchmark for the scraping pipeline.
+
+Recorded pages are served from a local HTTP server and fetched by fetch_and_store_markdowns,
+through the static HTTP path or, with --browser-only, the real crawl4ai browser. Extraction and pagination run through scrape_urls and
+paginate_urls against a deterministic fake LiteLLM backend with a configurable latency,
+and everything is stored in the SQLite stand-in for Supabase. No network, LLM or Supabase
+project is needed (only the Playwright browser for --browser-only or JS-dependent pages).
+
+For every batch size and concurrency level it reports pages/sec, p50/p95 latency per stage
+(fetch, preprocessing, chunking, LLM call, validation, storage read/write), peak Python memory
+and tokens per page:
+
+    python benchmarks/offline.py --batch-sizes 10,50 --concurrency 2,8 --llm-latency 0.2
+    python benchmarks/offline.py --corpus benchmarks/corpus --output results.json
+
+Without --corpus, a synthetic corpus of listing pages is generated. To record real pages:
+
+    python benchmarks/offline.py --record https://example.com/shop https://example.com/shop?page=2 --corpus benchmarks/corpus
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from functools import partial, wraps
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+WORKDIR = tempfile.mkdtemp(prefix="scrape-bench-")
+os.environ["STORAGE_BACKEND"] = "sqlite"
+os.environ["STORAGE_SQLITE_PATH"] = os.path.join(WORKDIR, "scraped_data.sqlite")
+
+import fetch_cache
+import llm_cache
+import llm_calls
+import markdown
+import pagination
+import preprocess
+import rate_limiter
+import scraper
+import static_fetch
+import storage
+from accounting import estimate_cost
+from assets import OPENAI_MODEL_FULLNAME, MODELS_USED
+
+MODEL = OPENAI_MODEL_FULLNAME
+FIELDS = ["title", "price"]
+LIST_ITEM = re.compile(r"^\s*[-*+]\s+(.+)$", re.M)
+PAGE_LINK = re.compile(r"\((https?://[^)\s]*page=\d+[^)\s]*)\)")
+
+# Corpus and local server
+
+def write_synthetic_corpus(directory: str, pages: int = 20, listings: int = 40) -> None:
+    """Writes `pages` shop listing pages with shared navigation, footer and numbered pagination links."""
+    os.makedirs(directory, exist_ok=True)
+    nav = "".join(f"<a href='/page-{n:03d}.html?page={n}'>{n}</a> " for n in range(1, pages + 1))
+    for page in range(1, pages + 1):
+        items = "".join(
+            f"<li><a href='/item-{page}-{i}.html'>Product {page}-{i}</a> <span>${(page * i) % 97 + 1}.99</span></li>"
+            for i in range(listings)
+        )
+        html = (
+            f"<html><head><title>Shop page {page}</title></head><body>"
+            f"<header><nav><a href='/'>Home</a> <a href='/about.html'>About</a> <a href='/contact.html'>Contact</a></nav></header>"
+            f"<h1>Shop page {page}</h1><ul>{items}</ul><div class='pagination'>{nav}</div>"
+            f"<footer>Example Shop, 1 Main Street. All rights reserved.</footer></body></html>"
+        )
+        with open(os.path.join(directory, f"page-{page:03d}.html"), "w", encoding="utf-8") as f:
+            f.write(html)
+
+def record_pages(urls: list, directory: str) -> None:
+    """Saves the HTML of live pages into the corpus directory."""
+    import httpx
+    os.makedirs(directory, exist_ok=True)
+    for i, url in enumerate(urls):
+        response = httpx.get(url, follow_redirects=True, timeout=30)
+        response.raise_for_status()
+        with open(os.path.join(directory, f"recorded-{i:03d}.html"), "w", encoding="utf-8") as f:
+            f.write(response.text)
+        print(f"INFO: Recorded {url}")
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+def serve_corpus(directory: str) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Fake LLM backend
+
+def fake_content(messages: list, response_format) -> str:
+    """Deterministic answer: list items become listings, numbered page links become page_urls."""
+    text = messages[-1]["content"]
+    if "page_urls" in getattr(response_format, "model_fields", {}):
+        return json.dumps({"page_urls": list(dict.fromkeys(PAGE_LINK.findall(text)))})
+    listings = [{field: item.strip() if i == 0 else "" for i, field in enumerate(FIELDS)}
+                for item in LIST_ITEM.findall(text)[:100]]
+    return json.dumps({"listings": listings})
+
+def fake_response(params: dict):
+    content = fake_content(params["messages"], params.get("response_format"))
+    prompt_tokens = sum(len(str(m["content"])) for m in params["messages"]) // 4
+    return SimpleNamespace(
+        model=params["model"],
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(content) // 4),
+    )
+
+def install_fake_llm(latency: float) -> None:
+    """Replaces the LiteLLM calls used by llm_calls with the fake backend."""
+    async def fake_acompletion(**params):
+        await asyncio.sleep(latency)
+        return fake_response(params)
+
+    def fake_completion(**params):
+        time.sleep(latency)
+        return fake_response(params)
+
+    def fake_completion_cost(completion_response):
+        usage = completion_response.usage
+        return estimate_cost(usage.prompt_tokens, usage.completion_tokens, completion_response.model)
+
+    llm_calls.acompletion = fake_acompletion
+    llm_calls.completion = fake_completion
+    llm_calls.completion_cost = fake_completion_cost
+    for env_var_name in MODELS_USED[MODEL]:
+        os.environ.setdefault(env_var_name, "offline-benchmark")
+    # The fake backend has no rate limits.
+    rate_limiter._limiters[MODEL] = rate_limiter.ProviderLimiter(10 ** 6, 10 ** 9)
+
+# Stage timing
+
+class StageTimer:
+    """Collects per-call durations of the instrumented functions, per stage."""
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def instrument(self, owner, name: str, stage: str) -> None:
+        original = getattr(owner, name)
+        if asyncio.iscoroutinefunction(original):
+            @wraps(original)
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    self.samples[stage].append(time.perf_counter() - start)
+        else:
+            @wraps(original)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    self.samples[stage].append(time.perf_counter() - start)
+        setattr(owner, name, timed)
+
+    def summary(self) -> dict:
+        result = {}
+        for stage, values in sorted(self.samples.items()):
+            values = sorted(values)
+            result[stage] = {
+                "calls": len(values),
+                "p50_ms": round(1000 * statistics.median(values), 2),
+                "p95_ms": round(1000 * values[min(len(values) - 1, int(0.95 * len(values)))], 2),
+            }
+        return result
+
+def instrument(timer: StageTimer) -> None:
+    timer.instrument(markdown, "crawl_page", "fetch")
+    timer.instrument(scraper, "preprocess_pages", "preprocess")
+    timer.instrument(scraper, "split_markdown", "chunking")
+    timer.instrument(scraper, "acall_llm_model", "llm_call")
+    timer.instrument(pagination, "acall_llm_model", "llm_call")
+    timer.instrument(scraper, "validate_response", "validation")
+    timer.instrument(pagination, "validate_response", "validation")
+    timer.instrument(storage.SQLiteBackend, "read_rows", "storage_read")
+    timer.instrument(storage.SQLiteBackend, "upsert_rows", "storage_write")
+
+# Benchmark runs
+
+def reset_state(run_dir: str, concurrency: int) -> None:
+    """Fresh storage, caches and concurrency limits, so every run fetches and extracts every page."""
+    if storage._storage is not None:
+        storage._storage.flush()
+    storage._storage = None
+    os.environ["STORAGE_SQLITE_PATH"] = os.path.join(run_dir, "scraped_data.sqlite")
+    llm_cache.LLM_CACHE_PATH = os.path.join(run_dir, "llm_cache.sqlite")
+    fetch_cache._memory_cache.clear()
+    preprocess._known_boilerplate.clear()
+    static_fetch._domain_modes.clear()
+    scraper.MAX_CONCURRENT_LLM_CALLS = concurrency
+    pagination.MAX_CONCURRENT_LLM_CALLS = concurrency
+
+def run_config(urls: list, concurrency: int) -> dict:
+    run_dir = tempfile.mkdtemp(dir=WORKDIR)
+    reset_state(run_dir, concurrency)
+    timer = StageTimer()
+    instrument(timer)
+    stats = {}
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        fetch_stats = {}
+        unique_names = markdown.fetch_and_store_markdowns(urls, fetch_stats, max_concurrency=concurrency, max_per_domain=concurrency)
+        fetched = time.perf_counter()
+        in_s, out_s, cost_s, _ = scraper.scrape_urls(unique_names, FIELDS, MODEL, run_stats=stats)
+        scraped = time.perf_counter()
+        in_p, out_p, cost_p, _ = pagination.paginate_urls(unique_names, MODEL, "", urls, run_stats=stats)
+        paginated = time.perf_counter()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        for owner, name in ((markdown, "crawl_page"), (scraper, "preprocess_pages"), (scraper, "split_markdown"),
+                            (scraper, "acall_llm_model"), (pagination, "acall_llm_model"),
+                            (scraper, "validate_response"), (pagination, "validate_response"),
+                            (storage.SQLiteBackend, "read_rows"), (storage.SQLiteBackend, "upsert_rows")):
+            setattr(owner, name, getattr(owner, name).__wrapped__)
+
+    pages = len(urls)
+    return {
+        "pages": pages,
+        "concurrency": concurrency,
+        "seconds": {"fetch": round(fetched - start, 3), "scrape": round(scraped - fetched, 3),
+                    "paginate": round(paginated - scraped, 3), "total": round(paginated - start, 3)},
+        "pages_per_sec": {"fetch": round(pages / (fetched - start), 2), "scrape": round(pages / (scraped - fetched), 2),
+                          "paginate": round(pages / max(paginated - scraped, 1e-9), 2), "total": round(pages / (paginated - start), 2)},
+        "stages": timer.summary(),
+        "peak_memory_mb": round(peak / 2 ** 20, 1),
+        "tokens_per_page": {"scrape": round((in_s + out_s) / pages, 1), "paginate": round((in_p + out_p) / pages, 1)},
+        "cost": round(cost_s + cost_p, 6),
+        "fetches": {"static": fetch_stats.get("static_fetches", 0), "browser": fetch_stats.get("browser_fetches", 0)},
+        "pages_detected_without_llm": stats.get("detected_pages", 0),
+        "tokens_saved_by_preprocessing": stats.get("tokens_saved", 0),
+    }
+
+def batch_urls(base_url: str, files: list, size: int) -> list:
+    """`size` distinct URLs over the corpus (a query string keeps repeated files apart)."""
+    return [f"{base_url}/{files[i % len(files)]}?copy={i}" for i in range(size)]
+
+def print_table(results: list) -> None:
+    print(f"{'pages':>6} {'conc':>5} {'pages/s':>8} {'fetch p50/p95 ms':>18} {'llm p50/p95 ms':>16} {'peak MB':>8} {'tok/page':>9}")
+    for r in results:
+        fetch = r["stages"].get("fetch", {})
+        llm = r["stages"].get("llm_call", {})
+        print(f"{r['pages']:>6} {r['concurrency']:>5} {r['pages_per_sec']['total']:>8} "
+              f"{str(fetch.get('p50_ms', '-')) + '/' + str(fetch.get('p95_ms', '-')):>18} "
+              f"{str(llm.get('p50_ms', '-')) + '/' + str(llm.get('p95_ms', '-')):>16} "
+              f"{r['peak_memory_mb']:>8} {r['tokens_per_page']['scrape'] + r['tokens_per_page']['paginate']:>9}")
+
+def _int_list(value: str) -> list:
+    return [int(item) for item in value.split(",") if item]
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark with recorded pages and a fake LLM.")
+    parser.add_argument("--corpus", help="directory of recorded .html pages (default: a generated corpus)")
+    parser.add_argument("--record", nargs="+", metavar="URL", help="record live pages into --corpus and exit")
+    parser.add_argument("--batch-sizes", type=_int_list, default=[10, 50])
+    parser.add_argument("--concurrency", type=_int_list, default=[2, 8])
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument("--browser-only", action="store_true", help="fetch every page with the browser (no static path)")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+    if args.browser_only:
+        static_fetch.STATIC_FETCH = False
+
+    if args.record:
+        if not args.corpus:
+            parser.error("--record needs --corpus")
+        record_pages(args.record, args.corpus)
+        return 0
+
+    corpus = args.corpus
+    if not corpus:
+        corpus = os.path.join(WORKDIR, "corpus")
+        write_synthetic_corpus(corpus)
+    files = sorted(name for name in os.listdir(corpus) if name.endswith(".html"))
+    if not files:
+        parser.error(f"No .html pages in {corpus}")
+
+    install_fake_llm(args.llm_latency)
+    server = serve_corpus(corpus)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    results = []
+    try:
+        for size in args.batch_sizes:
+            for concurrency in args.concurrency:
+                print(f"INFO: Benchmarking {size} pages at concurrency {concurrency}")
+                results.append(run_config(batch_urls(base_url, files, size), concurrency))
+    finally:
+        server.shutdown()
+
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"INFO: Results written to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Cold start benchmark for the Streamlit app.
+
+Every measurement runs in a fresh interpreter:
+- import time of the modules streamlit_app.py loads at startup (and which heavy
+  dependencies they pulled in),
+- first-render latency of the app and the latency of one rerun (a UI interaction),
+  through streamlit's AppTest.
+The medians are compared with a saved baseline so regressions show up:
+
+    python benchmarks/startup.py                  # measure and compare with the baseline
+    python benchmarks/startup.py --save-baseline  # record the current numbers
+
+The app runs against the SQLite storage backend, so no Supabase project is needed.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "startup_baseline.json")
+HEAVY_MODULES = ("litellm", "crawl4ai", "pandas", "supabase", "pydantic")
+
+IMPORT_SNIPPET = f"""
+import json, sys, time
+start = time.perf_counter()
+import streamlit, streamlit_tags, assets, jobs, storage
+seconds = time.perf_counter() - start
+print(json.dumps({{"import": seconds, "heavy_modules": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+RENDER_SNIPPET = """
+import json, time
+from streamlit.testing.v1 import AppTest
+start = time.perf_counter()
+app = AppTest.from_file("streamlit_app.py", default_timeout=120)
+app.run()
+first_render = time.perf_counter() - start
+start = time.perf_counter()
+app.run()
+rerun = time.perf_counter() - start
+print(json.dumps({"first_render": first_render, "rerun": rerun, "errors": [str(e.value) for e in app.exception]}))
+"""
+
+def run_snippet(snippet: str) -> dict:
+    """Runs a snippet in a fresh interpreter from the repository root and returns its JSON output."""
+    env = {**os.environ, "STORAGE_BACKEND": "sqlite"}
+    completed = subprocess.run([sys.executable, "-c", snippet], cwd=ROOT, env=env,
+                               capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def measure(runs: int) -> dict:
+    samples = {"import": [], "first_render": [], "rerun": []}
+    heavy_modules = set()
+    for _ in range(runs):
+        imported = run_snippet(IMPORT_SNIPPET)
+        samples["import"].append(imported["import"])
+        heavy_modules.update(imported["heavy_modules"])
+        rendered = run_snippet(RENDER_SNIPPET)
+        if rendered["errors"]:
+            raise RuntimeError(f"The app raised while rendering: {rendered['errors']}")
+        samples["first_render"].append(rendered["first_render"])
+        samples["rerun"].append(rendered["rerun"])
+    results = {name: round(statistics.median(values), 4) for name, values in samples.items()}
+    results["heavy_modules"] = sorted(heavy_modules)
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Returns a message for every timing that is more than `tolerance` slower than the baseline."""
+    regressions = []
+    for name in ("import", "first_render", "rerun"):
+        if name in baseline and results[name] > baseline[name] * (1 + tolerance):
+            regressions.append(f"{name}: {results[name]:.3f}s vs {baseline[name]:.3f}s baseline")
+    for module in set(results["heavy_modules"]) - set(baseline.get("heavy_modules", [])):
+        regressions.append(f"{module} is now imported at startup")
+    return regressions
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure the Streamlit app's cold start.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown over the baseline (0.25 = 25%%)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    results = measure(args.runs)
+    print(json.dumps(results, indent=2))
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"INFO: Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("INFO: No baseline yet, run with --save-baseline to record one.")
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for message in regressions:
+        print(f"WARNING: Startup regression, {message}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
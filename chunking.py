@@ -0,0 +1,112 @@
+"""
+Token-budgeted chunking of page markdown.
+
+Pages are split on heading, list-item and paragraph boundaries so every chunk fits the
+selected model's budget and no listing is cut in half if it can be avoided.
+Blocks are packed by their length (accounting.estimate_chars), so the tokenizer only runs
+once per finished chunk, to confirm it fits; a chunk the estimate got wrong is packed again
+into proportionally smaller chunks.
+"""
+import re
+from typing import List
+from litellm import token_counter
+from assets import CHUNK_RESERVED_TOKENS, DEFAULT_CHUNK_TOKENS
+from llm_calls import model_max_tokens
+from tracing import span
+import accounting
+
+BLOCK_START = re.compile(r"^(#{1,6}\s|\s{0,3}([-*+]|\d+[.)])\s)")
+LIST_START = re.compile(r"^\s{0,3}([-*+]|\d+[.)])\s")
+
+def chunk_budget(model: str) -> int:
+    """
+    Returns how many markdown tokens one request may carry for `model`:
+    the model's max tokens minus room for the prompt, schema and answer.
+    """
+    try:
+        max_tokens = model_max_tokens(model)
+    except Exception:
+        max_tokens = None
+    if not max_tokens:
+        return DEFAULT_CHUNK_TOKENS
+    return max(max_tokens - CHUNK_RESERVED_TOKENS, CHUNK_RESERVED_TOKENS)
+
+def split_blocks(markdown: str) -> List[str]:
+    """
+    Splits markdown into blocks, each starting at a heading, a list item or a paragraph
+    (a line after a blank line; indented lines after a blank line continue a list item).
+    """
+    blocks = []
+    current = []
+    after_blank = False
+    for line in markdown.splitlines(keepends=True):
+        paragraph = after_blank and line.strip() and not (line[0] in " \t" and LIST_START.match(current[0]))
+        if current and (BLOCK_START.match(line) or paragraph):
+            blocks.append("".join(current))
+            current = []
+        current.append(line)
+        after_blank = not line.strip()
+    if current:
+        blocks.append("".join(current))
+    return blocks
+
+def _split_oversized(block: str, max_chars: int) -> List[str]:
+    """Splits a single block that is longer than the budget by lines, then by characters."""
+    pieces = []
+    current, length = [], 0
+    for line in block.splitlines(keepends=True):
+        if length + len(line) <= max_chars:
+            current.append(line)
+            length += len(line)
+            continue
+        if current:
+            pieces.append("".join(current))
+        # A single huge line is cut into pieces that fit
+        while len(line) > max_chars:
+            pieces.append(line[:max_chars])
+            line = line[max_chars:]
+        current, length = [line], len(line)
+    if length:
+        pieces.append("".join(current))
+    return pieces
+
+def split_markdown(markdown: str, max_tokens: int, model: str) -> List[str]:
+    """
+    Greedily packs heading, list and paragraph blocks into chunks of at most `max_tokens` tokens.
+    Returns [markdown] unchanged when the whole page already fits.
+    """
+    with span("token_count", model=model, bytes=len(markdown)) as s:
+        chunks = _pack_blocks(markdown, max_tokens, model)
+        s.set(chunks=len(chunks))
+    return chunks
+
+def _pack_blocks(markdown: str, max_tokens: int, model: str, max_chars: int = None) -> List[str]:
+    if max_chars is None:
+        max_chars = accounting.estimate_chars(max_tokens, model)
+    chunks = []
+    for chunk in _pack_chars(markdown, max_chars):
+        tokens = token_counter(model=model, text=chunk)
+        if tokens <= max_tokens or len(chunk) <= 1:
+            chunks.append(chunk)
+        else:
+            # Denser text than estimated: pack it again to a length that is under the budget
+            chunks += _pack_blocks(chunk, max_tokens, model, max(1, len(chunk) * max_tokens // tokens - 1))
+    return chunks
+
+def _pack_chars(markdown: str, max_chars: int) -> List[str]:
+    """Greedily packs blocks into chunks of at most `max_chars` characters."""
+    if len(markdown) <= max_chars:
+        return [markdown]
+    chunks = []
+    current, length = [], 0
+    for block in split_blocks(markdown):
+        pieces = _split_oversized(block, max_chars) if len(block) > max_chars else [block]
+        for piece in pieces:
+            if current and length + len(piece) > max_chars:
+                chunks.append("".join(current))
+                current, length = [], 0
+            current.append(piece)
+            length += len(piece)
+    if current:
+        chunks.append("".join(current))
+    return chunks
@@ -0,0 +1,226 @@
+"""
+Command-line interface for the job service.
+
+Examples:
+    python cli.py run https://example.com/shop --field title --field price --pagination
+    python cli.py run https://example.com/a https://example.com/b --field title --batch-api --pack
+    python cli.py estimate https://example.com/shop --field title
+    python cli.py list
+    python cli.py status <job_id>
+    python cli.py cancel <job_id>
+    python cli.py export <job_id> --format csv --output listings.csv
+    python cli.py batch <batch_id> --wait
+    python cli.py relevance <job_id>
+    python cli.py worker --processes 4
+    python cli.py serve --port 8000
+"""
+import argparse
+import json
+import sys
+from assets import (MODELS_USED, OPENAI_MODEL_FULLNAME, CRAWL_MAX_PAGES, FETCH_PROFILES, WORKER_BATCH_SIZE,
+                    WORKER_LEASE_SECONDS, RELEVANCE_TOKEN_BUDGET, BATCH_POLL_INTERVAL)
+from jobs import JobStore, get_job_runner
+
+def _print_progress(job):
+    progress = job["progress"] or {}
+    extra = ", ".join(f"{k}={v}" for k, v in progress.items() if k != "stage")
+    print(f"[{job['id']}] {job['status']}: {progress.get('stage', '')} {extra}".rstrip(), file=sys.stderr)
+
+def _job_params(args):
+    return {
+        "urls": args.urls,
+        "model": args.model,
+        "fields": args.field,
+        "use_pagination": args.pagination or args.follow,
+        "pagination_details": args.pagination_details,
+        "follow_pagination": args.follow,
+        "max_pages": args.max_pages,
+        "use_templates": args.templates,
+        "fetch_profile": args.fetch_profile,
+        "distributed": args.distributed,
+        "pack_pages": args.pack,
+        "batch_api": args.batch_api,
+        "max_tokens": args.max_tokens,
+        "max_cost": args.max_cost,
+    }
+
+def cmd_run(args):
+    runner = get_job_runner()
+    job_id = runner.submit(_job_params(args))
+    print(f"Submitted job {job_id}", file=sys.stderr)
+    try:
+        job = runner.wait(job_id, on_progress=_print_progress)
+    except KeyboardInterrupt:
+        runner.store.request_cancel(job_id)
+        job = runner.wait(job_id)
+    if job["status"] != "completed":
+        print(f"Job {job_id} {job['status']}: {job['error'] or ''}", file=sys.stderr)
+        return 1
+    json.dump(job["results"], sys.stdout, indent=4, default=str)
+    print()
+    return 0
+
+def cmd_estimate(args):
+    from accounting import estimate_job
+    params = _job_params(args)
+    calls = bool(params["fields"]) + bool(params["use_pagination"])
+    json.dump(estimate_job(params["urls"], params["model"], max(calls, 1)), sys.stdout, indent=4)
+    print()
+    return 0
+
+def cmd_list(args):
+    for job in JobStore().list(args.limit):
+        _print_progress(job)
+    return 0
+
+def cmd_status(args):
+    job = JobStore().get(args.job_id)
+    if job is None:
+        print(f"Job {args.job_id} not found", file=sys.stderr)
+        return 1
+    json.dump(job if args.full else {k: job[k] for k in ("id", "status", "progress", "error")}, sys.stdout, indent=4, default=str)
+    print()
+    return 0
+
+def cmd_cancel(args):
+    if not JobStore().request_cancel(args.job_id):
+        print(f"Job {args.job_id} is not pending or running", file=sys.stderr)
+        return 1
+    print(f"Cancellation requested for {args.job_id}", file=sys.stderr)
+    return 0
+
+def cmd_export(args):
+    import export
+    job = JobStore().get(args.job_id)
+    if job is None or not job["results"]:
+        print(f"Job {args.job_id} not found or has no results", file=sys.stderr)
+        return 1
+    columns = job["params"].get("fields") if args.kind == "listings" else None
+    count = export.export(export.result_unique_names(job["results"], args.kind), args.format, args.output, args.kind, columns)
+    print(f"Exported {count} rows", file=sys.stderr)
+    return 0
+
+def cmd_batch(args):
+    import batching
+    try:
+        if args.cancel:
+            batching.cancel_batch(args.batch_id)
+        status = batching.batch_status(args.batch_id)
+        if args.wait:
+            status = batching.wait_for_batch(args.batch_id, args.poll_interval,
+                                             lambda status: print(f"[{args.batch_id}] {status}", file=sys.stderr))
+    except KeyError as e:
+        print(e.args[0], file=sys.stderr)
+        return 1
+    summary = {"batch_id": args.batch_id, "status": status}
+    if status == "completed":
+        run_stats = {}
+        pages = batching.collect_batch(args.batch_id, run_stats)
+        summary.update({"pages": [{key: page[key] for key in ("unique_name", "error")} for page in pages],
+                        **{key: run_stats.get(key, 0) for key in ("input_tokens", "output_tokens", "total_cost")}})
+    json.dump(summary, sys.stdout, indent=4)
+    print()
+    return 0 if status in ("completed", "collected", "in_progress", "validating", "finalizing") else 1
+
+def cmd_relevance(args):
+    import export
+    from relevance import recall_report
+    job = JobStore().get(args.job_id)
+    if job is None or not job["results"] or not job["params"].get("fields"):
+        print(f"Job {args.job_id} not found or has no extracted listings", file=sys.stderr)
+        return 1
+    report = recall_report(export.result_unique_names(job["results"]), job["params"]["fields"], job["params"]["model"],
+                           args.budget)
+    if not args.full:
+        report.pop("per_page")
+    json.dump(report, sys.stdout, indent=4)
+    print()
+    return 0
+
+def cmd_worker(args):
+    from worker import run_workers
+    run_workers(args.processes, worker_id=args.worker_id, batch_size=args.batch_size,
+                lease_seconds=args.lease, once=args.once)
+    return 0
+
+def cmd_serve(args):
+    import uvicorn
+    uvicorn.run("api:app", host=args.host, port=args.port)
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="TRAI SpiderMIND job runner")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run a scraping job and print its results (saved pages, totals, details) as JSON")
+    estimate = commands.add_parser("estimate", help="predict a job's tokens and cost without running it")
+    for command in (run, estimate):
+        command.add_argument("urls", nargs="+")
+        command.add_argument("--model", default=OPENAI_MODEL_FULLNAME, choices=list(MODELS_USED))
+        command.add_argument("--field", action="append", default=[], help="field to extract (repeatable)")
+        command.add_argument("--pagination", action="store_true", help="detect pagination URLs")
+        command.add_argument("--pagination-details", default="")
+        command.add_argument("--follow", action="store_true", help="also fetch and scrape the discovered page URLs")
+        command.add_argument("--max-pages", type=int, default=CRAWL_MAX_PAGES)
+        command.add_argument("--fetch-profile", default=None, choices=list(FETCH_PROFILES),
+                             help="browser fetch profile (default: FETCH_PROFILE; domains in DOMAIN_FETCH_PROFILES keep theirs)")
+        command.add_argument("--templates", action="store_true", help="learn CSS selectors per site and skip the LLM on its other pages")
+        command.add_argument("--max-tokens", type=int, default=None, help="token budget; pages beyond it are skipped")
+        command.add_argument("--max-cost", type=float, default=None, help="cost budget in USD; pages beyond it are skipped")
+        command.add_argument("--distributed", action="store_true", help="queue the URLs for worker processes (see the worker command)")
+        command.add_argument("--pack", action="store_true", help="extract several small pages per LLM request")
+        command.add_argument("--batch-api", action="store_true",
+                             help="extract through the provider's batch API (cheaper, results within hours; no pagination)")
+    run.set_defaults(func=cmd_run)
+    estimate.set_defaults(func=cmd_estimate)
+
+    list_jobs = commands.add_parser("list", help="list recent jobs")
+    list_jobs.add_argument("--limit", type=int, default=20)
+    list_jobs.set_defaults(func=cmd_list)
+
+    status = commands.add_parser("status", help="show a job")
+    status.add_argument("job_id")
+    status.add_argument("--full", action="store_true", help="include parameters and results")
+    status.set_defaults(func=cmd_status)
+
+    cancel = commands.add_parser("cancel", help="cancel a pending or running job")
+    cancel.add_argument("job_id")
+    cancel.set_defaults(func=cmd_cancel)
+
+    export_job = commands.add_parser("export", help="export a job's listings or page URLs from storage")
+    export_job.add_argument("job_id")
+    export_job.add_argument("--format", default="csv", choices=["csv", "jsonl", "parquet"])
+    export_job.add_argument("--kind", default="listings", choices=["listings", "pagination"])
+    export_job.add_argument("--output", default="-", help="output file (default: stdout, not for parquet)")
+    export_job.set_defaults(func=cmd_export)
+
+    batch = commands.add_parser("batch", help="show a provider batch and save its results once it is completed")
+    batch.add_argument("batch_id")
+    batch.add_argument("--wait", action="store_true", help="poll until the batch is finished")
+    batch.add_argument("--poll-interval", type=float, default=BATCH_POLL_INTERVAL)
+    batch.add_argument("--cancel", action="store_true", help="cancel the batch")
+    batch.set_defaults(func=cmd_batch)
+
+    relevance = commands.add_parser("relevance", help="measure the relevance filter's recall on a finished job's listings")
+    relevance.add_argument("job_id")
+    relevance.add_argument("--budget", type=int, default=RELEVANCE_TOKEN_BUDGET, help="token budget to measure")
+    relevance.add_argument("--full", action="store_true", help="include per-page results")
+    relevance.set_defaults(func=cmd_relevance)
+
+    work = commands.add_parser("worker", help="claim and scrape queued URLs of distributed jobs")
+    work.add_argument("--processes", type=int, default=1, help="worker processes to start on this machine")
+    work.add_argument("--worker-id", default=None, help="worker name (default: host-pid-random; suffixed with -<n> per process)")
+    work.add_argument("--batch-size", type=int, default=WORKER_BATCH_SIZE, help="URLs claimed at a time")
+    work.add_argument("--lease", type=float, default=WORKER_LEASE_SECONDS, help="lease length in seconds")
+    work.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    work.set_defaults(func=cmd_worker)
+
+    serve = commands.add_parser("serve", help="start the FastAPI app")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8000)
+    serve.set_defaults(func=cmd_serve)
+    return parser
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    sys.exit(args.func(args))
@@ -0,0 +1,148 @@
+"""
+Streaming export of scraped results from storage.
+
+Rows are read from scraped_data EXPORT_CHUNK_PAGES pages at a time and written as they
+come, so an export never holds more than one chunk in memory:
+- listings (formatted_data) -> CSV, JSONL or Parquet,
+- pagination URLs (pagination_data) -> CSV, JSONL or Parquet.
+The Streamlit app previews results one page of rows at a time, and cli.py exports a job:
+
+    python cli.py export <job_id> --format parquet --output listings.parquet
+"""
+import csv
+import json
+import os
+import sys
+from itertools import chain, islice
+from storage import get_storage
+from assets import EXPORT_CHUNK_PAGES, EXPORT_BATCH_ROWS, EXPORT_PREVIEW_ROWS, EXPORT_DIR
+
+FORMATS = ("csv", "jsonl", "parquet")
+KINDS = {"listings": "formatted_data", "pagination": "pagination_data"}
+
+def _parse(value):
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return {"raw_text": value}
+    return value
+
+def _rows_of(kind: str, value) -> list:
+    """Flattens one stored formatted_data or pagination_data value into table rows."""
+    value = _parse(value)
+    if kind == "pagination":
+        if isinstance(value, dict) and isinstance(value.get("page_urls"), list):
+            return [{"page_url": page_url} for page_url in value["page_urls"]]
+    elif isinstance(value, dict) and isinstance(value.get("listings"), list):
+        return [dict(listing) for listing in value["listings"] if isinstance(listing, dict)]
+    return [value] if isinstance(value, dict) else []
+
+def row_count(kind: str, value) -> int:
+    """How many rows one page's formatted_data or pagination_data exports to."""
+    if hasattr(value, "model_dump"):
+        value = value.model_dump()
+    return len(_rows_of(kind, value))
+
+def result_unique_names(results: dict, kind: str = "listings") -> list:
+    """The unique_names of the pages of a job's results (see jobs.py), in result order."""
+    items = results.get("data") if kind == "listings" else results.get("pagination_info")
+    return [item["unique_name"] for item in items or [] if isinstance(item, dict) and item.get("unique_name")]
+
+def iter_rows(unique_names: list, kind: str = "listings", chunk_pages: int = EXPORT_CHUNK_PAGES):
+    """Yields the rows of the given pages in order, reading storage one chunk of pages at a time."""
+    column = KINDS[kind]
+    unique_names = list(dict.fromkeys(unique_names))
+    for start in range(0, len(unique_names), chunk_pages):
+        names = unique_names[start:start + chunk_pages]
+        stored = get_storage().read_many(names, [column])
+        for name in names:
+            yield from _rows_of(kind, stored.get(name, {}).get(column))
+
+def preview(unique_names: list, kind: str = "listings", page: int = 1, page_size: int = EXPORT_PREVIEW_ROWS):
+    """
+    Returns (rows, has_more) for one page of rows (1-based), reading only the pages
+    of storage needed to reach it.
+    """
+    rows = list(islice(iter_rows(unique_names, kind), (page - 1) * page_size, page * page_size + 1))
+    return rows[:page_size], len(rows) > page_size
+
+def _columns(first_rows: list, columns: list = None) -> list:
+    if columns:
+        return list(columns)
+    return list(dict.fromkeys(key for row in first_rows for key in row))
+
+def _cell(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+
+def write_csv(rows, f, columns: list = None) -> int:
+    """
+    Writes rows to a text file as CSV. Without `columns`, the header is taken from the
+    first chunk of rows (keys that only appear later are dropped).
+    """
+    rows = iter(rows)
+    head = list(islice(rows, EXPORT_BATCH_ROWS))
+    writer = csv.DictWriter(f, fieldnames=_columns(head, columns), extrasaction="ignore")
+    writer.writeheader()
+    count = 0
+    for row in chain(head, rows):
+        writer.writerow({key: _cell(value) for key, value in row.items()})
+        count += 1
+    return count
+
+def write_jsonl(rows, f) -> int:
+    """Writes one JSON object per line to a text file."""
+    count = 0
+    for row in rows:
+        f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+def write_parquet(rows, path: str, columns: list = None) -> int:
+    """
+    Writes rows to a Parquet file in row groups of EXPORT_BATCH_ROWS, all columns
+    as strings. Requires pyarrow.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+    rows = iter(rows)
+    batch = list(islice(rows, EXPORT_BATCH_ROWS))
+    columns = _columns(batch, columns)
+    schema = pa.schema([(column, pa.string()) for column in columns])
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        while batch:
+            table = {column: [_cell(row.get(column)) for row in batch] for column in columns}
+            writer.write_table(pa.Table.from_pydict(table, schema=schema))
+            count += len(batch)
+            batch = list(islice(rows, EXPORT_BATCH_ROWS))
+    return count
+
+def export(unique_names: list, fmt: str, path: str, kind: str = "listings", columns: list = None) -> int:
+    """Exports the rows of the given pages to `path` ("-" for stdout, not for Parquet). Returns the row count."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {FORMATS}")
+    rows = iter_rows(unique_names, kind)
+    if path == "-":
+        if fmt == "parquet":
+            raise ValueError("Parquet can't be written to stdout, give an output file")
+        return write_csv(rows, sys.stdout, columns) if fmt == "csv" else write_jsonl(rows, sys.stdout)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if fmt == "parquet":
+        return write_parquet(rows, path, columns)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        return write_csv(rows, f, columns) if fmt == "csv" else write_jsonl(rows, f)
+
+def export_job_file(job_id: str, results: dict, fmt: str, kind: str = "listings", columns: list = None) -> str:
+    """Exports a job's results once to EXPORT_DIR and returns the file path (reused on later calls)."""
+    path = os.path.join(EXPORT_DIR, f"{job_id}_{kind}.{fmt}")
+    if not os.path.exists(path):
+        partial = path + ".part"
+        export(result_unique_names(results, kind), fmt, partial, kind, columns)
+        os.replace(partial, path)
+    return path
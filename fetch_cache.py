@@ -0,0 +1,103 @@
+"""
+URL-keyed cache for raw page markdown.
+
+Entries live in the scraped_data table (url_key, etag, last_modified, fetched_at columns)
+with a small LRU tier in front of it, so repeated launches reuse pages that were
+fetched recently instead of opening the browser again.
+"""
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timezone
+import httpx
+from storage import get_storage
+from assets import RAW_DATA_CACHE_TTL, RAW_DATA_CACHE_MAX_ENTRIES, REVALIDATION_TIMEOUT
+from utils import normalize_url
+
+_memory_cache = OrderedDict()
+
+def _remember(url_key: str, entry: dict) -> None:
+    _memory_cache[url_key] = entry
+    _memory_cache.move_to_end(url_key)
+    while len(_memory_cache) > RAW_DATA_CACHE_MAX_ENTRIES:
+        _memory_cache.popitem(last=False)
+
+def _header(headers: dict, name: str):
+    for key, value in (headers or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+def lookup(url: str):
+    """
+    Returns the newest cached entry for a URL, or None.
+    An entry is a dict with unique_name, raw_data, fetched_at, etag and last_modified.
+    """
+    url_key = normalize_url(url)
+    if url_key in _memory_cache:
+        _memory_cache.move_to_end(url_key)
+        return _memory_cache[url_key]
+    entry = get_storage().find_latest("url_key", url_key, ["raw_data", "fetched_at", "etag", "last_modified"], "fetched_at")
+    if not entry or not entry.get("raw_data"):
+        return None
+    _remember(url_key, entry)
+    return entry
+
+def is_fresh(entry: dict, ttl: int = RAW_DATA_CACHE_TTL) -> bool:
+    """True if the entry was fetched (or revalidated) less than `ttl` seconds ago."""
+    if not entry or not entry.get("fetched_at"):
+        return False
+    fetched_at = datetime.fromisoformat(entry["fetched_at"])
+    return (datetime.now(timezone.utc) - fetched_at).total_seconds() < ttl
+
+def cache_columns(url: str, headers: dict = None) -> dict:
+    """
+    Builds the cache columns stored next to raw_data for a freshly fetched page.
+    """
+    return {
+        "url_key": normalize_url(url),
+        "etag": _header(headers, "etag"),
+        "last_modified": _header(headers, "last-modified"),
+        "fetched_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+def store(url: str, unique_name: str, raw_data: str, columns: dict) -> None:
+    """
+    Puts a freshly saved page in the in-process tier.
+    """
+    _remember(columns["url_key"], {
+        "unique_name": unique_name,
+        "raw_data": raw_data,
+        "fetched_at": columns["fetched_at"],
+        "etag": columns["etag"],
+        "last_modified": columns["last_modified"],
+    })
+
+def touch(url: str, entry: dict) -> None:
+    """
+    Marks a revalidated entry as fresh again, both in memory and in storage.
+    """
+    entry["fetched_at"] = datetime.now(timezone.utc).isoformat()
+    get_storage().write(entry["unique_name"], {"fetched_at": entry["fetched_at"]})
+    _remember(normalize_url(url), entry)
+
+async def revalidate_async(items: list) -> list:
+    """
+    Sends conditional GETs (If-None-Match / If-Modified-Since) for (url, entry) pairs.
+    Returns a list of booleans, True where the server answered 304 Not Modified.
+    """
+    async with httpx.AsyncClient(follow_redirects=True, timeout=REVALIDATION_TIMEOUT) as client:
+        async def check(url, entry):
+            headers = {}
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+            if not headers:
+                return False
+            try:
+                response = await client.get(url, headers=headers)
+            except httpx.HTTPError:
+                return False
+            return response.status_code == 304
+
+        return await asyncio.gather(*(check(url, entry) for url, entry in items))
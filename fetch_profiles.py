@@ -0,0 +1,98 @@
+"""
+Named browser fetch profiles (FETCH_PROFILES in assets.py).
+
+A profile sets how pages are loaded in the crawl4ai browser:
+- resource types that are never downloaded (images, media, fonts, ...) and, optionally,
+  every request to another site (ads, analytics, widgets),
+- the page-load timeout and how long page scripts (scrolling) may run (TIMEOUT_SETTINGS
+  unless the profile overrides them),
+- a CSS selector to wait for before the page is read, instead of a fixed delay,
+- adaptive scrolling for infinite-scroll pages: scroll to the bottom until the page stops
+  growing for NUMBER_SCROLL rounds in a row (at most FETCH_MAX_SCROLLS rounds).
+The profile of a URL is its domain's (DOMAIN_FETCH_PROFILES), else the job's, else FETCH_PROFILE.
+"""
+from utils import get_domain
+from assets import (FETCH_PROFILES, FETCH_PROFILE, DOMAIN_FETCH_PROFILES, TIMEOUT_SETTINGS, NUMBER_SCROLL,
+                    FETCH_MAX_SCROLLS, FETCH_SCROLL_DELAY)
+
+def _site(host: str) -> str:
+    """Last two labels of a host ("shop.example.com" -> "example.com"), to tell first- from third-party requests."""
+    return ".".join(host.split(":")[0].split(".")[-2:])
+
+def resolve_profile(url: str, name: str = None) -> dict:
+    """The fetch profile for a URL, with its name and timeouts filled in."""
+    domain = get_domain(url)
+    name = DOMAIN_FETCH_PROFILES.get(domain) or DOMAIN_FETCH_PROFILES.get(_site(domain)) or name or FETCH_PROFILE
+    if name not in FETCH_PROFILES:
+        print(f"WARNING: Unknown fetch profile {name!r}, using {FETCH_PROFILE!r}")
+        name = FETCH_PROFILE
+    return {"name": name, "block": [], "block_third_party": False, "wait_for": None, "scroll": False,
+            **TIMEOUT_SETTINGS, **FETCH_PROFILES[name]}
+
+def allows_static(profile: dict) -> bool:
+    """Infinite-scroll pages only have their first screen in the HTML, so they always need the browser."""
+    return not profile["scroll"]
+
+def has_content(profile: dict, html: str) -> bool:
+    """False if the profile waits for a selector that the (static) HTML doesn't contain yet."""
+    if not profile["wait_for"]:
+        return True
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html, "html.parser").select_one(profile["wait_for"]) is not None
+
+def scroll_script(profile: dict) -> str:
+    """
+    JavaScript that scrolls until the page height stops changing, within the profile's script timeout.
+    crawl4ai runs js_code as the body of an async function and awaits it, so the loop uses
+    top-level awaits: the page is read only once scrolling has finished.
+    """
+    return f"""
+const deadline = Date.now() + {profile["script"] * 1000};
+let height = document.body.scrollHeight, unchanged = 0;
+for (let i = 0; i < {FETCH_MAX_SCROLLS} && unchanged < {NUMBER_SCROLL} && Date.now() < deadline; i++) {{
+    window.scrollTo(0, document.body.scrollHeight);
+    await new Promise(resolve => setTimeout(resolve, {int(FETCH_SCROLL_DELAY * 1000)}));
+    if (document.body.scrollHeight > height) {{
+        height = document.body.scrollHeight;
+        unchanged = 0;
+    }} else {{
+        unchanged += 1;
+    }}
+}}
+"""
+
+def run_config(url: str, profile: dict):
+    """The crawl4ai CrawlerRunConfig for one URL under a profile."""
+    from crawl4ai import CrawlerRunConfig
+    options = {
+        "page_timeout": int(profile["page_load"] * 1000),
+        "shared_data": {"fetch_profile": profile, "site": _site(get_domain(url))},
+    }
+    if profile["wait_for"]:
+        options["wait_for"] = f"css:{profile['wait_for']}"
+    if profile["scroll"]:
+        options["js_code"] = scroll_script(profile)
+    return CrawlerRunConfig(**options)
+
+async def block_resources(page, context=None, config=None, **kwargs):
+    """
+    crawl4ai on_page_context_created hook: aborts the requests the page's profile blocks.
+    The main document is always loaded.
+    """
+    shared = getattr(config, "shared_data", None) or {}
+    profile = shared.get("fetch_profile")
+    if not profile or not (profile["block"] or profile["block_third_party"]):
+        return page
+    blocked = set(profile["block"])
+
+    async def handle(route):
+        request = route.request
+        if request.resource_type != "document" and (
+                request.resource_type in blocked
+                or (profile["block_third_party"] and _site(get_domain(request.url)) != shared["site"])):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    await page.route("**/*", handle)
+    return page
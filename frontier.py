@@ -0,0 +1,136 @@
+"""
+Multi-page crawl scheduler.
+
+Starting from the seed URLs, every wave is fetched, extracted and paginated; the page URLs
+discovered by paginate_urls are fed back into a deduplicated frontier until the depth or
+page limit is reached. Results are streamed back wave by wave.
+"""
+import json
+from collections import deque
+from typing import List
+from assets import CRAWL_MAX_PAGES, CRAWL_MAX_DEPTH, CRAWL_DOMAIN_DELAY, CRAWL_MAX_PER_DOMAIN
+from markdown import fetch_and_store_markdowns
+from scraper import scrape_urls
+from pagination import paginate_urls
+from utils import normalize_url
+
+class CrawlFrontier:
+    """
+    FIFO of (url, depth) pairs that accepts every normalized URL once,
+    up to `max_pages` URLs in total and `max_depth` levels below the seeds.
+    """
+    def __init__(self, max_pages: int = CRAWL_MAX_PAGES, max_depth: int = CRAWL_MAX_DEPTH):
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.seen = set()
+        self.queue = deque()
+
+    def add(self, url: str, depth: int) -> bool:
+        """Queues a URL unless it was seen before or a limit is reached. Returns True if queued."""
+        key = normalize_url(url)
+        if key in self.seen or depth > self.max_depth or len(self.seen) >= self.max_pages:
+            return False
+        self.seen.add(key)
+        self.queue.append((url, depth))
+        return True
+
+    def next_wave(self) -> list:
+        """Pops every queued URL at the shallowest queued depth."""
+        if not self.queue:
+            return []
+        depth = self.queue[0][1]
+        wave = []
+        while self.queue and self.queue[0][1] == depth:
+            wave.append(self.queue.popleft())
+        return wave
+
+def _page_urls(pagination_data) -> list:
+    if hasattr(pagination_data, "model_dump"):
+        pagination_data = pagination_data.model_dump()
+    if isinstance(pagination_data, str):
+        try:
+            pagination_data = json.loads(pagination_data)
+        except json.JSONDecodeError:
+            return []
+    if isinstance(pagination_data, dict):
+        return [url for url in pagination_data.get("page_urls", []) if isinstance(url, str)]
+    return []
+
+def crawl_paginated(urls: List[str], fields: List[str], selected_model: str, indication: str = "",
+                    max_pages: int = CRAWL_MAX_PAGES, max_depth: int = CRAWL_MAX_DEPTH,
+                    domain_delay: float = CRAWL_DOMAIN_DELAY, max_per_domain: int = CRAWL_MAX_PER_DOMAIN,
+                    run_stats: dict = None, budget=None, use_templates: bool = False, fetch_profile: str = None,
+                    pack_pages: bool = False):
+    """
+    Crawls the seed URLs and the pagination URLs discovered on them, wave by wave.
+    Listings are extracted when `fields` is non-empty. Yields one dict per page:
+    {"url", "unique_name", "depth", "parsed_data", "pagination_data"}.
+    Token and cost totals accumulate in run_stats (input_tokens, output_tokens, total_cost), the
+    pagination share of them in pagination_input_tokens, pagination_output_tokens and pagination_cost.
+    With an accounting.Budget, every page reserves its estimated extraction and pagination usage
+    and is skipped if that doesn't fit, and no new wave is started once the budget is exhausted.
+    With use_templates, pages of a site already seen are extracted with its learned template (see wrappers.py).
+    Pages are loaded in the browser under `fetch_profile` (see fetch_profiles.py).
+    With pack_pages, small pages are extracted several to a request (see batching.py).
+    """
+    run_stats = run_stats if run_stats is not None else {}
+    for key in ("input_tokens", "output_tokens", "total_cost", "pages_crawled",
+                "pagination_input_tokens", "pagination_output_tokens", "pagination_cost"):
+        run_stats.setdefault(key, 0)
+
+    frontier = CrawlFrontier(max_pages, max_depth)
+    for url in urls:
+        frontier.add(url, 0)
+
+    while True:
+        wave = frontier.next_wave()
+        if not wave:
+            break
+        if budget is not None and budget.exhausted():
+            not_crawled = len(wave) + len(frontier.queue)
+            run_stats["pages_skipped"] = run_stats.get("pages_skipped", 0) + not_crawled
+            print(f"WARNING: Budget exhausted, {not_crawled} queued pages not crawled")
+            break
+        wave_urls = [url for url, _ in wave]
+        depth = wave[0][1]
+        print(f"INFO: Crawling {len(wave_urls)} pages at depth {depth}")
+
+        fetch_stats = {}
+        unique_names = fetch_and_store_markdowns(wave_urls, run_stats=fetch_stats,
+                                                 max_per_domain=max_per_domain, domain_delay=domain_delay, profile=fetch_profile,
+                                                 keep_html=use_templates and bool(fields))
+        run_stats.setdefault("failures", {}).update(fetch_stats.get("failures", {}))
+
+        parsed_by_name = {}
+        if fields:
+            in_tokens, out_tokens, cost, parsed_results = scrape_urls(unique_names, fields, selected_model, run_stats=run_stats,
+                                                                 use_templates=use_templates, pack_pages=pack_pages, budget=budget)
+            run_stats["input_tokens"] += in_tokens
+            run_stats["output_tokens"] += out_tokens
+            run_stats["total_cost"] += cost
+            parsed_by_name = {item["unique_name"]: item["parsed_data"] for item in parsed_results}
+
+        pagination_by_name = {}
+        if depth < max_depth:
+            in_tokens, out_tokens, cost, page_results = paginate_urls(unique_names, selected_model, indication, wave_urls,
+                                                                      run_stats=run_stats, budget=budget)
+            run_stats["input_tokens"] += in_tokens
+            run_stats["output_tokens"] += out_tokens
+            run_stats["total_cost"] += cost
+            run_stats["pagination_input_tokens"] += in_tokens
+            run_stats["pagination_output_tokens"] += out_tokens
+            run_stats["pagination_cost"] += cost
+            pagination_by_name = {item["unique_name"]: item["pagination_data"] for item in page_results}
+            for pagination_data in pagination_by_name.values():
+                for page_url in _page_urls(pagination_data):
+                    frontier.add(page_url, depth + 1)
+
+        for url, unique_name in zip(wave_urls, unique_names):
+            run_stats["pages_crawled"] += 1
+            yield {
+                "url": url,
+                "unique_name": unique_name,
+                "depth": depth,
+                "parsed_data": parsed_by_name.get(unique_name),
+                "pagination_data": pagination_by_name.get(unique_name),
+            }
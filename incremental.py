@@ -0,0 +1,94 @@
+"""
+Incremental re-extraction of pages that were extracted before.
+
+Every saved extraction is tagged with an extraction_key (URL + fields), so the row with the
+newest fetched_at for that key holds the markdown and listings of the last run. On the next run
+- the new markdown is diffed against it block by block (headings, list items and paragraphs),
+- only the added or changed blocks are sent to the model,
+- the previous listings whose values are still on the page, outside the changed blocks, are
+  merged back in (a listing whose block changed is re-extracted from it instead).
+Link targets are ignored when blocks are compared, so renumbered link:// tokens don't count
+as changes. Pages that changed too much (INCREMENTAL_MAX_CHANGE_RATIO) are extracted in full.
+"""
+import hashlib
+import json
+from collections import Counter
+from typing import List
+from chunking import split_blocks
+from preprocess import LINK_TOKEN, URL_PATTERN
+from storage import get_storage
+import accounting
+from utils import normalize_url
+from assets import INCREMENTAL_EXTRACTION, INCREMENTAL_MAX_CHANGE_RATIO, INCREMENTAL_MATCH_RATIO
+
+def extraction_key(url: str, fields: List[str]):
+    """Identifies the extractions of one URL with one set of fields (None without a URL)."""
+    if not url:
+        return None
+    payload = json.dumps([normalize_url(url), sorted(fields)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+def _normalize(text: str) -> str:
+    text = LINK_TOKEN.sub("", URL_PATTERN.sub("", text))
+    return " ".join(text.lower().split())
+
+def changed_blocks(previous_markdown: str, markdown: str) -> list:
+    """Blocks of `markdown` that don't appear (as often) in `previous_markdown`, in page order."""
+    remaining = Counter(_normalize(block) for block in split_blocks(previous_markdown))
+    changed = []
+    for block in split_blocks(markdown):
+        key = _normalize(block)
+        if remaining[key] > 0:
+            remaining[key] -= 1
+        elif key:
+            changed.append(block)
+    return changed
+
+def _still_listed(listing: dict, page_text: str, changed_text: str) -> bool:
+    values = [_normalize(str(value)) for value in listing.values()]
+    values = [value for value in values if len(value) >= 4]
+    if not values:
+        return True
+    # A value found only in changed blocks means the listing itself changed
+    if any(value in changed_text and page_text.count(value) <= changed_text.count(value) for value in values):
+        return False
+    return sum(value in page_text for value in values) >= INCREMENTAL_MATCH_RATIO * len(values)
+
+def carried_listings(previous_listings: list, raw_data: str, changed: List[str] = ()) -> list:
+    """
+    Previous listings whose values are (mostly) still present in the new page, leaving out
+    those with a value that only appears in the `changed` blocks (they are re-extracted).
+    """
+    page_text = _normalize(raw_data)
+    changed_text = "\n".join(_normalize(block) for block in changed)
+    return [listing for listing in previous_listings
+            if isinstance(listing, dict) and _still_listed(listing, page_text, changed_text)]
+
+def plan_extraction(url: str, fields: List[str], raw_data: str, markdown: str, model: str, run_stats: dict = None) -> dict:
+    """
+    Decides what to send to the model for one preprocessed page. Returns a dict with
+    "key" (the extraction_key to save with the result), "markdown" (the text to extract) and
+    "carried" (previous listings to merge into the result, or None for a full extraction).
+    If run_stats is given, incremental_pages and incremental_tokens_saved are recorded in it.
+    """
+    key = extraction_key(url, fields)
+    full = {"key": key, "markdown": markdown, "carried": None}
+    if not INCREMENTAL_EXTRACTION or key is None or not markdown:
+        return full
+    previous = get_storage().find_latest("extraction_key", key, ["raw_data", "formatted_data"], "fetched_at")
+    if not previous or not previous.get("raw_data") or not isinstance(previous.get("formatted_data"), dict) \
+            or not isinstance(previous["formatted_data"].get("listings"), list):
+        return full
+    blocks = changed_blocks(previous["raw_data"], markdown)
+    changed = "".join(blocks)
+    if len(changed) > INCREMENTAL_MAX_CHANGE_RATIO * len(markdown):
+        print(f"INFO: {url} changed too much since its last extraction, extracting it in full")
+        return full
+    carried = carried_listings(previous["formatted_data"]["listings"], raw_data, blocks)
+    print(f"INFO: {url}: {len(changed)} of {len(markdown)} characters changed, "
+          f"{len(carried)} previous listings kept")
+    if run_stats is not None:
+        saved = accounting.estimate_tokens(markdown, model) - (accounting.estimate_tokens(changed, model) if changed else 0)
+        run_stats["incremental_pages"] = run_stats.get("incremental_pages", 0) + 1
+        run_stats["incremental_tokens_saved"] = run_stats.get("incremental_tokens_saved", 0) + saved
+    return {"key": key, "markdown": changed, "carried": carried}
@@ -0,0 +1,460 @@
+"""
+Background job service for scraping runs.
+
+A job runs the streaming fetch/extract/save pipeline (or the multi-page crawl) on a
+worker thread. Job state, progress and results are persisted in a
+local SQLite table, so the Streamlit app, the FastAPI app (api.py) and the CLI (cli.py)
+can all submit jobs, poll them and cancel them, even from another process.
+A runner keeps its jobs' updated_at fresh while they are queued or running; when a runner
+starts, jobs left behind by a process that exited are recovered: running ones are marked
+failed and pending ones are queued again.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import tracing
+from assets import (JOBS_DB_PATH, JOB_WORKERS, CRAWL_MAX_PAGES, JOB_MAX_TOKENS, JOB_MAX_COST, WORKER_POLL_INTERVAL,
+                    BATCH_POLL_INTERVAL, JOB_HEARTBEAT_INTERVAL, JOB_STALE_SECONDS)
+
+class JobCancelled(Exception):
+    pass
+
+class JobStore:
+    """Persistent job records: status, parameters, progress, results and cancellation flag."""
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    progress TEXT,
+                    results TEXT,
+                    error TEXT,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def create(self, params: dict) -> str:
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, params, progress, created_at, updated_at) VALUES (?, 'pending', ?, ?, ?, ?)",
+                (job_id, json.dumps(params), json.dumps({"stage": "queued"}), now, now),
+            )
+        return job_id
+
+    def update(self, job_id: str, **fields) -> None:
+        for key in ("params", "progress", "results"):
+            if key in fields:
+                fields[key] = json.dumps(fields[key], default=str)
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for key in ("params", "progress", "results"):
+            job[key] = json.loads(job[key]) if job[key] else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def list(self, limit: int = 50) -> list:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self.get(row["id"]) for row in rows]
+
+    def request_cancel(self, job_id: str) -> bool:
+        """Flags a pending or running job for cancellation. Returns False if it already finished."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status IN ('pending', 'running')",
+                (time.time(), job_id),
+            )
+        return cursor.rowcount > 0
+
+    def touch(self, job_ids: list) -> None:
+        """Marks pending and running jobs as alive (see recover_stale)."""
+        with self._connect() as conn:
+            conn.executemany("UPDATE jobs SET updated_at = ? WHERE id = ? AND status IN ('pending', 'running')",
+                             [(time.time(), job_id) for job_id in job_ids])
+
+    def recover_stale(self, stale_seconds: float = JOB_STALE_SECONDS) -> list:
+        """
+        Finishes the jobs of runners that exited: running jobs not updated for `stale_seconds`
+        are marked failed, and stale pending jobs are cancelled if that was requested or claimed
+        for requeueing. Returns the claimed jobs as (job_id, params) pairs.
+        """
+        now = time.time()
+        cutoff = now - stale_seconds
+        claimed = []
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id, status, params, cancel_requested FROM jobs "
+                                "WHERE status IN ('pending', 'running') AND updated_at < ?", (cutoff,)).fetchall()
+            for row in rows:
+                if row["status"] == "running":
+                    conn.execute("UPDATE jobs SET status = 'failed', error = ?, progress = ?, updated_at = ? "
+                                 "WHERE id = ? AND status = 'running' AND updated_at < ?",
+                                 ("interrupted: the process running the job exited", json.dumps({"stage": "failed"}),
+                                  now, row["id"], cutoff))
+                elif row["cancel_requested"]:
+                    conn.execute("UPDATE jobs SET status = 'cancelled', progress = ?, updated_at = ? "
+                                 "WHERE id = ? AND status = 'pending' AND updated_at < ?",
+                                 (json.dumps({"stage": "cancelled"}), now, row["id"], cutoff))
+                else:
+                    # Claimed by this process only if no other runner claimed it first
+                    cursor = conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ? AND status = 'pending' AND updated_at < ?",
+                                          (now, row["id"], cutoff))
+                    if cursor.rowcount:
+                        claimed.append((row["id"], json.loads(row["params"])))
+        return claimed
+
+def _check_cancel(store: JobStore, job_id: str) -> None:
+    job = store.get(job_id)
+    if job and job["cancel_requested"]:
+        raise JobCancelled()
+
+def execute_job(store: JobStore, job_id: str, params: dict) -> dict:
+    """
+    Runs one scraping job and returns its results in the shape the Streamlit app displays:
+    {"data", "input_tokens", "output_tokens", "total_cost", "pagination_info", "details"}.
+    The rows themselves stay in storage: "data" and "pagination_info" only list the saved pages
+    as {"unique_name"} (read them with export.py), and details holds their row counts
+    (listing_rows, page_url_count).
+    Single-level jobs stream through pipeline.run_pipeline; cancellation is checked after every page.
+    The job is traced: details["stage_times"] holds the seconds spent per stage and the
+    full trace is written to TRACE_DIR/<job_id>.json.
+    """
+    with tracing.trace("job", job_id=job_id, model=params["model"], pages=len(params["urls"])) as root:
+        results = _run_job(store, job_id, params)
+        results["details"]["stage_times"] = tracing.breakdown(root.trace_id)
+    results["details"]["trace_file"] = tracing.write_trace(root.trace_id, job_id)
+    return results
+
+def _run_job(store: JobStore, job_id: str, params: dict) -> dict:
+    # The scraping stack (litellm, crawl4ai, pydantic models) is only loaded once a job runs,
+    # which keeps importing this module cheap for the UI, the API and the CLI.
+    from frontier import crawl_paginated
+    from pipeline import run_pipeline
+    from accounting import Budget, estimate_job
+
+    urls = params["urls"]
+    fields = params.get("fields") or []
+    model = params["model"]
+    pagination_details = params.get("pagination_details", "")
+    details = {}
+    results = {"data": [], "input_tokens": 0, "output_tokens": 0, "total_cost": 0, "pagination_info": None, "details": details}
+
+    def report(stage, **extra):
+        store.update(job_id, progress={"stage": stage, **extra})
+        _check_cancel(store, job_id)
+
+    # Pre-flight estimate and budget (max_tokens / max_cost; pages beyond it are skipped).
+    report("estimating")
+    calls = bool(fields) + bool(params.get("use_pagination") or params.get("follow_pagination"))
+    details["estimate"] = estimate_job(urls, model, max(calls, 1))
+    budget = Budget(params.get("max_tokens") or JOB_MAX_TOKENS, params.get("max_cost") or JOB_MAX_COST)
+    print(f"INFO: Estimated {details['estimate']['input_tokens']} input tokens, ${details['estimate']['cost']:.4f} for {len(urls)} pages")
+
+    if params.get("batch_api"):
+        return _run_batch_api(store, job_id, params, results, report, budget)
+
+    if params.get("distributed"):
+        if not params.get("follow_pagination"):
+            return _run_distributed(store, job_id, params, results, report)
+        print("WARNING: Crawls that follow pagination run in this process, not on workers")
+
+    if params.get("follow_pagination"):
+        crawl_stats = {}
+        results["pagination_info"] = []
+        report("crawling", pages_done=0)
+        for page in crawl_paginated(urls, fields, model, pagination_details,
+                                    max_pages=params.get("max_pages", CRAWL_MAX_PAGES), run_stats=crawl_stats, budget=budget,
+                                    use_templates=params.get("use_templates", False), fetch_profile=params.get("fetch_profile"),
+                                    pack_pages=params.get("pack_pages", False)):
+            _add_entry(results, _page_entry(page), listings=True, pagination=True)
+            report("crawling", pages_done=crawl_stats["pages_crawled"], depth=page["depth"])
+        results["input_tokens"] = crawl_stats["input_tokens"]
+        results["output_tokens"] = crawl_stats["output_tokens"]
+        results["total_cost"] = crawl_stats["total_cost"]
+        details.update({
+            "fetch_stats": {"failures": crawl_stats.get("failures", {})},
+            "scrape_stats": crawl_stats,
+            "pagination_stats": crawl_stats,
+            "budget": {**budget.summary(), "pages_skipped": crawl_stats.get("pages_skipped", 0)},
+        })
+        _book_usage(details, results, _pagination_usage(crawl_stats), bool(fields), True)
+        return results
+
+    # Fetch, preprocessing, extraction and saving overlap in the streaming pipeline.
+    report("processing", pages_done=0, pages_total=len(urls))
+    run_stats = {}
+    entries = []
+    indication = pagination_details if params.get("use_pagination") else None
+    for page in run_pipeline(urls, fields, model, indication, run_stats=run_stats, budget=budget,
+                             use_templates=params.get("use_templates", False), fetch_profile=params.get("fetch_profile"),
+                             pack_pages=params.get("pack_pages", False)):
+        entries.append(_page_entry(page))
+        report("processing", pages_done=len(entries), pages_total=len(urls))
+    order = {url: i for i, url in reversed(list(enumerate(urls)))}
+    entries.sort(key=lambda entry: order.get(entry["url"], len(urls)))
+
+    if indication is not None:
+        results["pagination_info"] = []
+    for entry in entries:
+        _add_entry(results, entry, listings=bool(fields), pagination=indication is not None)
+    results["input_tokens"] = run_stats.get("input_tokens", 0)
+    results["output_tokens"] = run_stats.get("output_tokens", 0)
+    results["total_cost"] = run_stats.get("total_cost", 0)
+    details["fetch_stats"] = {key: run_stats.get(key, 0) for key in ("cache_hits", "cache_revalidated", "cache_misses")}
+    details["fetch_stats"]["failures"] = run_stats.get("failures", {})
+    details["scrape_stats"] = run_stats
+    details["pagination_stats"] = run_stats
+    details["budget"] = {**budget.summary(), "pages_skipped": run_stats.get("pages_skipped", 0)}
+    _book_usage(details, results, _pagination_usage(run_stats), bool(fields), indication is not None)
+    return results
+
+def _page_entry(page: dict) -> dict:
+    """What a job keeps of a saved page: its unique_name and row counts (None for data that wasn't saved)."""
+    import export
+    return {"url": page.get("url"), "unique_name": page["unique_name"],
+            "listing_rows": None if page.get("parsed_data") is None else export.row_count("listings", page["parsed_data"]),
+            "page_urls": None if page.get("pagination_data") is None else export.row_count("pagination", page["pagination_data"])}
+
+def _add_entry(results: dict, entry: dict, listings: bool, pagination: bool) -> None:
+    """Lists a page in the job's results and adds its rows to the counts in the details."""
+    details = results["details"]
+    if listings and entry["listing_rows"] is not None:
+        results["data"].append({"unique_name": entry["unique_name"]})
+        details["listing_rows"] = details.get("listing_rows", 0) + entry["listing_rows"]
+    if pagination and entry["page_urls"] is not None:
+        results["pagination_info"].append({"unique_name": entry["unique_name"]})
+        details["page_url_count"] = details.get("page_url_count", 0) + entry["page_urls"]
+
+def _pagination_usage(run_stats: dict) -> dict:
+    """The pagination share of the totals in run_stats (see pipeline.py and frontier.py)."""
+    return {"input_tokens": run_stats.get("pagination_input_tokens", 0),
+            "output_tokens": run_stats.get("pagination_output_tokens", 0),
+            "cost": run_stats.get("pagination_cost", 0)}
+
+def _book_usage(details: dict, results: dict, pagination: dict, scraped: bool, paginated: bool) -> None:
+    """
+    Books a job's usage under the keys the app displays: extraction (in_tokens_s, out_tokens_s,
+    cost_s) and pagination (in_tokens_p, out_tokens_p, cost_p). `pagination` is the pagination
+    share of the results' totals.
+    """
+    if scraped:
+        details.update({"in_tokens_s": results["input_tokens"] - pagination["input_tokens"],
+                        "out_tokens_s": results["output_tokens"] - pagination["output_tokens"],
+                        "cost_s": results["total_cost"] - pagination["cost"]})
+    if paginated:
+        details.update({"in_tokens_p": pagination["input_tokens"], "out_tokens_p": pagination["output_tokens"],
+                        "cost_p": pagination["cost"]})
+
+def _run_distributed(store: JobStore, job_id: str, params: dict, results: dict, report) -> dict:
+    """
+    Queues one work item per URL for worker processes (worker.py), waits until every item is
+    done or failed and reads the results back from storage.
+    """
+    import worker
+    from storage import get_storage
+    from assets import EXPORT_CHUNK_PAGES
+
+    queue = worker.get_work_queue()
+    if queue is None:
+        raise RuntimeError("No work queue: set STORAGE_BACKEND=sqlite or configure Supabase")
+    queue.enqueue(job_id, params["urls"], params)
+    try:
+        while True:
+            items = queue.items(job_id)
+            counts = worker.progress(items)
+            report("on workers", pages_done=counts["done"] + counts["failed"], pages_total=len(items),
+                   leased=counts["leased"], failed=counts["failed"])
+            if not counts["pending"] and not counts["leased"]:
+                break
+            time.sleep(WORKER_POLL_INTERVAL)
+    except JobCancelled:
+        queue.cancel(job_id)
+        raise
+
+    done = [item for item in items if item["status"] == "done" and item["unique_name"]]
+    if params.get("use_pagination"):
+        results["pagination_info"] = []
+    # Only the row counts are needed, so storage is read a chunk of pages at a time
+    for start in range(0, len(done), EXPORT_CHUNK_PAGES):
+        names = [item["unique_name"] for item in done[start:start + EXPORT_CHUNK_PAGES]]
+        stored = get_storage().read_many(names, ["formatted_data", "pagination_data"])
+        for name in names:
+            row = stored.get(name, {})
+            entry = _page_entry({"unique_name": name, "parsed_data": row.get("formatted_data"),
+                                 "pagination_data": row.get("pagination_data")})
+            _add_entry(results, entry, listings=bool(params.get("fields")), pagination=bool(params.get("use_pagination")))
+    results["input_tokens"] = sum(item["input_tokens"] for item in items)
+    results["output_tokens"] = sum(item["output_tokens"] for item in items)
+    results["total_cost"] = sum(item["cost"] for item in items)
+    details = results["details"]
+    details["fetch_stats"] = {"failures": {item["url"]: item["error"] for item in items if item["status"] == "failed"}}
+    details["worker_stats"] = {**counts, "workers": len({item["worker_id"] for item in items if item["worker_id"]}),
+                               "retried": sum(item["attempts"] > 1 for item in items)}
+    details["scrape_stats"] = details["pagination_stats"] = {"pages_skipped": sum((item["error"] or "").startswith("skipped") for item in done)}
+    pagination = {"input_tokens": sum(item["pagination_input_tokens"] for item in items),
+                  "output_tokens": sum(item["pagination_output_tokens"] for item in items),
+                  "cost": sum(item["pagination_cost"] for item in items)}
+    _book_usage(details, results, pagination, bool(params.get("fields")), bool(params.get("use_pagination")))
+    return results
+
+def _run_batch_api(store: JobStore, job_id: str, params: dict, results: dict, report, budget) -> dict:
+    """
+    Fetches the pages, submits their extraction to the provider's batch endpoint (batching.py),
+    polls it until it is done and saves the results. Only listings are extracted; pages beyond
+    the budget are left out of the batch.
+    """
+    import batching
+    from markdown import fetch_and_store_markdowns
+
+    fields = params.get("fields") or []
+    if not fields:
+        raise ValueError("Batch API jobs need fields to extract")
+    if params.get("use_pagination"):
+        print("WARNING: Pagination is not detected in batch API jobs")
+    report("fetching", pages_total=len(params["urls"]))
+    fetch_stats = {}
+    unique_names = fetch_and_store_markdowns(params["urls"], run_stats=fetch_stats, profile=params.get("fetch_profile"))
+    run_stats = {}
+    batch_id = batching.submit_batch(unique_names, fields, params["model"], pack=params.get("pack_pages", False),
+                                     run_stats=run_stats, budget=budget)
+    try:
+        status = batching.wait_for_batch(batch_id, BATCH_POLL_INTERVAL,
+                                         lambda status: report("waiting for batch", batch_id=batch_id, batch_status=status))
+    except JobCancelled:
+        batching.cancel_batch(batch_id)
+        raise
+    if status != "completed":
+        raise RuntimeError(f"Batch {batch_id} ended with status {status}")
+    report("saving", batch_id=batch_id)
+    pages = batching.collect_batch(batch_id, run_stats, budget)
+
+    for page in pages:
+        _add_entry(results, _page_entry(page), listings=True, pagination=False)
+    results["input_tokens"] = run_stats.get("input_tokens", 0)
+    results["output_tokens"] = run_stats.get("output_tokens", 0)
+    results["total_cost"] = run_stats.get("total_cost", 0)
+    details = results["details"]
+    details["fetch_stats"] = {key: fetch_stats.get(key, 0) for key in ("cache_hits", "cache_revalidated", "cache_misses")}
+    details["fetch_stats"]["failures"] = fetch_stats.get("failures", {})
+    details["scrape_stats"] = run_stats
+    details["batch"] = {"batch_id": batch_id, "status": status}
+    details["budget"] = {**budget.summary(), "pages_skipped": run_stats.get("pages_skipped", 0)}
+    _book_usage(details, results, _pagination_usage(run_stats), True, False)
+    return results
+
+class JobRunner:
+    """
+    Runs submitted jobs on a thread pool and records their outcome in a JobStore.
+    On start it recovers the jobs left pending or running by processes that exited; requeued
+    jobs run with the API keys of the environment, as per-job keys are never persisted.
+    """
+    def __init__(self, store: JobStore = None, workers: int = JOB_WORKERS, heartbeat: float = JOB_HEARTBEAT_INTERVAL):
+        self.store = store or JobStore()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scrape-job")
+        self.active = set()
+        self.lock = threading.Lock()
+        threading.Thread(target=self._heartbeat, args=(heartbeat,), daemon=True, name="scrape-job-heartbeat").start()
+        for job_id, params in self.store.recover_stale():
+            print(f"INFO: Requeueing job {job_id}, left pending by a process that exited")
+            self._queue(job_id, params, {})
+
+    def submit(self, params: dict, api_keys: dict = None) -> str:
+        """
+        Queues a job. params: urls, model, and optionally fields, use_pagination,
+        pagination_details, follow_pagination, max_pages, use_templates, fetch_profile, max_tokens, max_cost,
+        pack_pages, batch_api (see batching.py), distributed (run on worker processes, see worker.py). api_keys (env var name -> key)
+        are passed to the job's LLM calls only and never persisted.
+        """
+        job_id = self.store.create(params)
+        self._queue(job_id, params, api_keys or {})
+        return job_id
+
+    def _queue(self, job_id: str, params: dict, api_keys: dict) -> None:
+        with self.lock:
+            self.active.add(job_id)
+        self.executor.submit(self._run, job_id, params, api_keys)
+
+    def _heartbeat(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            with self.lock:
+                job_ids = list(self.active)
+            if not job_ids:
+                continue
+            try:
+                self.store.touch(job_ids)
+            except sqlite3.Error as e:
+                print(f"WARNING: Could not refresh the running jobs: {e}")
+
+    def _run(self, job_id: str, params: dict, api_keys: dict) -> None:
+        from api_management import job_api_keys
+        try:
+            with job_api_keys(api_keys):
+                self._execute(job_id, params)
+        finally:
+            with self.lock:
+                self.active.discard(job_id)
+
+    def _execute(self, job_id: str, params: dict) -> None:
+        try:
+            _check_cancel(self.store, job_id)
+            self.store.update(job_id, status="running")
+            results = execute_job(self.store, job_id, params)
+            self.store.update(job_id, status="completed", results=results, progress={"stage": "done"})
+        except JobCancelled:
+            self.store.update(job_id, status="cancelled", progress={"stage": "cancelled"})
+        except Exception as e:
+            print(f"ERROR: Job {job_id} failed: {e}")
+            self.store.update(job_id, status="failed", error=str(e), progress={"stage": "failed"})
+
+    def wait(self, job_id: str, poll_interval: float = 1.0, on_progress=None) -> dict:
+        """Blocks until a job finishes, calling on_progress(job) on every poll. Returns the job."""
+        while True:
+            job = self.store.get(job_id)
+            if on_progress:
+                on_progress(job)
+            if job["status"] in ("completed", "failed", "cancelled"):
+                return job
+            time.sleep(poll_interval)
+
+_runner = None
+_runner_lock = threading.Lock()
+
+def get_job_runner() -> JobRunner:
+    """Returns the process-wide JobRunner."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+        return _runner
@@ -0,0 +1,90 @@
+"""
+Persistent SQLite cache for LLM responses.
+
+Responses are keyed on a hash of the model, system message, response schema and the
+user message, so re-extracting the same page with the same fields and model is free.
+Entries expire after LLM_CACHE_MAX_AGE seconds and the least recently used ones are
+evicted beyond LLM_CACHE_MAX_ENTRIES.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from assets import LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_MAX_AGE
+
+@contextmanager
+def _connect():
+    os.makedirs(os.path.dirname(LLM_CACHE_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(LLM_CACHE_PATH, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            input_tokens INTEGER NOT NULL,
+            output_tokens INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        )
+    """)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def make_key(params: dict) -> str:
+    """
+    Hashes the model, system message, response schema and user message of a completion request.
+    """
+    response_format = params.get("response_format")
+    if hasattr(response_format, "model_json_schema"):
+        schema = response_format.model_json_schema()
+    else:
+        schema = response_format
+    payload = json.dumps([params["model"], params["messages"], schema], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get(key: str):
+    """
+    Returns (parsed_response, token_counts) for a cached request, or None.
+    """
+    now = time.time()
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT response, input_tokens, output_tokens FROM llm_cache WHERE key = ? AND created_at > ?",
+            (key, now - LLM_CACHE_MAX_AGE),
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+    return json.loads(row[0]), {"input_tokens": row[1], "output_tokens": row[2]}
+
+def put(key: str, parsed_response, token_counts: dict) -> None:
+    """
+    Stores a response and evicts expired and least recently used entries.
+    """
+    now = time.time()
+    with _connect() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)",
+            (key, json.dumps(parsed_response), token_counts["input_tokens"], token_counts["output_tokens"], now, now),
+        )
+        conn.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - LLM_CACHE_MAX_AGE,))
+        conn.execute(
+            "DELETE FROM llm_cache WHERE key IN ("
+            "SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (LLM_CACHE_MAX_ENTRIES,),
+        )
+
+def cached_token_counts(token_counts: dict) -> dict:
+    """
+    Token counts reported for a cache hit: nothing billed, original usage kept separately.
+    """
+    return {
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "cached_input_tokens": token_counts["input_tokens"],
+        "cached_output_tokens": token_counts["output_tokens"],
+    }
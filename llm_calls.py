@@ -1,41 +1,38 @@
 import litellm
+import asyncio
 import json
-from litellm import completion, token_counter, completion_cost, get_max_tokens
-from assets import USER_MESSAGE, MODELS_USED
+import random
+from functools import lru_cache
+from litellm import completion, acompletion, completion_cost, get_max_tokens
+from assets import USER_MESSAGE, LLM_MAX_RETRIES, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX
 from api_management import get_api_key
-import os
+from rate_limiter import get_limiter
+import llm_cache
+import accounting
+from validation import InvalidResponse
+from tracing import span
 
-def call_llm_model(data, response_format, model, system_message, extra_user_instruction="", max_tokens=None, use_model_max_tokens_if_none=False):
+@lru_cache(maxsize=None)
+def model_max_tokens(model):
     """
-    Calls an LLM via LiteLLM and returns:
-      - parsed_response (str or dict),
-      - token_counts ({"input_tokens": int, "output_tokens": int}),
-      - cost (float).
-    It respects the maximum token limits and uses an improved prompt to force JSON output for structured data.
-
-    Parameters:
-        data (str): Additional data (e.g., raw webpage text).
-        response_format: Expected response format (e.g., a Pydantic model).
-        model (str): Model identifier.
-        system_message (str): System prompt.
-        extra_user_instruction (str): Additional instructions.
-        max_tokens (int, optional): Maximum tokens for completion.
-        use_model_max_tokens_if_none (bool, optional): Use model's max tokens if max_tokens is None.
+    get_max_tokens for a model, looked up once per process.
+    """
+    return get_max_tokens(model)
 
-    Returns:
-        tuple: (parsed_response, token_counts, cost)
+def _prepare_request(data, response_format, model, system_message, extra_user_instruction="", max_tokens=None, use_model_max_tokens_if_none=False):
+    """
+    Builds the completion parameters, including the model's API key when one is configured.
     """
-    env_var_name = list(MODELS_USED[model])[0]  # e.g., "GEMINI_API_KEY"
-    env_value = get_api_key(model)
-    print("env variable is:" + env_value)
-    if env_value:
-        os.environ[env_var_name] = env_value
+    with span("prompt_build", model=model, bytes=len(str(data))):
+        return _build_params(data, response_format, model, system_message, extra_user_instruction, max_tokens, use_model_max_tokens_if_none)
+
+def _build_params(data, response_format, model, system_message, extra_user_instruction, max_tokens, use_model_max_tokens_if_none):
+    api_key = get_api_key(model)
 
-    model_max_tokens = get_max_tokens(model)
     if max_tokens is not None:
-        max_tokens = min(max_tokens, model_max_tokens) - 100
+        max_tokens = min(max_tokens, model_max_tokens(model)) - 100
     elif use_model_max_tokens_if_none:
-        max_tokens = model_max_tokens - 100
+        max_tokens = model_max_tokens(model) - 100
 
     messages = [
         {"role": "system", "content": system_message},
@@ -49,19 +46,150 @@ def call_llm_model(data, response_format, model, system_message, extra_user_inst
     }
     if max_tokens is not None:
         params["max_tokens"] = max_tokens
+    if api_key:
+        params["api_key"] = api_key
+    return params
 
-    response = completion(**params)
+def _summarize_response(response, params, estimated_input_tokens):
+    """
+    Extracts the content, token counts and cost from a completion response.
+    Token counts come from the provider's usage report, which also calibrates the estimates.
+    """
+    model = params["model"]
     parsed_response = response.choices[0].message.content
 
-    input_tokens = token_counter(model=model, messages=messages)
     output_text = parsed_response if isinstance(parsed_response, str) else json.dumps(parsed_response)
-    output_tokens = token_counter(model=model, text=output_text)
-
-    token_counts = {
-        "input_tokens": input_tokens,
-        "output_tokens": output_tokens,
-    }
+    token_counts = accounting.usage_counts(response, estimated_input_tokens, output_text, model)
+    accounting.observe(model, accounting.message_chars(params["messages"]), token_counts["input_tokens"], token_counts["output_tokens"])
 
     cost = completion_cost(completion_response=response)
 
     return parsed_response, token_counts, cost
+
+def _validated(validator, parsed_response, token_counts, cost):
+    """
+    Applies the validator to a fresh response. An invalid response raises InvalidResponse
+    carrying its token counts and cost, and is never cached.
+    """
+    if validator is None:
+        return parsed_response
+    try:
+        return validator(parsed_response)
+    except InvalidResponse as e:
+        e.token_counts, e.cost = token_counts, cost
+        raise
+
+def _transient(error: Exception) -> bool:
+    """Timeouts, connection errors and 5xx responses, which are worth retrying."""
+    if isinstance(error, (litellm.Timeout, litellm.APIConnectionError, litellm.InternalServerError,
+                          litellm.ServiceUnavailableError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return isinstance(error, litellm.APIError) and isinstance(status_code, int) and status_code >= 500
+
+def _cached_if_valid(cached, validator):
+    """Returns a cached (parsed_response, token_counts, cost) result, or None if it fails validation."""
+    parsed_response, token_counts = cached
+    try:
+        parsed_response = validator(parsed_response) if validator else parsed_response
+    except InvalidResponse:
+        return None
+    return parsed_response, llm_cache.cached_token_counts(token_counts), 0.0
+
+def call_llm_model(data, response_format, model, system_message, extra_user_instruction="", max_tokens=None, use_model_max_tokens_if_none=False, validator=None):
+    """
+    Calls an LLM via LiteLLM and returns:
+      - parsed_response (str or dict),
+      - token_counts ({"input_tokens": int, "output_tokens": int}),
+      - cost (float).
+    It respects the maximum token limits and uses an improved prompt to force JSON output for structured data.
+
+    Parameters:
+        data (str): Additional data (e.g., raw webpage text).
+        response_format: Expected response format (e.g., a Pydantic model).
+        model (str): Model identifier.
+        system_message (str): System prompt.
+        extra_user_instruction (str): Additional instructions.
+        max_tokens (int, optional): Maximum tokens for completion.
+        use_model_max_tokens_if_none (bool, optional): Use model's max tokens if max_tokens is None.
+        validator (callable, optional): Validates and normalizes the response (see validation.py);
+            raises InvalidResponse for responses that must not be used or cached.
+
+    Returns:
+        tuple: (parsed_response, token_counts, cost)
+
+    Responses are cached locally (see llm_cache); a cache hit costs 0 and reports its
+    tokens as cached_input_tokens / cached_output_tokens instead.
+    """
+    params = _prepare_request(data, response_format, model, system_message, extra_user_instruction, max_tokens, use_model_max_tokens_if_none)
+    cache_key = llm_cache.make_key(params)
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        result = _cached_if_valid(cached, validator)
+        if result is not None:
+            return result
+
+    input_tokens = accounting.estimate_messages_tokens(params["messages"], model)
+    with span("completion", model=model) as s:
+        response = completion(**params)
+        parsed_response, token_counts, cost = _summarize_response(response, params, input_tokens)
+        s.set(cost=cost, **token_counts)
+    parsed_response = _validated(validator, parsed_response, token_counts, cost)
+    llm_cache.put(cache_key, parsed_response, token_counts)
+    return parsed_response, token_counts, cost
+
+async def acall_llm_model(data, response_format, model, system_message, extra_user_instruction="", max_tokens=None, use_model_max_tokens_if_none=False, validator=None):
+    """
+    Async counterpart of call_llm_model built on litellm.acompletion.
+    Every request first waits on the model's rate limiter (requests and tokens per minute);
+    429 responses pause the whole provider with capped exponential backoff and are retried
+    up to LLM_MAX_RETRIES times; timeouts, connection errors and 5xx responses are retried
+    with the same backoff, without pausing the provider. Returns the same (parsed_response, token_counts, cost) tuple,
+    uses the same response cache and takes the same validator.
+    """
+    params = _prepare_request(data, response_format, model, system_message, extra_user_instruction, max_tokens, use_model_max_tokens_if_none)
+    cache_key = llm_cache.make_key(params)
+    cached = await asyncio.to_thread(llm_cache.get, cache_key)
+    if cached is not None:
+        result = _cached_if_valid(cached, validator)
+        if result is not None:
+            return result
+
+    input_tokens = accounting.estimate_messages_tokens(params["messages"], model)
+    limiter = get_limiter(model)
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        await limiter.acquire(input_tokens)
+        try:
+            with span("completion", model=model, attempt=attempt) as s:
+                response = await acompletion(**params)
+                parsed_response, token_counts, cost = _summarize_response(response, params, input_tokens)
+                s.set(cost=cost, **token_counts)
+            break
+        except litellm.RateLimitError:
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            delay = min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"WARNING: Rate limited by {model}, retrying in {delay:.1f}s")
+            limiter.back_off(delay)
+        except Exception as e:
+            if not _transient(e) or attempt == LLM_MAX_RETRIES:
+                raise
+            delay = min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"WARNING: {type(e).__name__} from {model}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    # The limiter was charged the estimate; settle it with the reported usage.
+    limiter.consume(token_counts["output_tokens"] + max(0, token_counts["input_tokens"] - input_tokens))
+    parsed_response = _validated(validator, parsed_response, token_counts, cost)
+    await asyncio.to_thread(llm_cache.put, cache_key, parsed_response, token_counts)
+    return parsed_response, token_counts, cost
+
+def record_cached_tokens(run_stats: dict, token_counts: dict) -> None:
+    """
+    Adds the cache-served tokens of one call to run_stats (if given), kept apart from billed tokens.
+    """
+    if run_stats is None:
+        return
+    for key in ("cached_input_tokens", "cached_output_tokens"):
+        run_stats[key] = run_stats.get(key, 0) + token_counts.get(key, 0)
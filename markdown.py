@@ -1,66 +1,263 @@
 import asyncio
-from api_management import get_supabase_client
-from utils import generate_unique_name
-from crawl4ai import AsyncWebCrawler
+import atexit
+import threading
+from contextlib import asynccontextmanager
+from storage import get_storage
+from utils import generate_unique_name, get_domain, normalize_url, run_async
+from assets import MAX_CONCURRENT_FETCHES, MAX_FETCHES_PER_DOMAIN
+import fetch_cache
+import static_fetch
+import fetch_profiles
+from tracing import span
 
-supabase = get_supabase_client()
+class SharedCrawler:
+    """
+    One AsyncWebCrawler (and its browser) per process. It lives on its own event loop in a
+    daemon thread, so arun() can be awaited from any event loop or thread without
+    starting a new browser per batch.
+    """
+    def __init__(self):
+        from crawl4ai import AsyncWebCrawler  # imported on first use, it is slow to load
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True, name="crawler-loop").start()
+        self.crawler = AsyncWebCrawler()
+        self.crawler.crawler_strategy.set_hook("on_page_context_created", fetch_profiles.block_resources)
+        self._submit(self.crawler.start()).result()
+        atexit.register(self.close)
+
+    def _submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def arun(self, url: str, **kwargs):
+        return await asyncio.wrap_future(self._submit(self.crawler.arun(url=url, **kwargs)))
+
+    def close(self) -> None:
+        try:
+            self._submit(self.crawler.close()).result(timeout=10)
+        except Exception as e:
+            print(f"WARNING: Failed to close the browser: {e}")
 
-async def get_fit_markdown_async(url: str) -> str:
+_crawler = None
+_crawler_lock = threading.Lock()
+
+def get_crawler() -> SharedCrawler:
     """
-    Uses crawl4ai's AsyncWebCrawler to produce raw markdown.
+    Returns the process-wide crawler, starting the browser on first use.
     """
-    async with AsyncWebCrawler() as crawler:
-        result = await crawler.arun(url=url)
-        if result.success:
-            return result.markdown
-        else:
-            return ""
+    global _crawler
+    with _crawler_lock:
+        if _crawler is None:
+            _crawler = SharedCrawler()
+        return _crawler
+
+async def _fetch_static(url: str, profile: dict):
+    """The static fetch of a URL (see static_fetch.py), or None when the page needs the browser."""
+    if not static_fetch.use_static(url) or not fetch_profiles.allows_static(profile):
+        return None
+    with span("fetch", url=url, tier="static") as s:
+        result = await static_fetch.fetch_static(url)
+        s.set(bytes=len(result["markdown"]) if result else 0, fallback=result is None)
+    if result is not None and not fetch_profiles.has_content(profile, result["html"]):
+        print(f"INFO: {url} has no {profile['wait_for']} without JavaScript, using the browser")
+        return None
+    return result
+
+async def get_fit_markdown_async(url: str, crawler=None, profile: str = None) -> str:
+    """
+    Produces raw markdown for a URL: with a plain HTTP GET for static pages, otherwise with
+    crawl4ai's AsyncWebCrawler under the URL's fetch profile (see fetch_profiles.py).
+    If no crawler is given, the process-wide one is used.
+    """
+    profile = fetch_profiles.resolve_profile(url, profile)
+    result = await _fetch_static(url, profile)
+    if result is not None:
+        return result["markdown"]
+    crawler = crawler or await asyncio.to_thread(get_crawler)
+    with span("fetch", url=url, profile=profile["name"]) as s:
+        result = await crawler.arun(url=url, config=fetch_profiles.run_config(url, profile))
+        s.set(bytes=len(result.markdown or "") if result.success else 0, success=result.success)
+    if result.success:
+        return result.markdown
+    else:
+        return ""
 
 def fetch_fit_markdown(url: str) -> str:
     """
     Synchronous wrapper for get_fit_markdown_async.
     """
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        return loop.run_until_complete(get_fit_markdown_async(url))
-    finally:
-        loop.close()
+    return run_async(get_fit_markdown_async(url))
+
+class FetchLimits:
+    """
+    Concurrency limits shared by all fetches of one batch or pipeline: at most `max_concurrency`
+    pages load at once, at most `max_per_domain` per host, and requests to the same host
+    start at least `domain_delay` seconds apart (politeness). `profile` is the batch's fetch
+    profile (see fetch_profiles.py; domains with their own profile keep it).
+    """
+    def __init__(self, max_concurrency: int = MAX_CONCURRENT_FETCHES,
+                 max_per_domain: int = MAX_FETCHES_PER_DOMAIN, domain_delay: float = 0, profile: str = None):
+        self.profile = profile
+        self.global_limit = asyncio.Semaphore(max_concurrency)
+        self.max_per_domain = max_per_domain
+        self.domain_delay = domain_delay
+        self.domain_limits = {}
+        self.domain_next_start = {}
+
+    async def _wait_for_turn(self, domain: str) -> None:
+        loop = asyncio.get_running_loop()
+        start = max(loop.time(), self.domain_next_start.get(domain, 0))
+        self.domain_next_start[domain] = start + self.domain_delay
+        await asyncio.sleep(start - loop.time())
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        domain = get_domain(url)
+        domain_limit = self.domain_limits.setdefault(domain, asyncio.Semaphore(self.max_per_domain))
+        async with domain_limit, self.global_limit:
+            if self.domain_delay:
+                await self._wait_for_turn(domain)
+            yield
+
+async def crawl_page(crawler, url: str, limits: FetchLimits) -> dict:
+    """
+    Fetches one URL inside the given limits, with a plain HTTP GET when the page is static
+    (see static_fetch.py) and with the shared crawler under the URL's fetch profile otherwise. Without a crawler, the
+    process-wide one is started only when a page needs it.
+    Returns {"url", "markdown", "html", "headers", "error", "tier"}; failures are reported, never raised.
+    """
+    profile = fetch_profiles.resolve_profile(url, limits.profile)
+    async with limits.slot(url):
+        static = await _fetch_static(url, profile)
+        if static is not None:
+            return static
+        try:
+            crawler = crawler or await asyncio.to_thread(get_crawler)
+            with span("fetch", url=url, tier="browser", profile=profile["name"]) as s:
+                result = await crawler.arun(url=url, config=fetch_profiles.run_config(url, profile))
+                s.set(bytes=len(result.markdown or "") if result.success else 0, success=result.success)
+        except Exception as e:
+            return {"url": url, "markdown": "", "html": "", "headers": {}, "error": str(e) or type(e).__name__, "tier": "browser"}
+    headers = result.response_headers or {}
+    if result.success:
+        return {"url": url, "markdown": result.markdown, "html": result.html or "", "headers": headers, "error": None, "tier": "browser"}
+    return {"url": url, "markdown": "", "html": "", "headers": headers, "error": result.error_message or "crawl failed", "tier": "browser"}
+
+async def fetch_markdowns_async(urls: list, max_concurrency: int = MAX_CONCURRENT_FETCHES,
+                                max_per_domain: int = MAX_FETCHES_PER_DOMAIN, domain_delay: float = 0, profile: str = None) -> list:
+    """
+    Fetches many URLs concurrently within FetchLimits, static pages without a browser and
+    the others through the process-wide crawler under their fetch profile.
+    Returns one {"url", "markdown", "html", "headers", "error", "tier"} dict per URL, in input order.
+    A failing URL gets an error message instead of raising, so the batch carries on.
+    """
+    limits = FetchLimits(max_concurrency, max_per_domain, domain_delay, profile)
+    return await asyncio.gather(*(crawl_page(None, url, limits) for url in urls))
+
+def fetch_markdowns(urls: list, **limits) -> list:
+    """
+    Synchronous wrapper for fetch_markdowns_async.
+    """
+    return run_async(fetch_markdowns_async(urls, **limits))
 
 def read_raw_data(unique_name: str) -> str:
     """
-    Retrieves 'raw_data' from Supabase for the given unique_name.
+    Retrieves 'raw_data' from storage for the given unique_name.
     """
-    response = supabase.table("scraped_data").select("raw_data").eq("unique_name", unique_name).execute()
-    data = response.data
-    if data and len(data) > 0:
-        return data[0]["raw_data"]
-    return ""
+    return get_storage().read(unique_name, "raw_data") or ""
 
-def save_raw_data(unique_name: str, url: str, raw_data: str) -> None:
+def read_raw_data_many(unique_names: list) -> dict:
     """
-    Saves or updates raw_data in Supabase.
+    Retrieves 'raw_data' for many unique_names in one query. Returns {unique_name: raw_data}.
     """
-    supabase.table("scraped_data").upsert({
-        "unique_name": unique_name,
+    rows = get_storage().read_many(unique_names, ["raw_data"])
+    return {name: rows.get(name, {}).get("raw_data") or "" for name in unique_names}
+
+def save_raw_data(unique_name: str, url: str, raw_data: str, extra_columns: dict = None) -> None:
+    """
+    Queues raw_data for storage (written in batches by the storage layer).
+    extra_columns (e.g. the fetch cache columns) are stored on the same row.
+    """
+    row = {
         "url": url,
         "raw_data": raw_data
-    }, on_conflict="id").execute()
+    }
+    row.update(extra_columns or {})
+    get_storage().write(unique_name, row)
     print(f"INFO: Raw data stored for {unique_name}")
 
-def fetch_and_store_markdowns(urls: list) -> list:
+def store_fetched_page(result: dict, keep_html: bool = False) -> str:
+    """
+    Saves a crawl_page result under a new unique name (and in the fetch cache if it succeeded).
+    With keep_html, the page's HTML is kept in raw_html for wrapper induction (see wrappers.py).
+    Returns the unique name.
+    """
+    url = result["url"]
+    unique_name = generate_unique_name(url)
+    if result["error"]:
+        print(f"WARNING: Failed to fetch {url}: {result['error']}")
+        save_raw_data(unique_name, url, result["markdown"])
+    else:
+        columns = fetch_cache.cache_columns(url, result["headers"])
+        save_raw_data(unique_name, url, result["markdown"], {**columns, "raw_html": (result.get("html") or None) if keep_html else None})
+        fetch_cache.store(url, unique_name, result["markdown"], columns)
+    return unique_name
+
+def fetch_and_store_markdowns(urls: list, run_stats: dict = None, keep_html: bool = False, **limits) -> list:
     """
-    For each URL, generate a unique name, check for existing data, and fetch/store markdown.
-    Returns a list of unique names.
+    For each URL, reuse cached markdown when it is fresh (or revalidates with a 304),
+    otherwise fetch it (statically or with the shared browser) and store it under a new unique name.
+    Returns a list of unique names, in input order.
+    If run_stats is given, cache hit/miss counts and per-URL fetch errors are recorded in it.
+    keep_html stores the fetched pages' HTML too (for templates, see store_fetched_page).
+    `limits` are passed on to fetch_markdowns_async (concurrency caps, politeness delay, fetch profile).
     """
-    unique_names = []
-    for url in urls:
-        unique_name = generate_unique_name(url)
-        raw_data = read_raw_data(unique_name)
-        if raw_data:
-            print(f"Found existing data for {url} => {unique_name}")
+    unique_names = [None] * len(urls)
+    hits = 0
+    stale = []
+    to_fetch = {}
+    for i, url in enumerate(urls):
+        entry = fetch_cache.lookup(url)
+        if fetch_cache.is_fresh(entry):
+            print(f"Found cached data for {url} => {entry['unique_name']}")
+            unique_names[i] = entry["unique_name"]
+            hits += 1
+        elif entry:
+            stale.append((i, url, entry))
         else:
-            fit_md = fetch_fit_markdown(url)
-            save_raw_data(unique_name, url, fit_md)
-        unique_names.append(unique_name)
+            to_fetch.setdefault(normalize_url(url), []).append((i, url))
+
+    revalidated = 0
+    if stale:
+        not_modified = run_async(fetch_cache.revalidate_async([(url, entry) for _, url, entry in stale]))
+        for (i, url, entry), unchanged in zip(stale, not_modified):
+            if unchanged:
+                print(f"Revalidated cached data for {url} => {entry['unique_name']}")
+                fetch_cache.touch(url, entry)
+                unique_names[i] = entry["unique_name"]
+                revalidated += 1
+            else:
+                to_fetch.setdefault(normalize_url(url), []).append((i, url))
+
+    failures = {}
+    tiers = {"static": 0, "browser": 0}
+    batches = list(to_fetch.values())
+    results = fetch_markdowns([batch[0][1] for batch in batches], **limits) if batches else []
+    for batch, result in zip(batches, results):
+        unique_name = store_fetched_page(result, keep_html)
+        tiers[result["tier"]] += 1
+        if result["error"]:
+            failures[result["url"]] = result["error"]
+        for i, _ in batch:
+            unique_names[i] = unique_name
+
+    get_storage().flush()
+    misses = len(urls) - hits - revalidated
+    print(f"INFO: Fetch cache: {hits} hits, {revalidated} revalidated, {misses} misses")
+    if run_stats is not None:
+        run_stats["cache_hits"] = hits
+        run_stats["cache_revalidated"] = revalidated
+        run_stats["cache_misses"] = misses
+        run_stats["static_fetches"] = tiers["static"]
+        run_stats["browser_fetches"] = tiers["browser"]
+        run_stats["failures"] = failures
     return unique_names
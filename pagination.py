@@ -1,12 +1,19 @@
+import asyncio
 import json
+import re
+from collections import defaultdict
+from functools import reduce
+from math import gcd
 from typing import List
-from assets import PROMPT_PAGINATION
-from markdown import read_raw_data
-from api_management import get_supabase_client
+from urllib.parse import urljoin, urlparse, urlunparse, parse_qsl, urlencode
+from assets import PROMPT_PAGINATION, MAX_CONCURRENT_LLM_CALLS, PAGINATION_CONFIDENCE_THRESHOLD, MAX_PAGINATION_PAGES
+from markdown import read_raw_data_many
+from storage import get_storage
 from pydantic import BaseModel, create_model
-from llm_calls import call_llm_model
-
-supabase = get_supabase_client()
+from llm_calls import acall_llm_model, record_cached_tokens
+from utils import run_async
+from validation import InvalidResponse, repair_json, validate_response, with_retries
+import accounting
 
 class PaginationModel(BaseModel):
     page_urls: List[str]
@@ -26,35 +33,188 @@ def build_pagination_prompt(indications: str, url: str) -> str:
         prompt += "No special user indications. Use default pagination logic.\n\n"
     return prompt
 
+LINK_PATTERN = re.compile(r"\]\(\s*<?([^)\s>]+)>?|(https?://[^\s<>()\[\]\"']+)")
+# Parameter names of a page number or offset; page sizes (pageSize, per_page, limit) don't count
+PAGE_NAME_HINT = re.compile(r"^(pg|p|pagina|seite|paged|offset|start|from|skip)$"
+                            r"|^(current_?|cur_?)?page([-_]?(num|no|nr|number|index|idx))?$", re.IGNORECASE)
+NUMBER_IN_SEGMENT = re.compile(r"^(\D*?)(\d+)(\D*)$")
+
+def _page_number_slots(url: str):
+    """
+    Yields (template_key, name, number, build) for every numeric query parameter or path
+    segment of a URL, where build(n) returns the URL with that number replaced by n.
+    """
+    parsed = urlparse(url)
+    query = parse_qsl(parsed.query, keep_blank_values=True)
+    for i, (name, value) in enumerate(query):
+        if value.isdigit():
+            others = tuple(sorted(q for j, q in enumerate(query) if j != i))
+            key = ("query", parsed.netloc, parsed.path, name, others)
+
+            def build(n, i=i):
+                new_query = list(query)
+                new_query[i] = (new_query[i][0], str(n))
+                return urlunparse(parsed._replace(query=urlencode(new_query), fragment=""))
+            yield key, name, int(value), build
+    segments = parsed.path.split("/")
+    for i, segment in enumerate(segments):
+        match = NUMBER_IN_SEGMENT.match(segment)
+        if not match:
+            continue
+        prefix, number, suffix = match.groups()
+        name = prefix.strip("-_") or (segments[i - 1] if i > 0 else "")
+        key = ("path", parsed.netloc, tuple(segments[:i]), prefix, suffix, tuple(segments[i + 1:]), parsed.query)
+
+        def build(n, i=i, prefix=prefix, suffix=suffix):
+            new_segments = list(segments)
+            new_segments[i] = f"{prefix}{n}{suffix}"
+            return urlunparse(parsed._replace(path="/".join(new_segments), fragment=""))
+        yield key, name, int(number), build
+
+def detect_pagination_urls(raw_data: str, base_url: str):
+    """
+    Finds links whose only difference is an increasing page number (query or path parameter)
+    and builds the full list of page URLs against base_url, without calling the LLM.
+    Returns ({"page_urls": [...]}, confidence) where confidence is between 0 and 1.
+    """
+    base_host = urlparse(base_url).netloc
+    candidates = defaultdict(lambda: {"name": "", "numbers": set(), "build": None})
+    for match in LINK_PATTERN.finditer(raw_data or ""):
+        url = urljoin(base_url, match.group(1) or match.group(2))
+        if urlparse(url).netloc != base_host:
+            continue
+        for key, name, number, build in _page_number_slots(url):
+            candidate = candidates[key]
+            candidate["name"] = name
+            candidate["numbers"].add(number)
+            candidate["build"] = build
+
+    best_urls, best_confidence = [], 0.0
+    for candidate in candidates.values():
+        numbers = sorted(candidate["numbers"])
+        if len(numbers) < 2:
+            continue
+        step = reduce(gcd, (b - a for a, b in zip(numbers, numbers[1:])))
+        first = numbers[0]
+        count = (numbers[-1] - first) // step + 1
+        if count > MAX_PAGINATION_PAGES:
+            continue
+        confidence = 0.3
+        if PAGE_NAME_HINT.search(candidate["name"]):
+            confidence += 0.4
+        if len(numbers) / count >= 0.5 or len(numbers) >= 3:
+            confidence += 0.2
+        starts_at_first_page = first in (0, 1)
+        follows_current_page = not starts_at_first_page and first - step in (0, 1)
+        if starts_at_first_page or follows_current_page:
+            confidence += 0.1
+        if confidence > best_confidence:
+            best_confidence = confidence
+            best_urls = [candidate["build"](first + i * step) for i in range(count)]
+            if follows_current_page:
+                # The page being analyzed is page 1 and links only to the pages after it.
+                best_urls.insert(0, base_url)
+    return {"page_urls": best_urls}, round(best_confidence, 2)
+
 def save_pagination_data(unique_name: str, pagination_data):
     if hasattr(pagination_data, "dict"):
         pagination_data = pagination_data.dict()
     if isinstance(pagination_data, str):
         try:
-            pagination_data = json.loads(pagination_data)
+            pagination_data = json.loads(repair_json(pagination_data))
         except json.JSONDecodeError:
+            print(f"WARNING: Pagination data for {unique_name} is not valid JSON, storing it as raw_text")
             pagination_data = {"raw_text": pagination_data}
-    supabase.table("scraped_data").update({
-        "pagination_data": pagination_data
-    }).eq("unique_name", unique_name).execute()
+    get_storage().write(unique_name, {"pagination_data": pagination_data})
     print(f"INFO: Pagination data saved for {unique_name}")
 
-def paginate_urls(unique_names: List[str], selected_model: str, indication: str, urls: List[str]):
+async def paginate_page_async(raw_data: str, current_url: str, selected_model: str, indication: str,
+                              limit: asyncio.Semaphore = None, run_stats: dict = None):
+    """
+    Finds the pagination URLs of one page: deterministically when the detected pattern is
+    confident enough, otherwise with the LLM. LLM responses are validated against
+    PaginationModel and retried if invalid (raises InvalidResponse when they never validate).
+    Returns (pagination_data, token_counts, cost, detected_without_llm).
+    """
+    detected, confidence = detect_pagination_urls(raw_data, current_url)
+    if confidence >= PAGINATION_CONFIDENCE_THRESHOLD:
+        print(f"INFO: Pagination pattern detected for {current_url} (confidence {confidence}), skipping LLM")
+        return detected, {"input_tokens": 0, "output_tokens": 0}, 0.0, True
+    full_indication = build_pagination_prompt(indication, current_url)
+    response_format = get_pagination_response_format()
+    limit = limit or asyncio.Semaphore(1)
+
+    async def attempt():
+        async with limit:
+            return await acall_llm_model(raw_data, response_format, selected_model, full_indication,
+                                         validator=lambda content: validate_response(content, response_format, run_stats))
+
+    pag_data, token_counts, cost = await with_retries(attempt, f"pagination of {current_url}", run_stats)
+    return pag_data, token_counts, cost, False
+
+async def paginate_urls_async(unique_names: List[str], selected_model: str, indication: str, urls: List[str], run_stats: dict = None,
+                              budget=None):
+    """
+    Detects pagination URLs for many pages at once. Numeric page patterns found in the links are
+    used directly; only low-confidence pages go to the LLM, at most MAX_CONCURRENT_LLM_CALLS in flight.
+    If run_stats is given, tokens served from the LLM response cache and the number of pages
+    resolved without the LLM ("detected_pages") are recorded in it, along with validation/retry
+    counts. Pages whose responses never validate are listed in run_stats["pagination_failures"].
+    With an accounting.Budget, each page reserves its estimated usage first and is skipped
+    (counted in run_stats["pagination_skipped"]) if that doesn't fit.
+    """
     total_input_tokens = 0
     total_output_tokens = 0
     total_cost = 0
     pagination_results = []
+    pages = []
+    raw_pages = read_raw_data_many(unique_names)
     for uniq, current_url in zip(unique_names, urls):
-        raw_data = read_raw_data(uniq)
+        raw_data = raw_pages[uniq]
         if not raw_data:
             print(f"No raw_data for {uniq}, skipping pagination.")
             continue
-        response_schema = get_pagination_response_format()
-        full_indication = build_pagination_prompt(indication, current_url)
-        pag_data, token_counts, cost = call_llm_model(raw_data, response_schema, selected_model, full_indication)
-        save_pagination_data(uniq, pag_data)
+        pages.append((uniq, current_url, raw_data))
+
+    limit = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+
+    async def paginate(uniq, current_url, raw_data):
+        estimate = {"input_tokens": 0, "output_tokens": 0, "cost": 0.0}
+        if budget is not None:
+            estimate = accounting.estimate_page(raw_data, selected_model)
+            if not budget.reserve(estimate["input_tokens"] + estimate["output_tokens"], estimate["cost"]):
+                if run_stats is not None:
+                    run_stats["pagination_skipped"] = run_stats.get("pagination_skipped", 0) + 1
+                return None, {"input_tokens": 0, "output_tokens": 0}, 0.0, False
+        try:
+            outcome = await paginate_page_async(raw_data, current_url, selected_model, indication, limit, run_stats)
+        except InvalidResponse as e:
+            if run_stats is not None:
+                run_stats.setdefault("pagination_failures", {})[uniq] = str(e)
+            outcome = (None, e.token_counts, e.cost, False)
+        if budget is not None:
+            budget.settle(estimate["input_tokens"] + estimate["output_tokens"], estimate["cost"], outcome[1], outcome[2])
+        if outcome[0] is not None:
+            save_pagination_data(uniq, outcome[0])
+        return outcome
+
+    outcomes = await asyncio.gather(*(paginate(*page) for page in pages))
+    await asyncio.to_thread(get_storage().flush)
+    for (uniq, _, _), (pag_data, token_counts, cost, detected) in zip(pages, outcomes):
         total_input_tokens += token_counts["input_tokens"]
         total_output_tokens += token_counts["output_tokens"]
         total_cost += cost
+        record_cached_tokens(run_stats, token_counts)
+        if run_stats is not None:
+            run_stats["detected_pages"] = run_stats.get("detected_pages", 0) + int(detected)
+        if pag_data is None:
+            continue
         pagination_results.append({"unique_name": uniq, "pagination_data": pag_data})
     return total_input_tokens, total_output_tokens, total_cost, pagination_results
+
+def paginate_urls(unique_names: List[str], selected_model: str, indication: str, urls: List[str], run_stats: dict = None,
+                  budget=None):
+    """
+    Synchronous wrapper for paginate_urls_async.
+    """
+    return run_async(paginate_urls_async(unique_names, selected_model, indication, urls, run_stats, budget))
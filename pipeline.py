@@ -0,0 +1,276 @@
+"""
+Streaming fetch -> preprocess -> extract -> save pipeline.
+
+Stages run concurrently and are connected by bounded queues, so page N is extracted while
+page N+1 is still loading in the browser, and each page is yielded as soon as it is saved.
+URLs are consumed lazily from any iterable and at most a few queues' worth of pages are
+in memory at once, however long the batch is.
+"""
+import asyncio
+from typing import Iterable, List
+from assets import MAX_CONCURRENT_LLM_CALLS, MAX_CONCURRENT_FETCHES, PIPELINE_QUEUE_SIZE
+from markdown import FetchLimits, crawl_page, store_fetched_page
+from preprocess import StreamingPreprocessor
+from scraper import create_dynamic_listing_model, create_listings_container_model, extract_page_async, plan_page, \
+    save_formatted_data
+from pagination import paginate_page_async, save_pagination_data
+from llm_calls import record_cached_tokens
+from storage import get_storage
+import fetch_cache
+import accounting
+from wrappers import TemplateSession
+from batching import PagePacker
+from validation import InvalidResponse
+
+_DONE = object()
+
+async def _fetch_stage(urls: Iterable[str], limits: FetchLimits, out: asyncio.Queue, run_stats: dict, budget=None,
+                       keep_html: bool = False):
+    """
+    Resolves every URL from the fetch cache, a static fetch or the shared browser and queues
+    (url, unique_name, markdown). The browser is only started if a page needs it.
+    With keep_html, fetched pages are stored with their HTML (for templates).
+    Once the budget is exhausted, the remaining URLs are queued as (url, None, None) without fetching.
+    """
+    in_flight = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+
+    async def fetch_one(url):
+        try:
+            if budget is not None and budget.exhausted():
+                await out.put((url, None, None))
+                return
+            entry = await asyncio.to_thread(fetch_cache.lookup, url)
+            if fetch_cache.is_fresh(entry):
+                run_stats["cache_hits"] = run_stats.get("cache_hits", 0) + 1
+            elif entry:
+                (unchanged,) = await fetch_cache.revalidate_async([(url, entry)])
+                if unchanged:
+                    fetch_cache.touch(url, entry)
+                    run_stats["cache_revalidated"] = run_stats.get("cache_revalidated", 0) + 1
+                else:
+                    entry = None
+            if entry:
+                await out.put((url, entry["unique_name"], entry["raw_data"]))
+                return
+            run_stats["cache_misses"] = run_stats.get("cache_misses", 0) + 1
+            result = await crawl_page(None, url, limits)
+            unique_name = store_fetched_page(result, keep_html)
+            run_stats[f"{result['tier']}_fetches"] = run_stats.get(f"{result['tier']}_fetches", 0) + 1
+            if result["error"]:
+                run_stats.setdefault("failures", {})[url] = result["error"]
+            await out.put((url, unique_name, result["markdown"]))
+        finally:
+            in_flight.release()
+
+    tasks = set()
+    for url in urls:
+        await in_flight.acquire()
+        task = asyncio.create_task(fetch_one(url))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    while tasks:
+        await asyncio.gather(*tasks)
+    await out.put(_DONE)
+
+async def _preprocess_stage(source: asyncio.Queue, out: asyncio.Queue, preprocessor: StreamingPreprocessor,
+                            workers: int, run_stats: dict):
+    """Strips boilerplate and compacts links, then queues (url, unique_name, raw_data, markdown, link_map)."""
+    while True:
+        item = await source.get()
+        if item is _DONE:
+            break
+        url, unique_name, raw_data = item
+        if not raw_data:
+            await out.put((url, unique_name, raw_data, "", {}))
+            continue
+        markdown, link_map = preprocessor.process(unique_name, raw_data, run_stats)
+        await out.put((url, unique_name, raw_data, markdown, link_map))
+    for _ in range(workers):
+        await out.put(_DONE)
+
+def _add_usage(page: dict, token_counts: dict, cost: float, pagination: bool = False) -> None:
+    """Adds the usage of one LLM call to a page's totals, and to their pagination share for pagination calls."""
+    for key in ("input_tokens", "output_tokens"):
+        page[key] += token_counts.get(key, 0)
+        if pagination:
+            page[f"pagination_{key}"] += token_counts.get(key, 0)
+    page["cost"] += cost
+    if pagination:
+        page["pagination_cost"] += cost
+
+async def _extract_worker(source: asyncio.Queue, out: asyncio.Queue, container, fields: List[str], selected_model: str,
+                          indication, limit: asyncio.Semaphore, budget=None, run_stats: dict = None, templates=None,
+                          packer=None):
+    """
+    Runs listing extraction (and pagination detection if requested) for queued pages.
+    Pages extracted before with the same fields only send their new blocks (see incremental.py).
+    With a wrappers.TemplateSession, pages of a site with a learned template skip the LLM.
+    With a batching.PagePacker, small pages are extracted several to a request.
+    With a budget, each page reserves its estimated usage first and is skipped if that doesn't fit.
+    """
+    while True:
+        item = await source.get()
+        if item is _DONE:
+            await out.put(_DONE)
+            return
+        url, unique_name, raw_data, markdown, link_map = item
+        page = {"url": url, "unique_name": unique_name, "parsed_data": None, "pagination_data": None,
+                "input_tokens": 0, "output_tokens": 0, "cost": 0.0, "error": None,
+                "pagination_input_tokens": 0, "pagination_output_tokens": 0, "pagination_cost": 0.0}
+        if raw_data is None:
+            page["error"] = "skipped: budget exhausted"
+            await out.put(page)
+            continue
+        if not raw_data:
+            page["error"] = "no raw_data"
+            await out.put(page)
+            continue
+        plan = None
+        if container is not None:
+            plan = await asyncio.to_thread(plan_page, url, fields, raw_data, markdown, selected_model, run_stats)
+        estimate = {"input_tokens": 0, "output_tokens": 0, "cost": 0.0}
+        if budget is not None:
+            if indication is not None:
+                # The pagination call reads the whole page
+                estimate = accounting.estimate_page(markdown, selected_model)
+            if plan is not None and (plan["carried"] is None or plan["markdown"].strip()):
+                extraction = accounting.estimate_page(plan["markdown"], selected_model)
+                estimate = {key: estimate[key] + extraction[key] for key in estimate}
+            if not budget.reserve(estimate["input_tokens"] + estimate["output_tokens"], estimate["cost"]):
+                page["error"] = "skipped: over budget"
+                await out.put(page)
+                continue
+        paginating = False
+        try:
+            if plan is not None:
+                async def llm_extract():
+                    if packer is not None:
+                        return await packer.extract(plan, link_map, url)
+                    return await extract_page_async(plan, link_map, container, selected_model, limit, run_stats, url)
+
+                if templates is not None:
+                    html = await asyncio.to_thread(get_storage().read, unique_name, "raw_html")
+                    parsed, token_counts, cost = await templates.extract(url, html, llm_extract, run_stats)
+                else:
+                    parsed, token_counts, cost = await llm_extract()
+                page["parsed_data"] = parsed
+                page["extraction_key"] = plan["key"]
+                _add_usage(page, token_counts, cost)
+                page["token_counts"] = token_counts
+            if indication is not None:
+                paginating = True
+                pag_data, token_counts, cost, detected = await paginate_page_async(raw_data, url, selected_model, indication, limit, run_stats)
+                page["pagination_data"] = pag_data
+                _add_usage(page, token_counts, cost, pagination=True)
+                page["pagination_token_counts"] = token_counts
+                page["detected_pagination"] = detected
+        except InvalidResponse as e:
+            _add_usage(page, e.token_counts, e.cost, pagination=paginating)
+            page["error"] = f"invalid response: {e}"
+        except Exception as e:
+            print(f"WARNING: Extraction failed for {url}: {e}")
+            page["error"] = str(e) or type(e).__name__
+        if budget is not None:
+            budget.settle(estimate["input_tokens"] + estimate["output_tokens"], estimate["cost"], page, page["cost"])
+        await out.put(page)
+
+async def run_pipeline_async(urls: Iterable[str], fields: List[str], selected_model: str,
+                             indication: str = None, run_stats: dict = None, budget=None, use_templates: bool = False,
+                             fetch_profile: str = None, pack_pages: bool = False, before_save=None):
+    """
+    Async generator over a streaming scrape of `urls`. Listings are extracted when `fields`
+    is non-empty, pagination URLs are detected when `indication` is not None (use "" for none).
+    Yields one dict per page, in completion order, right after it is saved:
+    {"url", "unique_name", "parsed_data", "pagination_data", "input_tokens", "output_tokens", "cost", "error"},
+    plus the pagination share of its usage (pagination_input_tokens, pagination_output_tokens, pagination_cost).
+    Cache, preprocessing, token and validation/retry statistics accumulate in run_stats.
+    With an accounting.Budget, pages that don't fit it are skipped (error starts with "skipped").
+    With use_templates, CSS selector templates are learned per site and reused (see wrappers.py).
+    Pages that need the browser are loaded under `fetch_profile` (see fetch_profiles.py).
+    With pack_pages, small pages are extracted several to a request (see batching.py).
+    before_save(page) is called (in a thread) before each page is saved; pages it returns False
+    for are not saved and are yielded without their data (see worker.py).
+    """
+    run_stats = run_stats if run_stats is not None else {}
+    container = None
+    if fields:
+        container = create_listings_container_model(create_dynamic_listing_model(fields))
+
+    fetched = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    prepared = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    extracted = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    limit = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+    workers = MAX_CONCURRENT_LLM_CALLS
+    templates = TemplateSession(fields) if use_templates and fields else None
+    packer = PagePacker(fields, selected_model, limit, run_stats) if pack_pages and fields else None
+
+    tasks = [
+        asyncio.create_task(_fetch_stage(urls, FetchLimits(profile=fetch_profile), fetched, run_stats, budget,
+                                         keep_html=templates is not None)),
+        asyncio.create_task(_preprocess_stage(fetched, prepared, StreamingPreprocessor(selected_model), workers, run_stats)),
+    ]
+    tasks += [asyncio.create_task(_extract_worker(prepared, extracted, container, fields, selected_model, indication, limit, budget, run_stats, templates, packer))
+              for _ in range(workers)]
+
+    running = set(tasks)
+    getter = None
+    try:
+        finished_workers = 0
+        while finished_workers < workers:
+            if getter is None:
+                getter = asyncio.ensure_future(extracted.get())
+            done, _ = await asyncio.wait({getter, *running}, return_when=asyncio.FIRST_COMPLETED)
+            for task in done & running:
+                running.discard(task)
+                if task.exception():
+                    raise task.exception()
+            if getter not in done:
+                continue
+            page, getter = getter.result(), None
+            if page is _DONE:
+                finished_workers += 1
+                continue
+            # Persistence stage: buffered writes through the storage layer.
+            if before_save is not None and not await asyncio.to_thread(before_save, page):
+                page["parsed_data"] = page["pagination_data"] = None
+            if page["parsed_data"] is not None:
+                save_formatted_data(page["unique_name"], page["parsed_data"], page.pop("extraction_key"))
+                record_cached_tokens(run_stats, page.pop("token_counts"))
+            if page["pagination_data"] is not None:
+                save_pagination_data(page["unique_name"], page["pagination_data"])
+                record_cached_tokens(run_stats, page.pop("pagination_token_counts"))
+                run_stats["detected_pages"] = run_stats.get("detected_pages", 0) + int(page.pop("detected_pagination"))
+            for key in ("input_tokens", "output_tokens", "pagination_input_tokens", "pagination_output_tokens", "pagination_cost"):
+                run_stats[key] = run_stats.get(key, 0) + page[key]
+            run_stats["total_cost"] = run_stats.get("total_cost", 0) + page["cost"]
+            run_stats["pages_done"] = run_stats.get("pages_done", 0) + 1
+            if (page["error"] or "").startswith("skipped"):
+                run_stats["pages_skipped"] = run_stats.get("pages_skipped", 0) + 1
+            elif (page["error"] or "").startswith("invalid response"):
+                run_stats.setdefault("extraction_failures", {})[page["url"]] = page["error"]
+            yield page
+    finally:
+        for task in [*tasks, *([getter] if getter else [])]:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.to_thread(get_storage().flush)
+
+def run_pipeline(urls: Iterable[str], fields: List[str], selected_model: str,
+                 indication: str = None, run_stats: dict = None, budget=None, use_templates: bool = False,
+                 fetch_profile: str = None, pack_pages: bool = False, before_save=None):
+    """
+    Synchronous generator wrapper for run_pipeline_async (drives its own event loop).
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    pages = run_pipeline_async(urls, fields, selected_model, indication, run_stats, budget, use_templates, fetch_profile,
+                               pack_pages, before_save)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(pages.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(pages.aclose())
+        loop.close()
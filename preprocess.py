@@ -0,0 +1,162 @@
+"""
+Pre-LLM cleanup of page markdown.
+
+- Boilerplate stripping: blocks (paragraphs, menus, footers, cookie banners) that repeat
+  across most distinct pages of the same domain are removed before extraction (a page is
+  never stripped down to nothing). Each domain keeps
+  only the boilerplate of its latest batch of pages, for the BOILERPLATE_MAX_DOMAINS most
+  recently seen domains.
+- Link compaction: long URLs are swapped for short link://N tokens and put back into
+  the parsed output afterwards.
+"""
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict, defaultdict, deque
+from accounting import estimate_tokens
+from assets import (BOILERPLATE_MIN_PAGES, BOILERPLATE_RATIO, BOILERPLATE_WINDOW, BOILERPLATE_MAX_DOMAINS,
+                    LINK_COMPACT_MIN_LENGTH)
+
+BLOCK_SEPARATOR = re.compile(r"\n\s*\n")
+URL_PATTERN = re.compile(r"https?://[^\s<>()\[\]\"']+")
+LINK_TOKEN = re.compile(r"link://(\d+)")
+UNIQUE_NAME_TIMESTAMP = re.compile(r"_\d{4}_\d{2}_\d{2}__\d{2}_\d{2}_\d{2}_\d+$")
+
+# Domain -> boilerplate block hashes of its latest batch, least recently used domain first
+_known_boilerplate = OrderedDict()
+_known_lock = threading.Lock()
+
+def domain_of(unique_name: str) -> str:
+    """Returns the domain part of a unique name produced by utils.generate_unique_name."""
+    return UNIQUE_NAME_TIMESTAMP.sub("", unique_name)
+
+def _block_hash(block: str) -> str:
+    return hashlib.sha1(" ".join(block.split()).encode("utf-8")).hexdigest()
+
+def find_boilerplate(markdowns: list) -> set:
+    """
+    Hashes of the blocks that repeat on at least BOILERPLATE_RATIO of the given pages
+    (and on at least BOILERPLATE_MIN_PAGES pages). Identical pages (the same URL fetched twice)
+    count once, or all of their blocks would look like boilerplate.
+    """
+    markdowns = list({_block_hash(markdown): markdown for markdown in markdowns}.values())
+    if len(markdowns) < BOILERPLATE_MIN_PAGES:
+        return set()
+    counts = defaultdict(int)
+    for markdown in markdowns:
+        for block_hash in {_block_hash(b) for b in BLOCK_SEPARATOR.split(markdown) if b.strip()}:
+            counts[block_hash] += 1
+    threshold = max(BOILERPLATE_MIN_PAGES, BOILERPLATE_RATIO * len(markdowns))
+    return {h for h, count in counts.items() if count >= threshold}
+
+def learn_boilerplate(domain: str, markdowns: list) -> set:
+    """
+    Returns the boilerplate of a domain. With enough pages it is learned from them and replaces
+    what was known (so a block stops being stripped once the domain's pages no longer repeat it),
+    otherwise the domain's last learned boilerplate is used.
+    """
+    learned = find_boilerplate(markdowns) if len(markdowns) >= BOILERPLATE_MIN_PAGES else None
+    with _known_lock:
+        if learned is not None:
+            _known_boilerplate[domain] = learned
+        boilerplate = _known_boilerplate.get(domain, set())
+        if domain in _known_boilerplate:
+            _known_boilerplate.move_to_end(domain)
+        while len(_known_boilerplate) > BOILERPLATE_MAX_DOMAINS:
+            _known_boilerplate.popitem(last=False)
+    return boilerplate
+
+def strip_boilerplate(markdown: str, boilerplate: set) -> str:
+    """Removes every block whose hash is in `boilerplate`, unless that would leave nothing."""
+    if not boilerplate:
+        return markdown
+    blocks = BLOCK_SEPARATOR.split(markdown)
+    stripped = "\n\n".join(b for b in blocks if b.strip() and _block_hash(b) not in boilerplate)
+    return stripped if stripped.strip() else markdown
+
+def compact_links(markdown: str):
+    """
+    Replaces URLs of LINK_COMPACT_MIN_LENGTH characters or more with link://N tokens.
+    Returns (compacted_markdown, link_map) where link_map maps "N" to the real URL.
+    """
+    link_map = {}
+    by_url = {}
+
+    def replace(match):
+        url = match.group(0)
+        if len(url) < LINK_COMPACT_MIN_LENGTH:
+            return url
+        if url not in by_url:
+            by_url[url] = str(len(by_url) + 1)
+            link_map[by_url[url]] = url
+        return f"link://{by_url[url]}"
+
+    return URL_PATTERN.sub(replace, markdown), link_map
+
+def restore_links(parsed, link_map: dict):
+    """
+    Puts the real URLs back into a parsed LLM result (JSON string, dict or list).
+    """
+    if not link_map:
+        return parsed
+    if isinstance(parsed, str):
+        def replace(match):
+            url = link_map.get(match.group(1))
+            if url is None:
+                return match.group(0)
+            return json.dumps(url)[1:-1] if parsed.lstrip().startswith(("{", "[")) else url
+        return LINK_TOKEN.sub(replace, parsed)
+    if isinstance(parsed, dict):
+        return {k: restore_links(v, link_map) for k, v in parsed.items()}
+    if isinstance(parsed, list):
+        return [restore_links(v, link_map) for v in parsed]
+    return parsed
+
+def preprocess_pages(pages: list, model: str, run_stats: dict = None) -> list:
+    """
+    Strips cross-page boilerplate and compacts links for a batch of (unique_name, raw_data) pages.
+    Returns a list of (unique_name, cleaned_markdown, link_map) in the same order.
+    If run_stats is given, the number of input tokens saved is added under "tokens_saved".
+    """
+    by_domain = defaultdict(list)
+    for uniq, raw_data in pages:
+        by_domain[domain_of(uniq)].append(raw_data)
+    boilerplate = {domain: learn_boilerplate(domain, markdowns) for domain, markdowns in by_domain.items()}
+
+    processed = []
+    tokens_before = 0
+    tokens_after = 0
+    for uniq, raw_data in pages:
+        cleaned = strip_boilerplate(raw_data, boilerplate[domain_of(uniq)])
+        cleaned, link_map = compact_links(cleaned)
+        tokens_before += estimate_tokens(raw_data, model)
+        tokens_after += estimate_tokens(cleaned, model)
+        processed.append((uniq, cleaned, link_map))
+
+    saved = tokens_before - tokens_after
+    print(f"INFO: Preprocessing saved {saved} of {tokens_before} input tokens")
+    if run_stats is not None:
+        run_stats["tokens_saved"] = run_stats.get("tokens_saved", 0) + saved
+    return processed
+
+class StreamingPreprocessor:
+    """
+    Preprocessing for pages that arrive one at a time (see pipeline.py): boilerplate is
+    learned from a sliding window of the last `window` pages of each domain, so memory
+    stays bounded however many pages pass through.
+    """
+    def __init__(self, model: str, window: int = BOILERPLATE_WINDOW):
+        self.model = model
+        self.recent = defaultdict(lambda: deque(maxlen=window))
+
+    def process(self, uniq: str, raw_data: str, run_stats: dict = None):
+        """Returns (cleaned_markdown, link_map) for one page."""
+        domain = domain_of(uniq)
+        self.recent[domain].append(raw_data)
+        boilerplate = learn_boilerplate(domain, list(self.recent[domain]))
+        cleaned, link_map = compact_links(strip_boilerplate(raw_data, boilerplate))
+        if run_stats is not None:
+            saved = estimate_tokens(raw_data, self.model) - estimate_tokens(cleaned, self.model)
+            run_stats["tokens_saved"] = run_stats.get("tokens_saved", 0) + saved
+        return cleaned, link_map
@@ -0,0 +1,68 @@
+"""
+Token-bucket rate limiting for LLM providers.
+
+Each model in MODELS_USED gets one ProviderLimiter with a requests-per-minute and a
+tokens-per-minute bucket. Limiters hold no asyncio primitives, so they can be shared
+by event loops created with utils.run_async and by worker threads.
+"""
+import asyncio
+import threading
+import time
+from assets import MODEL_RATE_LIMITS, DEFAULT_RATE_LIMITS
+
+class TokenBucket:
+    """
+    Classic token bucket: holds up to `capacity` tokens and refills `capacity` per `period` seconds.
+    Reservations may drive the balance negative; the caller then sleeps until it is repaid.
+    """
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Takes `amount` tokens and returns how many seconds to wait before using them."""
+        amount = min(amount, self.capacity)
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+class ProviderLimiter:
+    """Requests-per-minute and tokens-per-minute limits for one provider, plus 429 cool-downs."""
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.blocked_until = 0.0
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        """Waits until one request carrying `estimated_tokens` tokens may be sent."""
+        wait = max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+        wait = max(wait, self.blocked_until - time.monotonic())
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def consume(self, tokens: int) -> None:
+        """Charges tokens that were only known after the call (e.g. output tokens)."""
+        self.tokens.reserve(tokens)
+
+    def back_off(self, seconds: float) -> None:
+        """Pauses every caller of this provider for `seconds` (used after a 429)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(model: str) -> ProviderLimiter:
+    """Returns the shared limiter for a model, creating it from MODEL_RATE_LIMITS on first use."""
+    with _limiters_lock:
+        if model not in _limiters:
+            limits = MODEL_RATE_LIMITS.get(model, DEFAULT_RATE_LIMITS)
+            _limiters[model] = ProviderLimiter(limits["rpm"], limits["tpm"])
+        return _limiters[model]
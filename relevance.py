@@ -0,0 +1,200 @@
+"""
+Field-aware selection of the page markdown sent to the model.
+
+Pages larger than RELEVANCE_MIN_PAGE_TOKENS are split into blocks (headings, list items and paragraphs,
+see chunking.split_blocks) and only the blocks likely to hold the requested fields are sent,
+in page order: blocks scoring below RELEVANCE_MIN_RELATIVE_SCORE of the page's top scores are
+dropped. Listings are kept whatever they score (their text rarely names the fields): blocks
+that look like records (list items, table rows, blocks with links, prices or images) and whose
+shape repeats across the page are always sent. Of the rest, listing-like blocks are all kept
+however long the page is, and the extractor chunks them (chunking.py); the other blocks are
+taken best first up to RELEVANCE_TOKEN_BUDGET. A block's score combines
+- BM25 of the block against the field names and their usual wording (FIELD_HINTS),
+- value shapes of the fields (prices, dates, links, ...) found in the block,
+- structure: list items and table rows, and blocks whose shape repeats across the page,
+  since listings are rendered from one template.
+The recall of the selection (the share of values of a
+previous full extraction that are still in the selected text) is measured with measure_recall,
+or for a finished job with `python cli.py relevance <job_id>`.
+"""
+import math
+import re
+from collections import Counter
+from typing import List
+from chunking import split_blocks
+from preprocess import LINK_TOKEN, URL_PATTERN
+import accounting
+from assets import (RELEVANCE_FILTER, RELEVANCE_MIN_PAGE_TOKENS, RELEVANCE_TOKEN_BUDGET, RELEVANCE_MIN_RELATIVE_SCORE,
+                    RELEVANCE_STRUCTURE_WEIGHT, RELEVANCE_SHAPE_WEIGHT, RELEVANCE_MIN_REPEATS)
+
+WORD = re.compile(r"[a-z0-9]+")
+MONEY = re.compile(r"[$€£¥₹]\s?\d|\d\s?(usd|eur|gbp|inr)\b", re.I)
+NUMBER = re.compile(r"\d")
+DATE = re.compile(r"\b\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}\b|\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.? \d", re.I)
+LINK = re.compile(r"\]\((link://\d+|https?://[^)]+)\)")
+IMAGE = re.compile(r"!\[[^\]]*\]\(")
+EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+")
+PHONE = re.compile(r"\+?\d[\d\s().-]{7,}\d")
+TABLE_ROW = re.compile(r"^\s*\|", re.M)
+LIST_ITEM = re.compile(r"^\s{0,3}([-*+]|\d+[.)])\s")
+
+# Words pages commonly use for a field, and the shape of its values
+FIELD_HINTS = {
+    "price": (["price", "cost", "sale", "usd", "eur", "per"], MONEY),
+    "cost": (["price", "cost", "fee"], MONEY),
+    "salary": (["salary", "pay", "year", "hour", "per"], MONEY),
+    "title": (["title", "name"], None),
+    "name": (["name", "title"], None),
+    "location": (["location", "city", "address", "remote", "street"], None),
+    "address": (["address", "street", "city", "road"], None),
+    "date": (["date", "posted", "published", "ago"], DATE),
+    "posted": (["posted", "ago", "date"], DATE),
+    "url": (["link", "url"], LINK),
+    "link": (["link", "url"], LINK),
+    "image": (["image", "photo"], IMAGE),
+    "email": (["email", "mail", "contact"], EMAIL),
+    "phone": (["phone", "tel", "call", "mobile"], PHONE),
+    "rating": (["rating", "stars", "reviews", "out"], NUMBER),
+    "reviews": (["reviews", "ratings"], NUMBER),
+    "bedrooms": (["bed", "beds", "bedroom", "bedrooms", "bd"], NUMBER),
+    "bathrooms": (["bath", "baths", "bathroom", "bathrooms", "ba"], NUMBER),
+}
+
+def _words(text: str) -> List[str]:
+    # Link targets carry no wording of their own
+    text = LINK_TOKEN.sub(" ", URL_PATTERN.sub(" ", text))
+    return WORD.findall(re.sub(r"([a-z])([A-Z])", r"\1 \2", text).lower())
+
+def field_terms(fields: List[str]):
+    """Query terms and value patterns for the requested fields."""
+    terms, shapes = [], []
+    for field in fields:
+        words = _words(field.replace("_", " "))
+        terms += words
+        for word in words:
+            hint_terms, shape = FIELD_HINTS.get(word) or FIELD_HINTS.get(word.rstrip("s"), ([], None))
+            terms += hint_terms
+            if shape is not None and shape not in shapes:
+                shapes.append(shape)
+    return list(dict.fromkeys(terms)), shapes
+
+def _shape(block: str) -> str:
+    """Rough template signature of a block: its kind and where digits, links and line breaks fall."""
+    kind = "row" if TABLE_ROW.match(block) else "item" if LIST_ITEM.match(block) else "heading" if block.startswith("#") else "text"
+    return f"{kind}:{len(block.strip().splitlines())}:{len(LINK.findall(block))}:{bool(MONEY.search(block))}:{bool(IMAGE.search(block))}"
+
+def score_blocks(blocks: List[str], fields: List[str]) -> List[float]:
+    """Relevance of each block to the fields (BM25 + value shapes + structure)."""
+    terms, shapes = field_terms(fields)
+    docs = [Counter(_words(block)) for block in blocks]
+    lengths = [sum(doc.values()) for doc in docs]
+    average = sum(lengths) / len(lengths) if lengths else 0
+    frequency = {term: sum(1 for doc in docs if term in doc) for term in terms}
+    shape_counts = Counter(_shape(block) for block in blocks)
+    k1, b = 1.2, 0.75
+    scores = []
+    for block, doc, length in zip(blocks, docs, lengths):
+        bm25 = 0.0
+        for term in terms:
+            if doc[term]:
+                idf = math.log(1 + (len(blocks) - frequency[term] + 0.5) / (frequency[term] + 0.5))
+                bm25 += idf * doc[term] * (k1 + 1) / (doc[term] + k1 * (1 - b + b * length / (average or 1)))
+        shape_hits = sum(1 for shape in shapes if shape.search(block))
+        repeats = shape_counts[_shape(block)]
+        structure = (TABLE_ROW.match(block) is not None or LIST_ITEM.match(block) is not None) \
+            + (math.log(repeats) if repeats >= RELEVANCE_MIN_REPEATS else 0)
+        relevant = bm25 > 0 or shape_hits > 0
+        scores.append(bm25 + RELEVANCE_SHAPE_WEIGHT * shape_hits + (RELEVANCE_STRUCTURE_WEIGHT * structure if relevant else 0))
+    return scores
+
+def _listing_like(block: str, repeats: int) -> bool:
+    return TABLE_ROW.match(block) is not None or LIST_ITEM.match(block) is not None or repeats >= RELEVANCE_MIN_REPEATS
+
+def _repeated_record(block: str, repeats: int) -> bool:
+    """A block rendered from a listing template: record-like and of a shape that repeats."""
+    record = TABLE_ROW.match(block) or LIST_ITEM.match(block) or LINK.search(block) or MONEY.search(block) \
+        or IMAGE.search(block)
+    return record is not None and repeats >= RELEVANCE_MIN_REPEATS
+
+def select_relevant(markdown: str, fields: List[str], model: str, budget: int = RELEVANCE_TOKEN_BUDGET,
+                    run_stats: dict = None) -> str:
+    """
+    The relevant blocks of `markdown` for the fields, in page order: all repeated records
+    whatever their score, the other relevant listing-like blocks, and the best remaining
+    blocks within `budget` tokens.
+    Pages under RELEVANCE_MIN_PAGE_TOKENS are returned unchanged.
+    If run_stats is given, relevance_pages and relevance_tokens_saved are recorded in it.
+    """
+    if not RELEVANCE_FILTER:
+        return markdown
+    return _select(markdown, fields, model, budget, run_stats)
+
+def _select(markdown: str, fields: List[str], model: str, budget: int, run_stats: dict = None) -> str:
+    total = accounting.estimate_tokens(markdown, model)
+    if not fields or total <= RELEVANCE_MIN_PAGE_TOKENS:
+        return markdown
+    blocks = split_blocks(markdown)
+    scores = score_blocks(blocks, fields)
+    ranked = sorted(range(len(blocks)), key=lambda i: -scores[i])
+    # Relative to the 90th percentile, so one outstanding block doesn't set the bar for all listings
+    threshold = max(RELEVANCE_MIN_RELATIVE_SCORE * scores[ranked[len(ranked) // 10]], 1e-9)
+    shapes = [_shape(block) for block in blocks]
+    shape_counts = Counter(shapes)
+    chosen, used, capped = set(), 0, 0
+    for i in ranked:
+        repeats = shape_counts[shapes[i]]
+        if scores[i] < threshold and not _repeated_record(blocks[i], repeats):
+            continue
+        tokens = accounting.estimate_tokens(blocks[i], model)
+        # Listings are never cut by the budget, only the text around them
+        if _listing_like(blocks[i], repeats):
+            chosen.add(i)
+            used += tokens
+        elif capped + tokens <= budget:
+            chosen.add(i)
+            used += tokens
+            capped += tokens
+    if not chosen or used >= total:
+        return markdown
+    selected = "".join(blocks[i] for i in sorted(chosen))
+    if run_stats is not None:
+        run_stats["relevance_pages"] = run_stats.get("relevance_pages", 0) + 1
+        run_stats["relevance_tokens_saved"] = run_stats.get("relevance_tokens_saved", 0) + total - used
+    return selected
+
+def _norm(text) -> str:
+    return " ".join(str(text or "").lower().split())
+
+def measure_recall(markdown: str, listings: list, fields: List[str], model: str, budget: int = RELEVANCE_TOKEN_BUDGET) -> dict:
+    """
+    How much of a known extraction survives the selection: the share of the listings' field
+    values (and of whole listings) found in the selected text, and the share of tokens kept.
+    """
+    selected = _norm(_select(markdown, fields, model, budget))
+    values = [_norm(listing.get(field)) for listing in listings if isinstance(listing, dict) for field in fields]
+    values = [value for value in values if value]
+    complete = [listing for listing in listings if isinstance(listing, dict)
+                and all(_norm(listing.get(field)) in selected for field in fields)]
+    return {
+        "value_recall": sum(value in selected for value in values) / len(values) if values else 1.0,
+        "listing_recall": len(complete) / len(listings) if listings else 1.0,
+        "values": len(values),
+        "token_share": accounting.estimate_tokens(selected, model) / accounting.estimate_tokens(markdown, model),
+    }
+
+def recall_report(unique_names: List[str], fields: List[str], model: str, budget: int = RELEVANCE_TOKEN_BUDGET) -> dict:
+    """
+    measure_recall over stored pages (raw_data against their saved listings), e.g. of a job
+    run with RELEVANCE_FILTER off (the selection is measured either way). Returns the averages and the per-page results.
+    """
+    from storage import get_storage
+    stored = get_storage().read_many(unique_names, ["raw_data", "formatted_data"])
+    pages = {}
+    for name in unique_names:
+        row = stored.get(name) or {}
+        parsed = row.get("formatted_data")
+        if row.get("raw_data") and isinstance(parsed, dict) and isinstance(parsed.get("listings"), list):
+            pages[name] = measure_recall(row["raw_data"], parsed["listings"], fields, model, budget)
+    summary = {key: sum(page[key] for page in pages.values()) / len(pages) if pages else None
+               for key in ("value_recall", "listing_recall", "token_share")}
+    return {**summary, "pages": len(pages), "per_page": pages}
@@ -1,13 +1,19 @@
+import asyncio
 import json
 from typing import List
 from pydantic import BaseModel, create_model
-from assets import OPENAI_MODEL_FULLNAME, GEMINI_MODEL_FULLNAME, SYSTEM_MESSAGE
-from llm_calls import call_llm_model
-from markdown import read_raw_data
-from api_management import get_supabase_client
-from utils import generate_unique_name
-
-supabase = get_supabase_client()
+from assets import OPENAI_MODEL_FULLNAME, GEMINI_MODEL_FULLNAME, SYSTEM_MESSAGE, MAX_CONCURRENT_LLM_CALLS
+from llm_calls import acall_llm_model, record_cached_tokens
+from chunking import chunk_budget, split_markdown
+from preprocess import preprocess_pages, restore_links
+from markdown import read_raw_data_many
+from storage import get_storage
+from incremental import plan_extraction
+from relevance import select_relevant
+from wrappers import TemplateSession
+from validation import InvalidResponse, add_token_counts, repair_json, validate_response, with_retries
+from utils import generate_unique_name, run_async
+import accounting
 
 def create_dynamic_listing_model(field_names: List[str]):
     field_definitions = {field: (str, ...) for field in field_names}
@@ -34,37 +40,213 @@ def generate_system_message(listing_model: BaseModel) -> str:
 """
     return final_prompt
 
-def save_formatted_data(unique_name: str, formatted_data):
+def save_formatted_data(unique_name: str, formatted_data, extraction_key: str = None):
     if isinstance(formatted_data, str):
         try:
-            data_json = json.loads(formatted_data)
+            data_json = json.loads(repair_json(formatted_data))
         except json.JSONDecodeError:
+            print(f"WARNING: Scraped data for {unique_name} is not valid JSON, storing it as raw_text")
             data_json = {"raw_text": formatted_data}
     elif hasattr(formatted_data, "dict"):
         data_json = formatted_data.dict()
     else:
         data_json = formatted_data
-    supabase.table("scraped_data").update({
-        "formatted_data": data_json
-    }).eq("unique_name", unique_name).execute()
+    columns = {"formatted_data": data_json}
+    if extraction_key:
+        # Tags the row as the latest extraction of its URL and fields (see incremental.py).
+        columns["extraction_key"] = extraction_key
+    get_storage().write(unique_name, columns)
     print(f"INFO: Scraped data saved for {unique_name}")
 
-def scrape_urls(unique_names: List[str], fields: List[str], selected_model: str):
+def _listing_key(listing: dict) -> str:
+    normalized = {k: " ".join(str(v).lower().split()) for k, v in listing.items()}
+    return json.dumps(normalized, sort_keys=True)
+
+def merge_listings(parsed_chunks: list) -> dict:
+    """
+    Merges the per-chunk extraction results into one {"listings": [...]} dict,
+    dropping duplicate listings (same values ignoring case and whitespace).
+    """
+    merged = []
+    seen = set()
+    for parsed in parsed_chunks:
+        if isinstance(parsed, str):
+            try:
+                parsed = json.loads(parsed)
+            except json.JSONDecodeError:
+                print("WARNING: Could not parse chunk output, skipping it.")
+                continue
+        elif hasattr(parsed, "model_dump"):
+            parsed = parsed.model_dump()
+        for listing in (parsed or {}).get("listings", []):
+            if not isinstance(listing, dict):
+                continue
+            key = _listing_key(listing)
+            if key not in seen:
+                seen.add(key)
+                merged.append(listing)
+    return {"listings": merged}
+
+async def extract_listings_async(raw_data: str, response_format, selected_model: str, system_message: str,
+                                 limit: asyncio.Semaphore = None, run_stats: dict = None, label: str = "page"):
+    """
+    Extracts listings from one page. Pages larger than the model's budget are split into
+    chunks that are extracted in parallel and merged (map-reduce).
+    Every response is validated against response_format; only the chunks with invalid
+    responses are retried. If some chunks still fail, the others are kept and the failure is
+    counted (chunks_failed); if all fail, InvalidResponse is raised.
+    Returns (parsed, token_counts, cost) like call_llm_model.
+    """
+    limit = limit or asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+    chunks = split_markdown(raw_data, chunk_budget(selected_model), selected_model)
+
+    def validator(content):
+        return validate_response(content, response_format, run_stats)
+
+    async def extract_chunk(chunk, chunk_label):
+        async def attempt():
+            async with limit:
+                return await acall_llm_model(chunk, response_format, selected_model, system_message, validator=validator)
+        return await with_retries(attempt, chunk_label, run_stats)
+
+    if len(chunks) == 1:
+        return await extract_chunk(chunks[0], label)
+
+    print(f"INFO: Page split into {len(chunks)} chunks for {selected_model}")
+    outcomes = await asyncio.gather(*(extract_chunk(chunk, f"{label} (chunk {i}/{len(chunks)})")
+                                      for i, chunk in enumerate(chunks, start=1)), return_exceptions=True)
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException) and not isinstance(outcome, InvalidResponse):
+            raise outcome
+    failed = [outcome for outcome in outcomes if isinstance(outcome, InvalidResponse)]
+    succeeded = [outcome for outcome in outcomes if not isinstance(outcome, InvalidResponse)]
+    token_counts = {}
+    for counts in [e.token_counts for e in failed] + [counts for _, counts, _ in succeeded]:
+        add_token_counts(token_counts, counts)
+    cost = sum(e.cost for e in failed) + sum(chunk_cost for _, _, chunk_cost in succeeded)
+    if not succeeded:
+        raise InvalidResponse(f"All {len(chunks)} chunks of {label} failed validation", token_counts, cost)
+    if failed:
+        print(f"WARNING: {len(failed)} of {len(chunks)} chunks of {label} failed validation, keeping the rest")
+        if run_stats is not None:
+            run_stats["chunks_failed"] = run_stats.get("chunks_failed", 0) + len(failed)
+    return merge_listings([parsed for parsed, _, _ in succeeded]), token_counts, cost
+
+def plan_page(url: str, fields: List[str], raw_data: str, markdown: str, model: str, run_stats: dict = None) -> dict:
+    """
+    What to extract from one preprocessed page: the incremental.plan_extraction plan, with its
+    markdown cut down to the blocks relevant to the fields on large pages (see relevance.py).
+    """
+    plan = plan_extraction(url, fields, raw_data, markdown, model, run_stats)
+    if plan["markdown"].strip():
+        plan["markdown"] = select_relevant(plan["markdown"], fields, model, run_stats=run_stats)
+    return plan
+
+async def extract_page_async(plan: dict, link_map: dict, response_format, selected_model: str,
+                             limit: asyncio.Semaphore = None, run_stats: dict = None, label: str = "page"):
+    """
+    Extracts listings for a plan_page plan: only plan["markdown"] is sent
+    to the model, links are restored and the previous listings still on the page are merged in.
+    A page without changes costs no call at all. Returns (parsed, token_counts, cost).
+    """
+    if plan["carried"] is not None and not plan["markdown"].strip():
+        return {"listings": plan["carried"]}, {"input_tokens": 0, "output_tokens": 0}, 0.0
+    parsed, token_counts, cost = await extract_listings_async(plan["markdown"], response_format, selected_model,
+                                                              SYSTEM_MESSAGE, limit, run_stats, label)
+    parsed = restore_links(parsed, link_map)
+    if plan["carried"] is not None:
+        parsed = merge_listings([parsed, {"listings": plan["carried"]}])
+    return parsed, token_counts, cost
+
+async def scrape_urls_async(unique_names: List[str], fields: List[str], selected_model: str, run_stats: dict = None,
+                            use_templates: bool = False, pack_pages: bool = False, budget=None):
+    """
+    Extracts listings from many pages at once, at most MAX_CONCURRENT_LLM_CALLS in flight.
+    Pages are stripped of cross-page boilerplate and long links before extraction;
+    oversized pages are chunked and their chunks share the same concurrency limit.
+    Pages extracted before with the same fields only send their new blocks (see incremental.py).
+    With use_templates, pages of a site with a learned template skip the LLM (see wrappers.py).
+    With pack_pages, small pages are extracted several to a request (see batching.py).
+    If run_stats is given, the input tokens saved by preprocessing, the tokens served
+    from the LLM response cache and the validation/retry counts are recorded in it.
+    Pages whose responses never validate are not saved; they are listed in
+    run_stats["extraction_failures"] and left out of the results.
+    With an accounting.Budget, each page reserves its estimated usage first and is skipped
+    (counted in run_stats["pages_skipped"]) if that doesn't fit.
+    """
     total_input_tokens = 0
     total_output_tokens = 0
     total_cost = 0
     parsed_results = []
     DynamicListingModel = create_dynamic_listing_model(fields)
     DynamicListingsContainer = create_listings_container_model(DynamicListingModel)
+    pages = []
+    raw_pages = read_raw_data_many(unique_names)
+    page_urls = {name: row.get("url") for name, row in get_storage().read_many(unique_names, ["url"]).items()}
     for uniq in unique_names:
-        raw_data = read_raw_data(uniq)
+        raw_data = raw_pages[uniq]
         if not raw_data:
             print(f"No raw_data found for {uniq}, skipping.")
             continue
-        parsed, token_counts, cost = call_llm_model(raw_data, DynamicListingsContainer, selected_model, SYSTEM_MESSAGE)
-        save_formatted_data(uniq, parsed)
+        pages.append((uniq, raw_data))
+    pages = preprocess_pages(pages, selected_model, run_stats)
+
+    limit = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+    templates = TemplateSession(fields) if use_templates else None
+    packer = None
+    if pack_pages:
+        from batching import PagePacker  # batching builds on this module
+        packer = PagePacker(fields, selected_model, limit, run_stats)
+
+    async def extract(uniq, markdown, link_map):
+        plan = await asyncio.to_thread(plan_page, page_urls.get(uniq), fields, raw_pages[uniq], markdown,
+                                      selected_model, run_stats)
+        estimate = {"input_tokens": 0, "output_tokens": 0, "cost": 0.0}
+        if budget is not None:
+            if plan["carried"] is None or plan["markdown"].strip():
+                estimate = accounting.estimate_page(plan["markdown"], selected_model)
+            if not budget.reserve(estimate["input_tokens"] + estimate["output_tokens"], estimate["cost"]):
+                if run_stats is not None:
+                    run_stats["pages_skipped"] = run_stats.get("pages_skipped", 0) + 1
+                return None, {"input_tokens": 0, "output_tokens": 0}, 0.0
+        parsed, token_counts, cost = await extract_planned(uniq, plan, link_map)
+        if budget is not None:
+            budget.settle(estimate["input_tokens"] + estimate["output_tokens"], estimate["cost"], token_counts, cost)
+        return parsed, token_counts, cost
+
+    async def extract_planned(uniq, plan, link_map):
+        async def llm_extract():
+            if packer is not None:
+                return await packer.extract(plan, link_map, uniq)
+            return await extract_page_async(plan, link_map, DynamicListingsContainer, selected_model, limit, run_stats, uniq)
+
+        try:
+            if templates is not None and page_urls.get(uniq):
+                html = await asyncio.to_thread(get_storage().read, uniq, "raw_html")
+                parsed, token_counts, cost = await templates.extract(page_urls[uniq], html, llm_extract, run_stats)
+            else:
+                parsed, token_counts, cost = await llm_extract()
+        except InvalidResponse as e:
+            if run_stats is not None:
+                run_stats.setdefault("extraction_failures", {})[uniq] = str(e)
+            return None, e.token_counts, e.cost
+        save_formatted_data(uniq, parsed, plan["key"])
+        return parsed, token_counts, cost
+
+    outcomes = await asyncio.gather(*(extract(*page) for page in pages))
+    await asyncio.to_thread(get_storage().flush)
+    for (uniq, _, _), (parsed, token_counts, cost) in zip(pages, outcomes):
         total_input_tokens += token_counts["input_tokens"]
         total_output_tokens += token_counts["output_tokens"]
         total_cost += cost
-        parsed_results.append({"unique_name": uniq, "parsed_data": parsed})
+        record_cached_tokens(run_stats, token_counts)
+        if parsed is not None:
+            parsed_results.append({"unique_name": uniq, "parsed_data": parsed})
     return total_input_tokens, total_output_tokens, total_cost, parsed_results
+
+def scrape_urls(unique_names: List[str], fields: List[str], selected_model: str, run_stats: dict = None,
+                use_templates: bool = False, pack_pages: bool = False, budget=None):
+    """
+    Synchronous wrapper for scrape_urls_async.
+    """
+    return run_async(scrape_urls_async(unique_names, fields, selected_model, run_stats, use_templates, pack_pages, budget))
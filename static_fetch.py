@@ -0,0 +1,175 @@
+"""
+Fast fetch path for server-rendered pages.
+
+Pages are first requested with a pooled HTTP/2 httpx client and converted from HTML to
+markdown with BeautifulSoup, which takes milliseconds instead of a browser page load.
+Pages that need JavaScript (a near-empty body, an empty app root such as
+<div id="root"></div>, a "please enable JavaScript" notice) are left to the crawl4ai
+browser, and that decision is remembered per domain so later URLs of the domain go
+straight to the browser.
+"""
+import asyncio
+import atexit
+import importlib.util
+import re
+import threading
+from urllib.parse import urljoin
+import httpx
+from utils import get_domain
+from assets import STATIC_FETCH, STATIC_FETCH_TIMEOUT, STATIC_MIN_TEXT_CHARS, STATIC_USER_AGENT
+
+EMPTY_APP_ROOT = re.compile(r"<div[^>]+id=[\"'](root|app|__next|__nuxt|svelte)[\"'][^>]*>\s*</div>", re.I)
+JS_NOTICE = re.compile(r"(enable|requires?) javascript|javascript (is )?(disabled|required)", re.I)
+SKIPPED_TAGS = ("script", "style", "noscript", "template", "svg", "iframe", "head")
+BLOCK_TAGS = ("p", "div", "section", "article", "main", "header", "footer", "nav", "aside", "form",
+              "ul", "ol", "table", "thead", "tbody", "tfoot", "blockquote", "pre", "figure", "dl")
+
+# Domain -> "static" or "browser", kept for the lifetime of the process
+_domain_modes = {}
+
+class SharedHttpClient:
+    """
+    One pooled httpx.AsyncClient per process, living on its own event loop in a daemon
+    thread like markdown.SharedCrawler, so connections are reused across batches and loops.
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True, name="http-client-loop").start()
+        http2 = importlib.util.find_spec("h2") is not None
+        if not http2:
+            print("WARNING: h2 is not installed, the static fetch path falls back to HTTP/1.1")
+        self.client = httpx.AsyncClient(http2=http2, follow_redirects=True, timeout=STATIC_FETCH_TIMEOUT,
+                                        headers={"User-Agent": STATIC_USER_AGENT})
+        atexit.register(self.close)
+
+    async def get(self, url: str):
+        future = asyncio.run_coroutine_threadsafe(self.client.get(url), self.loop)
+        return await asyncio.wrap_future(future)
+
+    def close(self) -> None:
+        try:
+            asyncio.run_coroutine_threadsafe(self.client.aclose(), self.loop).result(timeout=10)
+        except Exception as e:
+            print(f"WARNING: Failed to close the HTTP client: {e}")
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_http_client() -> SharedHttpClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = SharedHttpClient()
+        return _client
+
+def _inline(node, base_url: str) -> str:
+    """Markdown for the inline content of a node (links, images, emphasis, line breaks)."""
+    from bs4.element import NavigableString, PreformattedString, Tag
+    if isinstance(node, NavigableString):
+        # Comments, doctypes and CDATA are PreformattedStrings and carry no page text
+        return "" if isinstance(node, PreformattedString) else re.sub(r"\s+", " ", str(node))
+    if not isinstance(node, Tag) or node.name in SKIPPED_TAGS:
+        return ""
+    if node.name == "br":
+        return "\n"
+    if node.name == "img":
+        src = node.get("src") or node.get("data-src")
+        return f"![{node.get('alt', '').strip()}]({urljoin(base_url, src)})" if src else ""
+    text = "".join(_inline(child, base_url) for child in node.children)
+    if node.name == "a" and node.get("href") and not node["href"].startswith(("#", "javascript:")):
+        return f"[{text.strip()}]({urljoin(base_url, node['href'])})"
+    if node.name in ("strong", "b") and text.strip():
+        return f"**{text.strip()}**"
+    if node.name in ("em", "i") and text.strip():
+        return f"*{text.strip()}*"
+    return text
+
+def _blocks(node, base_url: str, out: list) -> None:
+    """Appends the markdown blocks of a node (headings, paragraphs, list items, table rows) to `out`."""
+    from bs4.element import NavigableString, Tag
+    inline = []
+
+    def flush():
+        lines = (re.sub(r"\s+", " ", line).strip() for line in "".join(inline).split("\n"))
+        text = "\n".join(line for line in lines if line)
+        if text:
+            out.append(text)
+        inline.clear()
+
+    for child in node.children:
+        if isinstance(child, NavigableString) or (isinstance(child, Tag) and child.name not in
+                                                  (*BLOCK_TAGS, "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6")):
+            inline.append(_inline(child, base_url))
+            continue
+        flush()
+        if not isinstance(child, Tag) or child.name in SKIPPED_TAGS:
+            continue
+        if re.fullmatch(r"h[1-6]", child.name):
+            text = " ".join(_inline(child, base_url).split())
+            if text:
+                out.append("#" * int(child.name[1]) + " " + text)
+        elif child.name == "li":
+            items = []
+            _blocks(child, base_url, items)
+            if items:
+                out.append("- " + "\n".join(items).replace("\n", "\n  "))
+        elif child.name == "tr":
+            cells = [" ".join(_inline(cell, base_url).split()) for cell in child.find_all(["td", "th"], recursive=False)]
+            if any(cells):
+                out.append("| " + " | ".join(cells) + " |")
+        else:
+            _blocks(child, base_url, out)
+    flush()
+
+def html_to_markdown(html: str, base_url: str) -> str:
+    """Converts an HTML page to markdown: headings, paragraphs, list items, table rows, links and images."""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "html.parser")
+    blocks = []
+    _blocks(soup.body or soup, base_url, blocks)
+    return "\n\n".join(blocks)
+
+def js_dependence(html: str, markdown: str):
+    """
+    Returns why a page looks like it needs a browser to render, or None if the HTML has its content.
+    The markers are checked whatever the amount of text, since a server-rendered header and
+    footer can surround an app that renders the listings client-side.
+    """
+    if EMPTY_APP_ROOT.search(html):
+        return "empty app root"
+    if JS_NOTICE.search(html):
+        return "requires JavaScript"
+    text_chars = len(re.sub(r"!?\[([^\]]*)\]\([^)]*\)", r"\1", markdown).strip())
+    if text_chars < STATIC_MIN_TEXT_CHARS:
+        return "empty body"
+    return None
+
+def use_static(url: str) -> bool:
+    """True unless the static path is disabled or the URL's domain is known to need a browser."""
+    return STATIC_FETCH and _domain_modes.get(get_domain(url)) != "browser"
+
+async def fetch_static(url: str):
+    """
+    Fetches one page without a browser. Returns {"url", "markdown", "html", "headers", "error", "tier"}
+    like markdown.crawl_page, or None when the page has to be rendered by the browser.
+    """
+    domain = get_domain(url)
+    try:
+        response = await get_http_client().get(url)
+    except httpx.HTTPError as e:
+        print(f"INFO: Static fetch of {url} failed ({type(e).__name__}), using the browser")
+        return None
+    content_type = response.headers.get("content-type", "")
+    if response.status_code >= 400 or "html" not in content_type:
+        print(f"INFO: Static fetch of {url} returned {response.status_code} {content_type}, using the browser")
+        return None
+    markdown = await asyncio.to_thread(html_to_markdown, response.text, str(response.url))
+    reason = js_dependence(response.text, markdown)
+    if reason:
+        if _domain_modes.get(domain) != "browser":
+            print(f"INFO: {domain} needs a browser ({reason}), using it for this domain from now on")
+        _domain_modes[domain] = "browser"
+        return None
+    _domain_modes[domain] = "static"
+    return {"url": url, "markdown": markdown, "html": response.text, "headers": dict(response.headers),
+            "error": None, "tier": "static"}
@@ -0,0 +1,256 @@
+"""
+Storage layer behind the scraped_data table.
+
+Every module goes through get_storage() instead of talking to Supabase directly:
+- one shared backend per process (Supabase, or SQLite for offline runs and benchmarks),
+- bulk reads of many unique_names in one query,
+- buffered write-behind upserts, flushed in batches.
+
+Select the backend with STORAGE_BACKEND ("supabase" or "sqlite") in the environment or .env.
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from api_management import get_supabase_client
+from tracing import span
+from assets import STORAGE_BATCH_SIZE, STORAGE_FLUSH_INTERVAL, STORAGE_SQLITE_PATH, STORAGE_READ_CHUNK
+
+TABLE = "scraped_data"
+JSON_COLUMNS = ("raw_data", "formatted_data", "pagination_data")
+COLUMNS = ("unique_name", "url", "raw_data", "raw_html", "formatted_data", "pagination_data",
+           "url_key", "etag", "last_modified", "fetched_at", "extraction_key", "created_at")
+
+class SupabaseBackend:
+    """scraped_data in Supabase. Requires a UNIQUE constraint on unique_name (see README)."""
+    def __init__(self, client):
+        self.client = client
+
+    def read_rows(self, unique_names: list, columns: list) -> dict:
+        rows = {}
+        select = ", ".join(dict.fromkeys(["unique_name", *columns]))
+        for start in range(0, len(unique_names), STORAGE_READ_CHUNK):
+            names = unique_names[start:start + STORAGE_READ_CHUNK]
+            response = self.client.table(TABLE).select(select).in_("unique_name", names).execute()
+            for row in response.data or []:
+                rows[row["unique_name"]] = row
+        return rows
+
+    def find_latest(self, column: str, value, columns: list, order_by: str):
+        select = ", ".join(dict.fromkeys(["unique_name", *columns]))
+        response = self.client.table(TABLE).select(select).eq(column, value) \
+            .order(order_by, desc=True).limit(1).execute()
+        return response.data[0] if response.data else None
+
+    def upsert_rows(self, rows: list) -> None:
+        # PostgREST fills keys missing from a row with NULL, so rows are sent in groups
+        # that carry exactly the same columns and never overwrite columns they don't set.
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        for group in groups.values():
+            self.client.table(TABLE).upsert(group, on_conflict="unique_name").execute()
+
+class SQLiteBackend:
+    """Drop-in local stand-in for scraped_data, for offline runs and benchmarks."""
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {TABLE} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    unique_name TEXT NOT NULL UNIQUE,
+                    url TEXT,
+                    raw_data TEXT,
+                    raw_html TEXT,
+                    formatted_data TEXT,
+                    pagination_data TEXT,
+                    url_key TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    fetched_at TEXT,
+                    extraction_key TEXT,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({TABLE})")}
+            for column in COLUMNS:
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE {TABLE} ADD COLUMN {column} TEXT")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_url_key_idx ON {TABLE} (url_key, fetched_at)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_extraction_key_idx ON {TABLE} (extraction_key, fetched_at)")
+
+    @contextmanager
+    def _connect(self):
+        with self.lock:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            try:
+                with conn:
+                    yield conn
+            finally:
+                conn.close()
+
+    @staticmethod
+    def _decode(row) -> dict:
+        decoded = dict(row)
+        for column in JSON_COLUMNS:
+            if decoded.get(column) is not None:
+                decoded[column] = json.loads(decoded[column])
+        return decoded
+
+    @staticmethod
+    def _check_columns(columns) -> None:
+        unknown = set(columns) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown scraped_data columns: {sorted(unknown)}")
+
+    def read_rows(self, unique_names: list, columns: list) -> dict:
+        columns = list(dict.fromkeys(["unique_name", *columns]))
+        self._check_columns(columns)
+        rows = {}
+        with self._connect() as conn:
+            for start in range(0, len(unique_names), STORAGE_READ_CHUNK):
+                names = unique_names[start:start + STORAGE_READ_CHUNK]
+                placeholders = ", ".join("?" * len(names))
+                query = f"SELECT {', '.join(columns)} FROM {TABLE} WHERE unique_name IN ({placeholders})"
+                for row in conn.execute(query, names):
+                    rows[row["unique_name"]] = self._decode(row)
+        return rows
+
+    def find_latest(self, column: str, value, columns: list, order_by: str):
+        columns = list(dict.fromkeys(["unique_name", *columns]))
+        self._check_columns([*columns, column, order_by])
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(columns)} FROM {TABLE} WHERE {column} = ? ORDER BY {order_by} DESC LIMIT 1",
+                (value,),
+            ).fetchone()
+        return self._decode(row) if row else None
+
+    def upsert_rows(self, rows: list) -> None:
+        with self._connect() as conn:
+            for row in rows:
+                self._check_columns(row)
+                columns = list(row)
+                values = [json.dumps(row[c]) if c in JSON_COLUMNS and row[c] is not None else row[c] for c in columns]
+                updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c != "unique_name")
+                conn.execute(
+                    f"INSERT INTO {TABLE} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                    f"ON CONFLICT(unique_name) DO " + (f"UPDATE SET {updates}" if updates else "NOTHING"),
+                    values,
+                )
+
+class Storage:
+    """
+    Write-behind front end for a backend. Writes are merged per unique_name and flushed
+    as one bulk upsert once STORAGE_BATCH_SIZE rows are pending, every STORAGE_FLUSH_INTERVAL
+    seconds, on flush() and at exit. Reads see pending writes.
+    """
+    def __init__(self, backend, batch_size: int = STORAGE_BATCH_SIZE, flush_interval: float = STORAGE_FLUSH_INTERVAL):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.flushing = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        threading.Thread(target=self._flush_periodically, daemon=True).start()
+        atexit.register(self.flush)
+
+    def _flush_periodically(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"WARNING: Background flush failed: {e}")
+
+    def write(self, unique_name: str, fields: dict) -> None:
+        """Queues an upsert of `fields` for one row."""
+        with self.lock:
+            self.pending.setdefault(unique_name, {}).update(fields)
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes every pending row to the backend."""
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return
+                self.flushing, self.pending = self.pending, {}
+            try:
+                with span("storage_write", rows=len(self.flushing)):
+                    self.backend.upsert_rows([{"unique_name": name, **fields} for name, fields in self.flushing.items()])
+            except Exception:
+                with self.lock:
+                    for name, fields in self.flushing.items():
+                        self.pending[name] = {**fields, **self.pending.get(name, {})}
+                raise
+            finally:
+                with self.lock:
+                    self.flushing = {}
+
+    def _buffered(self, unique_name: str) -> dict:
+        with self.lock:
+            return {**self.flushing.get(unique_name, {}), **self.pending.get(unique_name, {})}
+
+    def read_many(self, unique_names: list, columns: list) -> dict:
+        """
+        Returns {unique_name: row} for the rows that exist, each row holding `columns`,
+        in one backend query for all names not fully answered by pending writes.
+        """
+        rows = {}
+        missing = []
+        for name in dict.fromkeys(unique_names):
+            buffered = self._buffered(name)
+            if all(column in buffered for column in columns):
+                rows[name] = {"unique_name": name, **buffered}
+            else:
+                missing.append(name)
+        if missing:
+            with span("storage_read", rows=len(missing), columns=",".join(columns)):
+                backend_rows = self.backend.read_rows(missing, columns)
+            for name, row in backend_rows.items():
+                rows[name] = {**row, **self._buffered(name)}
+        return rows
+
+    def read(self, unique_name: str, column: str):
+        """Returns one column of one row, or None."""
+        return self.read_many([unique_name], [column]).get(unique_name, {}).get(column)
+
+    def find_latest(self, column: str, value, columns: list, order_by: str):
+        """Returns the row with the largest `order_by` among rows where `column` == value."""
+        with self.lock:
+            buffered_match = any(fields.get(column) == value
+                                 for fields in (*self.pending.values(), *self.flushing.values()))
+        if buffered_match:
+            self.flush()
+        with span("storage_read", rows=1, columns=",".join(columns)):
+            return self.backend.find_latest(column, value, columns, order_by)
+
+_storage = None
+_storage_lock = threading.Lock()
+
+def get_storage():
+    """
+    Returns the process-wide Storage, or None if the selected backend is not configured.
+    """
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            if os.getenv("STORAGE_BACKEND", "supabase").lower() == "sqlite":
+                _storage = Storage(SQLiteBackend(os.getenv("STORAGE_SQLITE_PATH", STORAGE_SQLITE_PATH)))
+            else:
+                client = get_supabase_client()
+                if client is None:
+                    return None
+                _storage = Storage(SupabaseBackend(client))
+        return _storage
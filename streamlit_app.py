@@ -1,25 +1,21 @@
 import streamlit as st
 from streamlit_tags import st_tags_sidebar
-import pandas as pd
-import json
 import re
 import sys
+import time
 import asyncio
 # Local imports
-from scraper import scrape_urls
-from pagination import paginate_urls
-from markdown import fetch_and_store_markdowns
-from assets import MODELS_USED
-from api_management import get_supabase_client
+from assets import MODELS_USED, CRAWL_MAX_PAGES, EXPORT_PREVIEW_ROWS, FETCH_PROFILES, FETCH_PROFILE
+from jobs import get_job_runner
+from storage import get_storage
 
 # Set event loop policy for Windows
 if sys.platform.startswith("win"):
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
 
 st.set_page_config(page_title=" TRAI SpiderMIND", page_icon="🦑")
-supabase = get_supabase_client()
-if supabase is None:
-    st.error("🚨 Supabase is not configured! Follow the README instructions to set it up.")
+if get_storage() is None:
+    st.error("🚨 Supabase is not configured! Follow the README instructions to set it up, or set STORAGE_BACKEND=sqlite to run locally.")
     st.stop()
 
 st.title("TRAI SpiderMIND  🦑")
@@ -29,6 +25,25 @@ if 'scraping_state' not in st.session_state:
 if 'results' not in st.session_state:
     st.session_state['results'] = None
 
+def download_buttons(kind: str, label: str, file_name: str, columns: list = None):
+    """One button per export format; a file is only written when its download is prepared."""
+    import export
+    for column, fmt in zip(st.columns(len(export.FORMATS)), export.FORMATS):
+        with column:
+            key = f"export_{kind}_{fmt}"
+            if st.session_state.get(key) is None:
+                if st.button(f"Prepare {label}{fmt.upper()}", key=f"prepare_{kind}_{fmt}"):
+                    try:
+                        st.session_state[key] = export.export_job_file(st.session_state['job_id'], st.session_state['results'],
+                                                                       fmt, kind, columns)
+                    except RuntimeError as e:
+                        st.caption(str(e))
+                        continue
+                    st.rerun()
+                continue
+            with open(st.session_state[key], "rb") as f:
+                st.download_button(f"Download {label}{fmt.upper()}", data=f, file_name=f"{file_name}.{fmt}", key=f"download_{kind}_{fmt}")
+
 st.sidebar.title("Web Scraper Settings")
 
 with st.sidebar.expander("API Keys", expanded=False):
@@ -76,14 +91,30 @@ with st.sidebar.container():
 st.sidebar.markdown("---")
 show_tags = st.sidebar.toggle("Enable Scraping")
 fields = []
+use_templates = False
 if show_tags:
     fields = st_tags_sidebar(label='Enter Fields to Extract:', text='Press enter to add a field', value=[], suggestions=[], maxtags=-1, key='fields_input')
+    use_templates = st.sidebar.toggle("Learn Page Templates", help="Learn CSS selectors from the first page of each site and extract its other pages without the LLM")
 
 st.sidebar.markdown("---")
 use_pagination = st.sidebar.toggle("Enable Pagination")
 pagination_details = ""
 if use_pagination:
     pagination_details = st.sidebar.text_input("Enter Pagination Details (optional)", help="Describe how to navigate through pages (e.g., 'Next' button class, URL pattern)")
+follow_pagination = False
+max_crawl_pages = CRAWL_MAX_PAGES
+if use_pagination:
+    follow_pagination = st.sidebar.toggle("Follow Page URLs", help="Fetch and scrape the discovered page URLs too, in one job")
+    if follow_pagination:
+        max_crawl_pages = st.sidebar.number_input("Maximum Pages to Crawl", min_value=1, value=CRAWL_MAX_PAGES)
+with st.sidebar.expander("Budget", expanded=False):
+    max_tokens = st.number_input("Maximum Tokens (0 = no limit)", min_value=0, value=0, step=10000)
+    max_cost = st.number_input("Maximum Cost in $ (0 = no limit)", min_value=0.0, value=0.0, step=0.1, format="%.2f")
+fetch_profile = st.sidebar.selectbox("Fetch Profile", list(FETCH_PROFILES), index=list(FETCH_PROFILES).index(FETCH_PROFILE),
+                                     help="How pages are loaded in the browser: blocked resources, timeouts, scrolling")
+distributed = st.sidebar.toggle("Run on Workers", help="Queue the URLs for worker processes (python cli.py worker) instead of scraping in the app")
+pack_pages = st.sidebar.toggle("Pack Small Pages", help="Extract several small pages in one LLM request")
+batch_api = st.sidebar.toggle("Use Batch API", help="Submit the extraction to the provider's batch endpoint: about half the cost, results within hours, no pagination")
 st.sidebar.markdown("---")
 
 if st.sidebar.button("LAUNCH", type="primary"):
@@ -97,160 +128,148 @@ if st.sidebar.button("LAUNCH", type="primary"):
         st.session_state['model_selection'] = model_selection
         st.session_state['use_pagination'] = use_pagination
         st.session_state['pagination_details'] = pagination_details
-        unique_names = fetch_and_store_markdowns(st.session_state["urls_splitted"])
-        st.session_state["unique_names"] = unique_names
+        job_params = {
+            "urls": st.session_state["urls_splitted"],
+            "model": model_selection,
+            "fields": fields if show_tags else [],
+            "use_pagination": use_pagination,
+            "pagination_details": pagination_details,
+            "follow_pagination": follow_pagination,
+            "max_pages": max_crawl_pages,
+            "use_templates": use_templates,
+            "fetch_profile": fetch_profile,
+            "distributed": distributed,
+            "pack_pages": pack_pages,
+            "batch_api": batch_api,
+            "max_tokens": max_tokens or None,
+            "max_cost": max_cost or None,
+        }
+        api_keys = {key_name: st.session_state.get(key_name) for required_keys in MODELS_USED.values() for key_name in required_keys}
+        for key in ('fetch_stats', 'scrape_stats', 'pagination_stats', 'estimate', 'budget', 'stage_times', 'in_tokens_s', 'out_tokens_s', 'cost_s', 'in_tokens_p', 'out_tokens_p', 'cost_p',
+                    'listing_rows', 'page_url_count', 'export_listings_csv', 'export_listings_jsonl', 'export_listings_parquet',
+                    'export_pagination_csv', 'export_pagination_jsonl', 'export_pagination_parquet'):
+            st.session_state.pop(key, None)
+        st.session_state['job_id'] = get_job_runner().submit(job_params, api_keys)
         st.session_state['scraping_state'] = 'scraping'
 
 if st.session_state['scraping_state'] == 'scraping':
-    try:
-        with st.spinner("Processing..."):
-            unique_names = st.session_state["unique_names"]
-            total_input_tokens = 0
-            total_output_tokens = 0
-            total_cost = 0
-            all_data = []
-            if show_tags:
-                in_tokens_s, out_tokens_s, cost_s, parsed_data = scrape_urls(unique_names, st.session_state['fields'], st.session_state['model_selection'])
-                total_input_tokens += in_tokens_s
-                total_output_tokens += out_tokens_s
-                total_cost += cost_s
-                all_data = parsed_data
-                st.session_state['in_tokens_s'] = in_tokens_s
-                st.session_state['out_tokens_s'] = out_tokens_s
-                st.session_state['cost_s'] = cost_s
-            pagination_info = None
-            if st.session_state['use_pagination']:
-                in_tokens_p, out_tokens_p, cost_p, page_results = paginate_urls(unique_names, st.session_state['model_selection'], st.session_state['pagination_details'], st.session_state["urls_splitted"])
-                total_input_tokens += in_tokens_p
-                total_output_tokens += out_tokens_p
-                total_cost += cost_p
-                pagination_info = page_results
-                st.session_state['in_tokens_p'] = in_tokens_p
-                st.session_state['out_tokens_p'] = out_tokens_p
-                st.session_state['cost_p'] = cost_p
-            st.session_state['results'] = {
-                'data': all_data,
-                'input_tokens': total_input_tokens,
-                'output_tokens': total_output_tokens,
-                'total_cost': total_cost,
-                'pagination_info': pagination_info
-            }
-            st.session_state['scraping_state'] = 'completed'
-    except Exception as e:
-        st.error(f"An error occurred during scraping: {e}")
+    job = get_job_runner().store.get(st.session_state['job_id'])
+    if job is None:
+        st.error("The scraping job could not be found.")
+        st.session_state['scraping_state'] = 'idle'
+    elif job['status'] in ('pending', 'running'):
+        progress = job['progress'] or {}
+        progress_text = ", ".join(f"{k.replace('_', ' ')}: {v}" for k, v in progress.items() if k != 'stage')
+        st.info(f"Job {job['id']} is {job['status']} ({progress.get('stage', 'queued')}) {progress_text}")
+        if st.button("Cancel Job"):
+            get_job_runner().store.request_cancel(job['id'])
+        time.sleep(1)
+        st.rerun()
+    elif job['status'] == 'completed':
+        results = job['results']
+        for key, value in results.pop('details', {}).items():
+            st.session_state[key] = value
+        st.session_state['results'] = results
+        st.session_state['scraping_state'] = 'completed'
+    elif job['status'] == 'cancelled':
+        st.warning(f"Job {job['id']} was cancelled.")
+        st.session_state['scraping_state'] = 'idle'
+    else:
+        st.error(f"An error occurred during scraping: {job['error']}")
         st.session_state['scraping_state'] = 'idle'
 
 if st.session_state['scraping_state'] == 'completed' and st.session_state['results']:
+    import pandas as pd  # only needed to display results, kept off the cold start path
+    import export
     results = st.session_state['results']
-    all_data = results['data']
     total_input_tokens = results['input_tokens']
     total_output_tokens = results['output_tokens']
     total_cost = results['total_cost']
     pagination_info = results['pagination_info']
     if show_tags:
         st.subheader("Scraping Results")
-        all_rows = []
-        for i, data_item in enumerate(all_data, start=1):
-            if not isinstance(data_item, dict):
-                st.error(f"data_item is not a dict, skipping. Type: {type(data_item)}")
-                continue
-            if "parsed_data" in data_item:
-                parsed_obj = data_item["parsed_data"]
-                if hasattr(parsed_obj, "dict"):
-                    parsed_obj = parsed_obj.model_dump()
-                elif isinstance(parsed_obj, str):
-                    try:
-                        parsed_obj = json.loads(parsed_obj)
-                    except json.JSONDecodeError:
-                        pass
-                data_item["parsed_data"] = parsed_obj
-            pd_obj = data_item["parsed_data"]
-            if isinstance(pd_obj, dict) and "listings" in pd_obj and isinstance(pd_obj["listings"], list):
-                for listing in pd_obj["listings"]:
-                    row_dict = dict(listing)
-                    all_rows.append(row_dict)
-            else:
-                row_dict = dict(data_item)
-                all_rows.append(row_dict)
-        if not all_rows:
-            st.warning("No data rows to display.")
+        listing_names = export.result_unique_names(results)
+        results_page = int(st.number_input("Results page", min_value=1, value=1, step=1, key="results_page"))
+        rows, has_more = export.preview(listing_names, "listings", results_page)
+        if not rows:
+            st.warning("No data rows to display." if results_page == 1 else "No rows on this page.")
         else:
-            df = pd.DataFrame(all_rows)
-            st.dataframe(df, use_container_width=True)
+            st.dataframe(pd.DataFrame(rows), use_container_width=True)
+            first_row = (results_page - 1) * EXPORT_PREVIEW_ROWS + 1
+            st.caption(f"Rows {first_row}-{first_row + len(rows) - 1} of {st.session_state.get('listing_rows', 0)}"
+                       + (", more on the next page." if has_more else "."))
         if "in_tokens_s" in st.session_state:
             st.sidebar.markdown("### Scraping Details")
             st.sidebar.markdown("#### Token Usage")
             st.sidebar.markdown(f"*Input Tokens:* {st.session_state['in_tokens_s']}")
             st.sidebar.markdown(f"*Output Tokens:* {st.session_state['out_tokens_s']}")
             st.sidebar.markdown(f"**Total Cost:** ${st.session_state['cost_s']:.4f}")
+            scrape_stats = st.session_state.get('scrape_stats', {})
+            st.sidebar.markdown(f"*Cached Tokens (not billed):* {scrape_stats.get('cached_input_tokens', 0)} in / {scrape_stats.get('cached_output_tokens', 0)} out")
+            st.sidebar.markdown(f"*Tokens Saved by Preprocessing:* {scrape_stats.get('tokens_saved', 0)}")
+            if scrape_stats.get("template_pages") or scrape_stats.get("templates_learned"):
+                st.sidebar.markdown(f"*Pages Extracted by Template:* {scrape_stats.get('template_pages', 0)}, *Templates Learned:* {scrape_stats.get('templates_learned', 0)}, *Template Fallbacks:* {scrape_stats.get('template_failures', 0)}")
+            if scrape_stats.get("packed_calls"):
+                st.sidebar.markdown(f"*Packed Requests:* {scrape_stats['packed_calls']}, *Pages Packed:* {scrape_stats.get('packed_pages', 0)}, *Fallbacks:* {scrape_stats.get('pack_fallbacks', 0)}")
+            if scrape_stats.get("relevance_pages"):
+                st.sidebar.markdown(f"*Pages Filtered to Relevant Blocks:* {scrape_stats['relevance_pages']}, *Tokens Saved:* {scrape_stats.get('relevance_tokens_saved', 0)}")
+            if scrape_stats.get("incremental_pages"):
+                st.sidebar.markdown(f"*Incremental Pages:* {scrape_stats['incremental_pages']}, *Tokens Saved:* {scrape_stats.get('incremental_tokens_saved', 0)}")
+            st.sidebar.markdown(f"*Responses Repaired:* {scrape_stats.get('responses_repaired', 0)}, *Retried:* {scrape_stats.get('retries', 0)}, *Failed:* {scrape_stats.get('validation_failures', 0)}")
+            for failed_page, error in scrape_stats.get("extraction_failures", {}).items():
+                st.sidebar.warning(f"Extraction failed for {failed_page}: {error}")
         st.subheader("Download Extracted Data")
-        col1, col2 = st.columns(2)
-        with col1:
-            json_data = json.dumps(all_data, default=lambda o: o.dict() if hasattr(o, 'dict') else str(o), indent=4)
-            st.download_button("Download JSON", data=json_data, file_name="scraped_data.json")
-        with col2:
-            all_listings = []
-            for data in all_data:
-                if isinstance(data, str):
-                    try:
-                        data = json.loads(data)
-                    except json.JSONDecodeError:
-                        continue
-                if isinstance(data, dict) and 'listings' in data:
-                    all_listings.extend(data['listings'])
-                elif hasattr(data, 'listings'):
-                    all_listings.extend([item.dict() for item in data.listings])
-                else:
-                    all_listings.append(data)
-            combined_df = pd.DataFrame(all_listings)
-            st.download_button("Download CSV", data=combined_df.to_csv(index=False), file_name="scraped_data.csv")
+        download_buttons("listings", "", "scraped_data", st.session_state.get('fields'))
         st.success("Scraping completed. Results saved in database.")
     if pagination_info:
-        all_page_rows = []
-        for i, item in enumerate(pagination_info, start=1):
-            if not isinstance(item, dict):
-                st.error(f"item is not a dict, skipping. Type: {type(item)}")
-                continue
-            if "pagination_data" in item:
-                pag_obj = item["pagination_data"]
-                if hasattr(pag_obj, "dict"):
-                    pag_obj = pag_obj.model_dump()
-                elif isinstance(pag_obj, str):
-                    try:
-                        pag_obj = json.loads(pag_obj)
-                    except json.JSONDecodeError:
-                        pass
-                item["pagination_data"] = pag_obj
-            pd_obj = item["pagination_data"]
-            if isinstance(pd_obj, dict) and "page_urls" in pd_obj and isinstance(pd_obj["page_urls"], list):
-                for page_url in pd_obj["page_urls"]:
-                    row_dict = {"page_url": page_url}
-                    all_page_rows.append(row_dict)
-            else:
-                row_dict = dict(item)
-                all_page_rows.append(row_dict)
-        if not all_page_rows:
+        pagination_names = export.result_unique_names(results, "pagination")
+        page_url_count = st.session_state.get('page_url_count', 0)
+        if not page_url_count:
             st.warning("No page URLs found.")
         else:
-            pagination_df = pd.DataFrame(all_page_rows)
             st.markdown("---")
             st.subheader("Pagination Information")
             st.write("**Page URLs:**")
-            st.dataframe(pagination_df, use_container_width=True)
+            pagination_page = int(st.number_input("Page URLs page", min_value=1, value=1, step=1, key="pagination_page"))
+            page_rows, _ = export.preview(pagination_names, "pagination", pagination_page)
+            st.dataframe(pd.DataFrame(page_rows), use_container_width=True)
         if "in_tokens_p" in st.session_state:
             st.sidebar.markdown("---")
             st.sidebar.markdown("### Pagination Details")
-            st.sidebar.markdown(f"**Number of Page URLs:** {len(all_page_rows)}")
+            st.sidebar.markdown(f"**Number of Page URLs:** {page_url_count}")
             st.sidebar.markdown("#### Pagination Token Usage")
             st.sidebar.markdown(f"*Input Tokens:* {st.session_state['in_tokens_p']}")
             st.sidebar.markdown(f"*Output Tokens:* {st.session_state['out_tokens_p']}")
             st.sidebar.markdown(f"**Total Cost:** ${st.session_state['cost_p']:.4f}")
+            pagination_stats = st.session_state.get('pagination_stats', {})
+            st.sidebar.markdown(f"*Cached Tokens (not billed):* {pagination_stats.get('cached_input_tokens', 0)} in / {pagination_stats.get('cached_output_tokens', 0)} out")
+            st.sidebar.markdown(f"*Pages Resolved Without LLM:* {pagination_stats.get('detected_pages', 0)}")
         st.subheader("Download Pagination URLs")
-        col1, col2 = st.columns(2)
-        with col1:
-            st.download_button("Download Pagination CSV", data=pagination_df.to_csv(index=False), file_name="pagination_urls.csv")
-        with col2:
-            st.download_button("Download Pagination JSON", data=json.dumps(all_page_rows, indent=4), file_name="pagination_urls.json")
+        download_buttons("pagination", "Pagination ", "pagination_urls")
+    if "fetch_stats" in st.session_state:
+        fetch_stats = st.session_state["fetch_stats"]
+        st.sidebar.markdown("---")
+        st.sidebar.markdown("### Fetch Details")
+        st.sidebar.markdown(f"*Cache Hits:* {fetch_stats.get('cache_hits', 0)} (+{fetch_stats.get('cache_revalidated', 0)} revalidated)")
+        st.sidebar.markdown(f"*Cache Misses:* {fetch_stats.get('cache_misses', 0)}")
+        st.sidebar.markdown(f"*Fetched Without Browser:* {fetch_stats.get('static_fetches', 0)}, *With Browser:* {fetch_stats.get('browser_fetches', 0)}")
+        for failed_url, error in fetch_stats.get("failures", {}).items():
+            st.sidebar.warning(f"Failed to fetch {failed_url}: {error}")
+    if st.session_state.get("stage_times"):
+        st.sidebar.markdown("---")
+        st.sidebar.markdown("### Time Breakdown")
+        for stage, seconds in sorted(st.session_state["stage_times"].items(), key=lambda item: -item[1]):
+            st.sidebar.markdown(f"*{stage.replace('_', ' ').title()}:* {seconds:.2f}s")
+        st.sidebar.caption("Cumulative time per stage; concurrent work adds up.")
+    if "estimate" in st.session_state:
+        estimate = st.session_state["estimate"]
+        budget = st.session_state.get("budget", {})
+        st.sidebar.markdown("---")
+        st.sidebar.markdown("### Budget")
+        st.sidebar.markdown(f"*Estimated:* {estimate['input_tokens']} input tokens, ${estimate['cost']:.4f}")
+        st.sidebar.markdown(f"*Used:* {budget.get('tokens_used', 0)} tokens, ${budget.get('cost_used', 0):.4f}")
+        if budget.get("pages_skipped"):
+            st.sidebar.warning(f"{budget['pages_skipped']} pages skipped because the budget was reached.")
     if st.sidebar.button("Clear Results"):
         st.session_state['scraping_state'] = 'idle'
         st.session_state['results'] = None
@@ -0,0 +1,65 @@
+import pytest
+import accounting
+from accounting import Budget
+
+MODEL = "gpt-4o-mini"
+
+def test_reserve_stops_at_the_token_cap():
+    budget = Budget(max_tokens=1000)
+    assert budget.reserve(600, 0.0)
+    assert not budget.reserve(600, 0.0)
+    assert budget.reserve(400, 0.0)
+    assert budget.exhausted()
+
+def test_reserve_stops_at_the_cost_cap():
+    budget = Budget(max_cost=0.05)
+    assert budget.reserve(10**6, 0.04)
+    assert not budget.reserve(1, 0.02)
+    assert not budget.exhausted()
+
+def test_settle_replaces_the_reservation_with_billed_usage():
+    budget = Budget(max_tokens=1000, max_cost=1.0)
+    budget.reserve(800, 0.5)
+    budget.settle(800, 0.5, {"input_tokens": 250, "output_tokens": 50}, 0.1)
+    assert budget.summary() == {"max_tokens": 1000, "max_cost": 1.0, "tokens_used": 300,
+                                "cost_used": pytest.approx(0.1)}
+    # The room freed by the overestimate can be reserved again
+    assert budget.reserve(700, 0.9)
+
+def test_charge_records_unreserved_usage():
+    budget = Budget(max_tokens=100)
+    budget.charge({"input_tokens": 80, "output_tokens": 30}, 0.0)
+    assert budget.exhausted()
+    assert not budget.reserve(1, 0.0)
+
+def test_no_caps_never_runs_out():
+    budget = Budget()
+    assert budget.reserve(10**9, 10**6)
+    assert not budget.exhausted()
+
+def test_estimates_follow_observed_usage(monkeypatch):
+    monkeypatch.setattr(accounting, "_calibration", {})
+    text = "x" * 4000
+    before = accounting.estimate_tokens(text, MODEL)
+    # The provider bills two characters per token, twice the default estimate
+    for _ in range(30):
+        accounting.observe(MODEL, 4000, 2000, 200)
+    assert before < accounting.estimate_tokens(text, MODEL) <= 2001
+    assert accounting.estimate_output_tokens(1000, MODEL) == 100
+    assert accounting.estimate_chars(2000, MODEL) >= 3990
+    assert accounting.estimate_tokens(text, "other-model") == before
+
+def test_usage_comes_from_the_provider():
+    class Response:
+        usage = {"prompt_tokens": 1200, "completion_tokens": 80}
+    assert accounting.usage_counts(Response(), estimated_input_tokens=999) == {"input_tokens": 1200, "output_tokens": 80}
+    estimated = accounting.usage_counts(object(), estimated_input_tokens=999, output_text="x" * 400, model=MODEL)
+    assert estimated == {"input_tokens": 999, "output_tokens": accounting.estimate_tokens("x" * 400, MODEL)}
+
+def test_estimate_page_counts_every_call(monkeypatch):
+    monkeypatch.setattr(accounting, "_token_prices", lambda model: (1e-6, 2e-6))
+    once = accounting.estimate_page("x" * 4000, MODEL)
+    twice = accounting.estimate_page("x" * 4000, MODEL, calls=2)
+    assert twice["input_tokens"] == 2 * once["input_tokens"]
+    assert once["cost"] == pytest.approx(once["input_tokens"] * 1e-6 + once["output_tokens"] * 2e-6)
+    assert accounting.estimate_page("x" * 4000, MODEL, calls=0) == {"input_tokens": 0, "output_tokens": 0, "cost": 0.0}
@@ -0,0 +1,34 @@
+import os
+import threading
+from api_management import get_api_key, job_api_keys
+from assets import MODELS_USED, OPENAI_MODEL_FULLNAME
+
+ENV_VAR = list(MODELS_USED[OPENAI_MODEL_FULLNAME])[0]
+
+def test_job_keys_apply_inside_the_block_only(monkeypatch):
+    monkeypatch.delenv(ENV_VAR, raising=False)
+    with job_api_keys({ENV_VAR: "job-key"}):
+        assert get_api_key(OPENAI_MODEL_FULLNAME) == "job-key"
+        assert ENV_VAR not in os.environ
+    assert get_api_key(OPENAI_MODEL_FULLNAME) is None
+
+def test_concurrent_jobs_keep_their_own_keys():
+    seen = {}
+    barrier = threading.Barrier(2)
+
+    def job(key):
+        with job_api_keys({ENV_VAR: key}):
+            barrier.wait()
+            seen[key] = get_api_key(OPENAI_MODEL_FULLNAME)
+
+    threads = [threading.Thread(target=job, args=(key,)) for key in ("key-a", "key-b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen == {"key-a": "key-a", "key-b": "key-b"}
+
+def test_empty_job_keys_fall_back_to_the_environment(monkeypatch):
+    monkeypatch.setenv(ENV_VAR, "env-key")
+    with job_api_keys({ENV_VAR: ""}):
+        assert get_api_key(OPENAI_MODEL_FULLNAME) == "env-key"
@@ -0,0 +1,104 @@
+import asyncio
+import json
+from types import SimpleNamespace
+import pytest
+import accounting
+import batching
+from batching import BatchBackend, _shares, packed_prompt, unpack
+
+def test_packed_prompt_numbers_pages_from_one():
+    prompt = packed_prompt(["  first page \n", "second page"])
+    assert prompt == "=== PAGE 1 ===\nfirst page\n\n=== PAGE 2 ===\nsecond page"
+
+def test_unpack_splits_pages_in_pack_order():
+    parsed = {"pages": [{"page": "2", "listings": [{"title": "b"}]}, {"page": " 1 ", "listings": [{"title": "a"}]}]}
+    assert unpack(parsed, 2) == [[{"title": "a"}], [{"title": "b"}]]
+
+def test_unpack_leaves_out_missing_and_unknown_pages():
+    parsed = {"pages": [{"page": "1", "listings": []}, {"page": "PAGE 2", "listings": [{"title": "x"}]},
+                        {"page": "7", "listings": [{"title": "y"}]}]}
+    assert unpack(parsed, 3) == [[], None, None]
+
+def test_unpack_merges_a_page_returned_twice():
+    parsed = {"pages": [{"page": "1", "listings": [{"title": "a"}]}, {"page": "1", "listings": [{"title": "b"}]}]}
+    assert unpack(parsed, 1) == [[{"title": "a"}, {"title": "b"}]]
+
+def test_shares_follow_page_length():
+    assert _shares(["aaa", "a"]) == [0.75, 0.25]
+    assert _shares(["", ""]) == [0.0, 0.0]
+
+def test_batch_backend_is_abstract():
+    with pytest.raises(TypeError):
+        BatchBackend()
+
+class FakeStorage:
+    def read_many(self, names, columns):
+        return {}
+
+    def flush(self):
+        pass
+
+def test_pages_beyond_the_budget_are_left_out_of_the_batch(tmp_path, monkeypatch):
+    markdowns = {"a": "Item one $10\n" * 50, "b": "Item two $20\n" * 50, "c": "Item three $30\n" * 50}
+    monkeypatch.setattr(batching, "BATCH_DB_PATH", str(tmp_path / "batches.sqlite"))
+    monkeypatch.setattr(batching, "get_storage", FakeStorage)
+    monkeypatch.setattr(batching, "read_raw_data_many", lambda names: {name: markdowns[name] for name in names})
+    monkeypatch.setattr(batching, "preprocess_pages", lambda pages, model, run_stats: [(name, markdown, {}) for name, markdown in pages])
+    monkeypatch.setattr(batching, "plan_page", lambda url, fields, raw, markdown, model, run_stats:
+                        {"key": None, "carried": None, "markdown": markdown})
+    saved = {}
+    monkeypatch.setattr(batching, "save_formatted_data", lambda name, parsed, key: saved.setdefault(name, parsed))
+    requests = []
+
+    def respond(**body):
+        requests.append(body)
+        usage = SimpleNamespace(prompt_tokens=100, completion_tokens=20)
+        message = SimpleNamespace(content=json.dumps({"listings": [{"title": "x", "price": "1"}]}))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+    monkeypatch.setattr(batching.litellm, "completion", respond)
+
+    model = "gpt-4o-mini"
+    page_tokens = sum(accounting.estimate_page(markdowns["a"], model)[key] for key in ("input_tokens", "output_tokens"))
+    budget = accounting.Budget(max_tokens=int(page_tokens * 2.5))
+    run_stats = {}
+    batch_id = batching.submit_batch(["a", "b", "c"], ["title", "price"], model, backend_name="local",
+                                     run_stats=run_stats, budget=budget)
+    assert run_stats["pages_skipped"] == 1
+    assert batching.wait_for_batch(batch_id, 0) == "completed"
+
+    pages = {page["unique_name"]: page for page in batching.collect_batch(batch_id, run_stats, budget)}
+    assert len(requests) == 2
+    assert pages["c"]["error"] == "skipped: over budget" and "c" not in saved
+    assert sorted(saved) == ["a", "b"]
+    assert "extraction_failures" not in run_stats
+    # The reservations were replaced by the usage that was billed
+    assert budget.summary()["tokens_used"] == 240
+
+def test_running_packs_are_referenced_until_done(monkeypatch):
+    async def scenario():
+        release = asyncio.Event()
+
+        async def run(group):
+            await release.wait()
+        packer = batching.PagePacker(["title"], "gpt-4o-mini")
+        monkeypatch.setattr(packer, "_run", run)
+        packer.pending = [("plan", {}, "page", None)]
+        packer._flush()
+        assert len(packer.tasks) == 1
+        release.set()
+        await asyncio.gather(*packer.tasks)
+        await asyncio.sleep(0)
+        return packer.tasks
+    assert asyncio.run(scenario()) == set()
+
+def test_cli_collects_a_batch(tmp_path, monkeypatch, capsys):
+    import cli
+    monkeypatch.setattr(batching, "BATCH_DB_PATH", str(tmp_path / "batches.sqlite"))
+    monkeypatch.setattr(batching, "get_storage", FakeStorage)
+    monkeypatch.setattr(batching, "read_raw_data_many", lambda names: {})
+    monkeypatch.setattr(batching, "preprocess_pages", lambda pages, model, run_stats: [])
+    batch_id = batching.submit_batch([], ["title"], "gpt-4o-mini", backend_name="local")
+    capsys.readouterr()
+    args = cli.build_parser().parse_args(["batch", batch_id, "--wait"])
+    assert args.func(args) == 0
+    assert json.loads(capsys.readouterr().out)["status"] == "completed"
@@ -0,0 +1,77 @@
+import chunking
+from chunking import chunk_budget, split_blocks, split_markdown
+
+MODEL = "gpt-4o-mini"
+
+def counting_tokenizer(monkeypatch, chars_per_token=4):
+    calls = []
+
+    def token_counter(model=None, text=None):
+        calls.append(len(text))
+        return len(text) // chars_per_token + 1
+    monkeypatch.setattr(chunking, "token_counter", token_counter)
+    return calls
+
+def listing_page(count):
+    return "# Shop\n\n" + "".join(f"- [Product {i}](link://{i}) ${i}.99 in stock\n" for i in range(count))
+
+def test_split_blocks_starts_at_headings_and_list_items():
+    assert split_blocks("# A\ntext\n- one\n- two\n") == ["# A\ntext\n", "- one\n", "- two\n"]
+
+def test_page_that_fits_is_one_chunk(monkeypatch):
+    calls = counting_tokenizer(monkeypatch)
+    markdown = listing_page(10)
+    assert split_markdown(markdown, 10000, MODEL) == [markdown]
+    assert len(calls) == 1
+
+def test_chunks_fit_the_budget_and_keep_every_block(monkeypatch):
+    calls = counting_tokenizer(monkeypatch)
+    markdown = listing_page(5000)
+    chunks = split_markdown(markdown, 500, MODEL)
+    assert "".join(chunks) == markdown
+    assert all(len(chunk) // 4 + 1 <= 500 for chunk in chunks)
+    assert all(line.startswith(("# ", "- ", "\n")) for chunk in chunks for line in chunk.splitlines(keepends=True))
+    # The tokenizer runs once per chunk, never per block
+    assert len(calls) == len(chunks)
+
+def test_huge_line_is_cut(monkeypatch):
+    counting_tokenizer(monkeypatch)
+    markdown = "x" * 10000
+    chunks = split_markdown(markdown, 100, MODEL)
+    assert "".join(chunks) == markdown
+    assert max(len(chunk) for chunk in chunks) <= 400
+
+def test_denser_text_than_estimated_is_packed_again(monkeypatch):
+    # Two characters per token while the estimate assumes four
+    counting_tokenizer(monkeypatch, chars_per_token=2)
+    markdown = listing_page(2000)
+    chunks = split_markdown(markdown, 500, MODEL)
+    assert "".join(chunks) == markdown
+    assert all(len(chunk) // 2 + 1 <= 500 for chunk in chunks)
+
+def test_split_blocks_falls_back_to_paragraphs():
+    markdown = "First paragraph\nwraps\n\nSecond paragraph\n\n- item\n\n  continued\n\nAfter the list\n"
+    assert split_blocks(markdown) == ["First paragraph\nwraps\n\n", "Second paragraph\n\n", "- item\n\n  continued\n\n",
+                                      "After the list\n"]
+
+def test_chunk_budget_leaves_room_for_the_prompt(monkeypatch):
+    monkeypatch.setattr(chunking, "model_max_tokens", lambda model: 128000)
+    assert chunk_budget(MODEL) == 128000 - chunking.CHUNK_RESERVED_TOKENS
+    # A small context window still gets a usable budget
+    monkeypatch.setattr(chunking, "model_max_tokens", lambda model: 1000)
+    assert chunk_budget(MODEL) == chunking.CHUNK_RESERVED_TOKENS
+
+def test_chunk_budget_defaults_for_unknown_models(monkeypatch):
+    def unknown(model):
+        raise ValueError("no such model")
+    monkeypatch.setattr(chunking, "model_max_tokens", unknown)
+    assert chunk_budget("my-local-model") == chunking.DEFAULT_CHUNK_TOKENS
+    monkeypatch.setattr(chunking, "model_max_tokens", lambda model: None)
+    assert chunk_budget("my-local-model") == chunking.DEFAULT_CHUNK_TOKENS
+
+def test_listing_blocks_are_not_cut_between_chunks(monkeypatch):
+    counting_tokenizer(monkeypatch)
+    markdown = listing_page(1000)
+    blocks = set(split_blocks(markdown))
+    for chunk in split_markdown(markdown, 300, MODEL):
+        assert set(split_blocks(chunk)) <= blocks
@@ -0,0 +1,96 @@
+import csv
+import json
+import pytest
+import export
+
+PAGES = {
+    "p1": {"formatted_data": {"listings": [{"title": "a", "price": "1"}, {"title": "b", "price": "2"}]},
+           "pagination_data": {"page_urls": ["https://shop.test/2", "https://shop.test/3"]}},
+    "p2": {"formatted_data": json.dumps({"listings": [{"title": "c", "tags": ["new", "sale"]}]})},
+    "p3": {"formatted_data": "not json"},
+}
+
+class FakeStorage:
+    def __init__(self):
+        self.reads = []
+
+    def read_many(self, names, columns):
+        self.reads.append(names)
+        return {name: PAGES[name] for name in names if name in PAGES}
+
+def fake_storage(monkeypatch):
+    storage = FakeStorage()
+    monkeypatch.setattr(export, "get_storage", lambda: storage)
+    return storage
+
+def test_rows_are_read_one_chunk_of_pages_at_a_time(monkeypatch):
+    storage = fake_storage(monkeypatch)
+    rows = list(export.iter_rows(["p1", "p2", "p1", "p3", "missing"], chunk_pages=2))
+    assert [row.get("title") for row in rows] == ["a", "b", "c", None]
+    assert rows[-1] == {"raw_text": "not json"}
+    assert storage.reads == [["p1", "p2"], ["p3", "missing"]]
+
+def test_pagination_rows(monkeypatch):
+    fake_storage(monkeypatch)
+    assert list(export.iter_rows(["p1", "p2"], "pagination")) == [{"page_url": "https://shop.test/2"},
+                                                                  {"page_url": "https://shop.test/3"}]
+    assert export.row_count("pagination", PAGES["p1"]["pagination_data"]) == 2
+    assert export.row_count("listings", PAGES["p2"]["formatted_data"]) == 1
+
+def test_preview_pages(monkeypatch):
+    fake_storage(monkeypatch)
+    assert export.preview(["p1", "p2"], page=1, page_size=2) == ([{"title": "a", "price": "1"}, {"title": "b", "price": "2"}], True)
+    assert export.preview(["p1", "p2"], page=2, page_size=2) == ([{"title": "c", "tags": ["new", "sale"]}], False)
+
+def test_csv_export(monkeypatch, tmp_path):
+    fake_storage(monkeypatch)
+    path = tmp_path / "listings.csv"
+    assert export.export(["p1", "p2"], "csv", str(path)) == 3
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == ["title", "price", "tags"]
+    assert rows[2] == {"title": "c", "price": "", "tags": '["new", "sale"]'}
+
+def test_csv_header_can_be_given(monkeypatch, tmp_path):
+    fake_storage(monkeypatch)
+    path = tmp_path / "listings.csv"
+    export.export(["p1", "p2"], "csv", str(path), columns=["price", "title"])
+    assert path.read_text(encoding="utf-8").splitlines() == ["price,title", "1,a", "2,b", ",c"]
+
+def test_jsonl_export(monkeypatch, tmp_path):
+    fake_storage(monkeypatch)
+    path = tmp_path / "out" / "listings.jsonl"
+    assert export.export(["p1", "p2"], "jsonl", str(path)) == 3
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line) for line in lines][2] == {"title": "c", "tags": ["new", "sale"]}
+
+def test_parquet_export(monkeypatch, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    fake_storage(monkeypatch)
+    monkeypatch.setattr(export, "EXPORT_BATCH_ROWS", 2)
+    path = tmp_path / "listings.parquet"
+    assert export.export(["p1", "p2"], "parquet", str(path)) == 3
+    parquet = pq.ParquetFile(str(path))
+    assert parquet.metadata.num_row_groups == 2
+    # The columns come from the first batch of rows, all as strings
+    assert parquet.read().to_pylist() == [{"title": "a", "price": "1"}, {"title": "b", "price": "2"},
+                                          {"title": "c", "price": None}]
+
+def test_bad_format_and_parquet_to_stdout_are_refused(monkeypatch):
+    fake_storage(monkeypatch)
+    with pytest.raises(ValueError):
+        export.export(["p1"], "xlsx", "-")
+    with pytest.raises(ValueError):
+        export.export(["p1"], "parquet", "-")
+
+def test_job_file_is_written_once(monkeypatch, tmp_path):
+    storage = fake_storage(monkeypatch)
+    monkeypatch.setattr(export, "EXPORT_DIR", str(tmp_path))
+    results = {"data": [{"unique_name": "p1"}, {"unique_name": "p2"}], "pagination_info": [{"unique_name": "p1"}]}
+    path = export.export_job_file("job1", results, "jsonl")
+    assert path == str(tmp_path / "job1_listings.jsonl")
+    assert export.export_job_file("job1", results, "jsonl") == path
+    assert len(storage.reads) == 1
+    pagination = export.export_job_file("job1", results, "csv", kind="pagination")
+    with open(pagination, encoding="utf-8") as f:
+        assert f.read().splitlines() == ["page_url", "https://shop.test/2", "https://shop.test/3"]
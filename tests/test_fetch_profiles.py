@@ -0,0 +1,61 @@
+import asyncio
+import fetch_profiles
+from fetch_profiles import allows_static, block_resources, has_content, resolve_profile, scroll_script
+
+def test_domain_profiles_win_over_the_job_profile(monkeypatch):
+    monkeypatch.setattr(fetch_profiles, "DOMAIN_FETCH_PROFILES", {"example.com": "infinite_scroll"})
+    assert resolve_profile("https://shop.example.com/list", "lean")["name"] == "infinite_scroll"
+    assert resolve_profile("https://other.test/list", "lean")["name"] == "lean"
+
+def test_unknown_profiles_fall_back_to_the_default():
+    profile = resolve_profile("https://other.test/list", "missing")
+    assert profile["name"] == fetch_profiles.FETCH_PROFILE
+    assert profile["page_load"] and profile["script"]
+
+def test_scrolling_profiles_need_the_browser():
+    assert not allows_static(resolve_profile("https://a.test", "infinite_scroll"))
+    assert allows_static(resolve_profile("https://a.test", "lean"))
+
+def test_wait_for_selector_in_static_html():
+    profile = {**resolve_profile("https://a.test", "standard"), "wait_for": ".results li"}
+    assert has_content(profile, "<ul class='results'><li>Widget</li></ul>")
+    assert not has_content(profile, "<ul class='results'></ul>")
+
+def test_scroll_script_awaits_at_top_level():
+    # crawl4ai awaits js_code as the body of an async function; a detached async IIFE would not be awaited
+    script = scroll_script(resolve_profile("https://a.test", "infinite_scroll")).strip()
+    assert not script.startswith("(async")
+    assert "await new Promise" in script
+
+class Request:
+    def __init__(self, url, resource_type):
+        self.url, self.resource_type = url, resource_type
+
+class Route:
+    def __init__(self, url, resource_type):
+        self.request = Request(url, resource_type)
+        self.outcome = None
+
+    async def abort(self):
+        self.outcome = "aborted"
+
+    async def continue_(self):
+        self.outcome = "continued"
+
+class Page:
+    async def route(self, pattern, handler):
+        self.handler = handler
+
+class Config:
+    def __init__(self, profile, site):
+        self.shared_data = {"fetch_profile": profile, "site": site}
+
+def test_blocked_resources_are_aborted():
+    page = Page()
+    asyncio.run(block_resources(page, config=Config(resolve_profile("https://shop.test", "lean"), "shop.test")))
+    routes = [Route("https://shop.test/", "document"), Route("https://shop.test/a.png", "image"),
+              Route("https://shop.test/app.js", "script"), Route("https://ads.test/tag.js", "script"),
+              Route("https://ads.test/frame", "document")]
+    for route in routes:
+        asyncio.run(page.handler(route))
+    assert [route.outcome for route in routes] == ["continued", "aborted", "continued", "aborted", "continued"]
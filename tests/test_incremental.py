@@ -0,0 +1,46 @@
+from incremental import carried_listings, changed_blocks, extraction_key
+
+PREVIOUS = "# Shop\n\n- Blue Widget $10 Berlin\n\n- Red Widget $20 Berlin\n\n- Green Widget $30 Paris\n"
+LISTINGS = [
+    {"name": "Blue Widget", "price": "$10", "city": "Berlin"},
+    {"name": "Red Widget", "price": "$20", "city": "Berlin"},
+    {"name": "Green Widget", "price": "$30", "city": "Paris"},
+]
+
+def names(listings):
+    return [listing["name"] for listing in listings]
+
+def test_unchanged_page_has_no_changed_blocks():
+    assert changed_blocks(PREVIOUS, PREVIOUS) == []
+
+def test_link_targets_are_ignored():
+    previous = "- [Blue Widget](link://1) $10\n"
+    assert changed_blocks(previous, "- [Blue Widget](link://7) $10\n") == []
+
+def test_added_block_is_changed():
+    markdown = PREVIOUS + "\n- Yellow Widget $40 Rome\n"
+    assert [block.strip() for block in changed_blocks(PREVIOUS, markdown)] == ["- Yellow Widget $40 Rome"]
+
+def test_changed_price_is_not_carried():
+    markdown = PREVIOUS.replace("$10", "$12")
+    changed = changed_blocks(PREVIOUS, markdown)
+    assert [block.strip() for block in changed] == ["- Blue Widget $12 Berlin"]
+    assert names(carried_listings(LISTINGS, markdown, changed)) == ["Red Widget", "Green Widget"]
+
+def test_values_shared_with_a_changed_block_are_still_carried():
+    markdown = PREVIOUS + "\n- Yellow Widget $40 Berlin\n"
+    changed = changed_blocks(PREVIOUS, markdown)
+    assert names(carried_listings(LISTINGS, markdown, changed)) == names(LISTINGS)
+
+def test_removed_listing_is_not_carried():
+    markdown = PREVIOUS.replace("- Green Widget $30 Paris\n", "")
+    assert names(carried_listings(LISTINGS, markdown, changed_blocks(PREVIOUS, markdown))) == ["Blue Widget", "Red Widget"]
+
+def test_extraction_key_ignores_field_order_and_url_spelling():
+    assert extraction_key("https://Shop.test/list/", ["b", "a"]) == extraction_key("https://shop.test/list", ["a", "b"])
+    assert extraction_key(None, ["a"]) is None
+
+def test_pages_without_headings_or_lists_diff_by_paragraph():
+    previous = "Widget, $10, Berlin\n\nGadget, $12, Paris\n\nGizmo, $14, Rome\n"
+    current = "Widget, $10, Berlin\n\nGadget, $15, Paris\n\nGizmo, $14, Rome\n"
+    assert changed_blocks(previous, current) == ["Gadget, $15, Paris\n\n"]
@@ -0,0 +1,61 @@
+import time
+import jobs
+from jobs import JobRunner, JobStore, _book_usage, _pagination_usage
+
+RESULTS = {"input_tokens": 1000, "output_tokens": 300, "total_cost": 0.05}
+RUN_STATS = {"pagination_input_tokens": 400, "pagination_output_tokens": 100, "pagination_cost": 0.02}
+
+def test_scraping_and_pagination_are_booked_separately():
+    details = {}
+    _book_usage(details, RESULTS, _pagination_usage(RUN_STATS), scraped=True, paginated=True)
+    assert (details["in_tokens_s"], details["out_tokens_s"]) == (600, 200)
+    assert (details["in_tokens_p"], details["out_tokens_p"]) == (400, 100)
+    assert abs(details["cost_s"] - 0.03) < 1e-9 and details["cost_p"] == 0.02
+
+def test_pagination_only_job():
+    details = {}
+    _book_usage(details, RESULTS, _pagination_usage(RESULTS | {"pagination_input_tokens": 1000, "pagination_output_tokens": 300,
+                                                               "pagination_cost": 0.05}), scraped=False, paginated=True)
+    assert "in_tokens_s" not in details
+    assert details["in_tokens_p"] == 1000
+
+def test_scraping_only_job():
+    details = {}
+    _book_usage(details, RESULTS, _pagination_usage({}), scraped=True, paginated=False)
+    assert details == {"in_tokens_s": 1000, "out_tokens_s": 300, "cost_s": 0.05}
+
+def _age(store, job_id, status, seconds):
+    with store._connect() as conn:
+        conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?", (status, time.time() - seconds, job_id))
+
+def test_jobs_of_an_exited_process_are_recovered(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    running, pending, fresh = (store.create({"urls": [], "model": "m"}) for _ in range(3))
+    _age(store, running, "running", 3600)
+    _age(store, pending, "pending", 3600)
+    _age(store, fresh, "running", 5)
+    assert store.recover_stale(60) == [(pending, {"urls": [], "model": "m"})]
+    assert store.get(running)["status"] == "failed"
+    assert store.get(fresh)["status"] == "running"
+    # A claimed job is fresh again, so no other runner claims it too
+    assert store.recover_stale(60) == []
+
+def test_runner_requeues_pending_jobs_on_start(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    job_id = store.create({"urls": [], "model": "m"})
+    _age(store, job_id, "pending", 3600)
+    monkeypatch.setattr(jobs, "execute_job", lambda store, job_id, params: {"data": [], "details": {}})
+    runner = JobRunner(store, workers=1)
+    assert runner.wait(job_id, 0.01)["status"] == "completed"
+    assert runner.active == set()
+
+def test_results_keep_only_unique_names_and_row_counts():
+    results = {"data": [], "pagination_info": [], "details": {}}
+    pages = [{"url": "https://a.test/1", "unique_name": "a1", "parsed_data": {"listings": [{"title": "x"}, {"title": "y"}]},
+              "pagination_data": {"page_urls": ["https://a.test/2"]}},
+             {"url": "https://a.test/2", "unique_name": "a2", "parsed_data": None, "pagination_data": None}]
+    for page in pages:
+        jobs._add_entry(results, jobs._page_entry(page), listings=True, pagination=True)
+    assert results["data"] == [{"unique_name": "a1"}]
+    assert results["pagination_info"] == [{"unique_name": "a1"}]
+    assert results["details"] == {"listing_rows": 2, "page_url_count": 1}
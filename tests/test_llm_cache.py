@@ -0,0 +1,79 @@
+import llm_cache
+import llm_calls
+
+MODEL = "gpt-4o-mini"
+MESSAGES = [{"role": "system", "content": "Extract listings"}, {"role": "user", "content": "page"}]
+SCHEMA = {"type": "object", "properties": {"listings": {"type": "array"}}}
+
+class Listings:
+    @classmethod
+    def model_json_schema(cls):
+        return SCHEMA
+
+def use_cache(monkeypatch, tmp_path, **settings):
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_PATH", str(tmp_path / "llm_cache.sqlite"))
+    for name, value in settings.items():
+        monkeypatch.setattr(llm_cache, name, value)
+
+def key(**params):
+    return llm_cache.make_key({"model": MODEL, "messages": MESSAGES, "response_format": SCHEMA, **params})
+
+def test_key_is_stable():
+    assert key() == key()
+    assert key(response_format=Listings) == key()
+    # Key order inside the schema doesn't matter
+    assert key(response_format=dict(reversed(list(SCHEMA.items())))) == key()
+
+def test_key_changes_with_model_prompt_schema_and_page():
+    keys = {
+        key(),
+        key(model="gpt-4o"),
+        key(messages=[MESSAGES[0], {"role": "user", "content": "another page"}]),
+        key(messages=[{"role": "system", "content": "Extract prices"}, MESSAGES[1]]),
+        key(response_format={"type": "object"}),
+    }
+    assert len(keys) == 5
+
+def test_miss_then_hit(monkeypatch, tmp_path):
+    use_cache(monkeypatch, tmp_path)
+    assert llm_cache.get(key()) is None
+    llm_cache.put(key(), {"listings": [{"title": "a"}]}, {"input_tokens": 100, "output_tokens": 20})
+    assert llm_cache.get(key()) == ({"listings": [{"title": "a"}]}, {"input_tokens": 100, "output_tokens": 20})
+    assert llm_cache.get(key(model="gpt-4o")) is None
+
+def test_expired_entries_miss(monkeypatch, tmp_path):
+    use_cache(monkeypatch, tmp_path, LLM_CACHE_MAX_AGE=60)
+    llm_cache.put(key(), {"listings": []}, {"input_tokens": 1, "output_tokens": 1})
+    now = llm_cache.time.time()
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now + 61)
+    assert llm_cache.get(key()) is None
+
+def test_least_recently_used_entries_are_evicted(monkeypatch, tmp_path):
+    use_cache(monkeypatch, tmp_path, LLM_CACHE_MAX_ENTRIES=2)
+    clock = [1000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: clock[0])
+    counts = {"input_tokens": 1, "output_tokens": 1}
+    for page in ("a", "b"):
+        llm_cache.put(key(model=page), page, counts)
+        clock[0] += 1
+    llm_cache.get(key(model="a"))
+    clock[0] += 1
+    llm_cache.put(key(model="c"), "c", counts)
+    assert [llm_cache.get(key(model=page)) is not None for page in ("a", "b", "c")] == [True, False, True]
+
+def test_hit_is_not_billed(monkeypatch, tmp_path):
+    use_cache(monkeypatch, tmp_path)
+    calls = []
+
+    def completion(**params):
+        calls.append(params)
+        return "response"
+    monkeypatch.setattr(llm_calls, "completion", completion)
+    monkeypatch.setattr(llm_calls, "_summarize_response", lambda response, params, input_tokens:
+                        ({"listings": []}, {"input_tokens": 100, "output_tokens": 20}, 0.01))
+    first = llm_calls.call_llm_model("page", SCHEMA, MODEL, "system")
+    second = llm_calls.call_llm_model("page", SCHEMA, MODEL, "system")
+    assert len(calls) == 1
+    assert first == ({"listings": []}, {"input_tokens": 100, "output_tokens": 20}, 0.01)
+    assert second == ({"listings": []}, {"input_tokens": 0, "output_tokens": 0,
+                                         "cached_input_tokens": 100, "cached_output_tokens": 20}, 0.0)
@@ -0,0 +1,36 @@
+import asyncio
+import litellm
+import pytest
+import llm_cache
+import llm_calls
+
+def fake_calls(monkeypatch, errors):
+    attempts = []
+
+    async def acompletion(**params):
+        attempts.append(params["model"])
+        if errors:
+            raise errors.pop(0)
+        return "response"
+    monkeypatch.setattr(llm_calls, "acompletion", acompletion)
+    monkeypatch.setattr(llm_calls, "_summarize_response", lambda response, params, input_tokens:
+                        ('{"listings": []}', {"input_tokens": 10, "output_tokens": 2}, 0.0))
+    monkeypatch.setattr(llm_calls, "LLM_BACKOFF_BASE", 0)
+    monkeypatch.setattr(llm_cache, "get", lambda key: None)
+    monkeypatch.setattr(llm_cache, "put", lambda key, parsed, token_counts: None)
+    return attempts
+
+def call():
+    return asyncio.run(llm_calls.acall_llm_model("page", None, "gpt-4o-mini", "system"))
+
+def test_transient_errors_are_retried(monkeypatch):
+    attempts = fake_calls(monkeypatch, [litellm.Timeout(message="slow", model="gpt-4o-mini", llm_provider="openai"),
+                                        litellm.APIConnectionError(message="reset", llm_provider="openai", model="gpt-4o-mini")])
+    assert call()[0] == '{"listings": []}'
+    assert len(attempts) == 3
+
+def test_client_errors_are_not_retried(monkeypatch):
+    attempts = fake_calls(monkeypatch, [litellm.BadRequestError(message="bad", model="gpt-4o-mini", llm_provider="openai")])
+    with pytest.raises(litellm.BadRequestError):
+        call()
+    assert len(attempts) == 1
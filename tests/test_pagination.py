@@ -0,0 +1,40 @@
+from assets import PAGINATION_CONFIDENCE_THRESHOLD
+from pagination import PAGE_NAME_HINT, detect_pagination_urls
+
+BASE = "https://shop.test/list"
+
+def links(*urls):
+    return "\n".join(f"[{i}]({url})" for i, url in enumerate(urls))
+
+def test_page_query_parameter_is_confident():
+    detected, confidence = detect_pagination_urls(links("/list?page=1", "/list?page=2", "/list?page=4"), BASE)
+    assert confidence >= PAGINATION_CONFIDENCE_THRESHOLD
+    assert detected["page_urls"] == [f"{BASE}?page={n}" for n in range(1, 5)]
+
+def test_links_after_the_current_page_include_it():
+    detected, confidence = detect_pagination_urls(links("/list?page=2", "/list?page=3", "/list?page=5"), BASE)
+    assert confidence >= PAGINATION_CONFIDENCE_THRESHOLD
+    assert detected["page_urls"][0] == BASE
+    assert detected["page_urls"][-1] == f"{BASE}?page=5"
+
+def test_path_segment_after_page():
+    detected, confidence = detect_pagination_urls(links("/list/page/2", "/list/page/3"), BASE)
+    assert confidence >= PAGINATION_CONFIDENCE_THRESHOLD
+    assert detected["page_urls"][-1] == "https://shop.test/list/page/3"
+
+def test_page_size_parameters_are_not_confident():
+    for name in ("pageSize", "per_page", "page_size", "perPage"):
+        urls = [f"/list?{name}={n}" for n in (10, 20, 50, 100)]
+        _, confidence = detect_pagination_urls(links(*urls), BASE)
+        assert confidence < PAGINATION_CONFIDENCE_THRESHOLD, name
+
+def test_page_number_names():
+    for name in ("page", "Page", "pageNum", "page_number", "currentPage", "pageIndex", "p", "offset"):
+        assert PAGE_NAME_HINT.search(name), name
+    for name in ("pageSize", "per_page", "pages_total", "homepage"):
+        assert not PAGE_NAME_HINT.search(name), name
+
+def test_other_hosts_are_ignored():
+    urls = [f"https://ads.test/list?page={n}" for n in (1, 2, 3)]
+    detected, confidence = detect_pagination_urls(links(*urls), BASE)
+    assert detected["page_urls"] == [] and confidence == 0
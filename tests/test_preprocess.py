@@ -0,0 +1,44 @@
+import preprocess
+from preprocess import compact_links, learn_boilerplate, restore_links, strip_boilerplate
+
+FOOTER = "Copyright Example Shop"
+
+def pages(*bodies):
+    return [f"# Menu\n\n{body}\n\n{FOOTER}" for body in bodies]
+
+def test_repeated_blocks_are_stripped():
+    boilerplate = learn_boilerplate("shop.test", pages("a", "b", "c"))
+    assert strip_boilerplate(pages("d")[0], boilerplate) == "d"
+
+def test_boilerplate_is_replaced_by_the_latest_batch():
+    learn_boilerplate("replaced.test", pages("a", "b", "c"))
+    boilerplate = learn_boilerplate("replaced.test", ["x", "y", "z"])
+    # The footer is content on these pages and must not be stripped any more
+    assert strip_boilerplate(f"item\n\n{FOOTER}", boilerplate) == f"item\n\n{FOOTER}"
+
+def test_small_batches_reuse_the_last_learned_boilerplate():
+    learn_boilerplate("reuse.test", pages("a", "b", "c"))
+    assert strip_boilerplate(pages("d")[0], learn_boilerplate("reuse.test", pages("d"))) == "d"
+
+def test_known_domains_are_bounded(monkeypatch):
+    monkeypatch.setattr(preprocess, "BOILERPLATE_MAX_DOMAINS", 2)
+    for domain in ("one.test", "two.test", "three.test"):
+        learn_boilerplate(domain, pages("a", "b", "c"))
+    assert "one.test" not in preprocess._known_boilerplate
+    assert learn_boilerplate("one.test", []) == set()
+
+def test_links_round_trip():
+    url = "https://example.com/products/" + "x" * 80
+    compacted, link_map = compact_links(f"[Item]({url})")
+    assert url not in compacted
+    assert restore_links({"link": compacted[7:-1]}, link_map) == {"link": url}
+
+def test_the_same_page_repeated_is_not_boilerplate():
+    page = "# Shop\n\n- Widget $10\n\n- Gadget $12"
+    processed = preprocess.preprocess_pages([("dup.test_2026_01_01__00_00_00_1", page)] * 3, "gpt-4o-mini")
+    assert [markdown for _, markdown, _ in processed] == [page] * 3
+
+def test_a_page_is_never_stripped_empty():
+    boilerplate = learn_boilerplate("empty.test", pages("a", "b", "c"))
+    page = f"# Menu\n\n{FOOTER}"
+    assert strip_boilerplate(page, boilerplate) == page
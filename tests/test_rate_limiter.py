@@ -0,0 +1,82 @@
+import asyncio
+import rate_limiter
+from rate_limiter import ProviderLimiter, TokenBucket, get_limiter
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def fake_clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock)
+    return clock
+
+def fake_sleep(monkeypatch):
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(seconds)
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", sleep)
+    return waits
+
+def test_bucket_waits_once_it_is_empty(monkeypatch):
+    fake_clock(monkeypatch)
+    bucket = TokenBucket(60)
+    assert [bucket.reserve(30), bucket.reserve(30)] == [0.0, 0.0]
+    # One token per second: the next 10 are repaid in 10 seconds
+    assert bucket.reserve(10) == 10.0
+
+def test_bucket_refills_up_to_capacity(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    bucket = TokenBucket(60)
+    bucket.reserve(60)
+    clock.now += 30
+    assert bucket.reserve(30) == 0.0
+    clock.now += 1000
+    bucket.reserve(0)
+    assert bucket.tokens == 60
+
+def test_oversized_reservation_is_capped_at_capacity(monkeypatch):
+    fake_clock(monkeypatch)
+    bucket = TokenBucket(100)
+    # A request larger than a whole minute of tokens waits one period, not forever
+    assert bucket.reserve(1000) == 0.0
+    assert bucket.reserve(1000) == 60.0
+
+def test_limiter_waits_for_the_tighter_bucket(monkeypatch):
+    fake_clock(monkeypatch)
+    waits = fake_sleep(monkeypatch)
+    limiter = ProviderLimiter(rpm=60, tpm=600)
+    asyncio.run(limiter.acquire(600))
+    asyncio.run(limiter.acquire(300))
+    # Requests are free, tokens refill at 10 per second
+    assert waits == [30.0]
+
+def test_consume_charges_tokens_after_the_call(monkeypatch):
+    fake_clock(monkeypatch)
+    waits = fake_sleep(monkeypatch)
+    limiter = ProviderLimiter(rpm=60, tpm=600)
+    asyncio.run(limiter.acquire(100))
+    limiter.consume(500)
+    asyncio.run(limiter.acquire(100))
+    assert waits == [10.0]
+
+def test_back_off_pauses_every_caller(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    waits = fake_sleep(monkeypatch)
+    limiter = ProviderLimiter(rpm=60, tpm=600)
+    limiter.back_off(5)
+    clock.now += 2
+    asyncio.run(limiter.acquire(1))
+    assert waits == [3.0]
+
+def test_limiters_are_shared_per_model(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    monkeypatch.setattr(rate_limiter, "MODEL_RATE_LIMITS", {"fast-model": {"rpm": 10, "tpm": 1000}})
+    limiter = get_limiter("fast-model")
+    assert get_limiter("fast-model") is limiter
+    assert limiter.requests.capacity == 10 and limiter.tokens.capacity == 1000
+    assert get_limiter("other-model").tokens.capacity == rate_limiter.DEFAULT_RATE_LIMITS["tpm"]
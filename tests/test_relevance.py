@@ -0,0 +1,57 @@
+import random
+import relevance
+from relevance import field_terms, measure_recall, score_blocks, select_relevant
+
+FIELDS = ["title", "price", "location"]
+MODEL = "gpt-4o-mini"
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore".split()
+
+def prose(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def listing_page(count, seed=1):
+    rng = random.Random(seed)
+    items = [{"title": f"Widget Model {i}", "price": f"${i * 3 + 5}.99", "location": rng.choice(["Berlin", "Paris", "Remote"])}
+             for i in range(count)]
+    markdown = "# Our Shop Blog\n\n" + "\n\n".join(prose(rng, 120) for _ in range(15)) + "\n\n## Products\n\n"
+    markdown += "".join(f"- [{item['title']}](link://{i}) {item['price']} · {item['location']}\n" for i, item in enumerate(items))
+    markdown += "\n## Footer\n\n" + prose(rng, 200)
+    return markdown, items
+
+def test_field_terms_include_hints_and_shapes():
+    terms, shapes = field_terms(["price", "job_title"])
+    assert {"price", "cost", "job", "title", "name"} <= set(terms)
+    assert relevance.MONEY in shapes
+
+def test_listing_blocks_score_above_prose():
+    blocks = ["Lorem ipsum dolor sit amet.\n\n", "- [Widget](link://1) $10 · Berlin\n", "- [Gadget](link://2) $12 · Paris\n",
+              "- [Gizmo](link://3) $14 · Rome\n"]
+    scores = score_blocks(blocks, FIELDS)
+    assert min(scores[1:]) > scores[0]
+
+def test_small_pages_are_unchanged():
+    markdown = "- [Widget](link://1) $10\n"
+    assert select_relevant(markdown, FIELDS, MODEL) == markdown
+
+def test_prose_is_dropped_and_listings_kept():
+    markdown, items = listing_page(40)
+    run_stats = {}
+    selected = select_relevant(markdown, FIELDS, MODEL, run_stats=run_stats)
+    assert len(selected) < len(markdown) / 2
+    assert run_stats["relevance_pages"] == 1
+    assert measure_recall(markdown, items, FIELDS, MODEL)["listing_recall"] == 1.0
+
+def test_long_listing_page_keeps_every_item():
+    markdown, items = listing_page(2500)
+    recall = measure_recall(markdown, items, FIELDS, MODEL)
+    assert recall["listing_recall"] == 1.0
+    assert recall["token_share"] < 1.0
+
+def test_listings_without_field_words_are_kept():
+    rng = random.Random(3)
+    books = [{"title": f"The {rng.choice(WORDS).title()} of {rng.choice(WORDS).title()} {i}",
+              "author": f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}"} for i in range(400)]
+    markdown = "# Bookshop\n\nSearch by title or author below.\n\n"
+    markdown += "".join(f"- [{book['title']}](link://{i})\n  by {book['author']} · {i + 100} pages\n" for i, book in enumerate(books))
+    recall = measure_recall(markdown, books, ["title", "author"], MODEL)
+    assert recall["listing_recall"] == 1.0
@@ -0,0 +1,40 @@
+import accounting
+import scraper
+from scraper import merge_listings, scrape_urls
+
+MODEL = "gpt-4o-mini"
+
+class FakeStorage:
+    def read_many(self, names, columns):
+        return {name: {"url": f"https://shop.test/{name}"} for name in names}
+
+    def flush(self):
+        pass
+
+def test_merge_listings_drops_duplicates():
+    merged = merge_listings([{"listings": [{"title": "a"}, {"title": "b"}]}, {"listings": [{"title": "a"}]}])
+    assert merged == {"listings": [{"title": "a"}, {"title": "b"}]}
+
+def test_pages_beyond_the_budget_are_skipped(monkeypatch):
+    markdowns = {name: f"- Item {name} $10\n" * 200 for name in ("a", "b", "c")}
+    monkeypatch.setattr(scraper, "get_storage", FakeStorage)
+    monkeypatch.setattr(scraper, "read_raw_data_many", lambda names: {name: markdowns[name] for name in names})
+    monkeypatch.setattr(scraper, "preprocess_pages", lambda pages, model, run_stats: [(name, markdown, {}) for name, markdown in pages])
+    monkeypatch.setattr(scraper, "plan_page", lambda url, fields, raw, markdown, model, run_stats:
+                        {"key": None, "carried": None, "markdown": markdown})
+    saved = []
+    monkeypatch.setattr(scraper, "save_formatted_data", lambda name, parsed, key: saved.append(name))
+
+    estimate = accounting.estimate_page(markdowns["a"], MODEL)
+
+    async def extract(plan, link_map, container, model, limit, run_stats, label):
+        return {"listings": [{"title": label}]}, {"input_tokens": estimate["input_tokens"], "output_tokens": 10}, 0.001
+    monkeypatch.setattr(scraper, "extract_page_async", extract)
+
+    budget = accounting.Budget(max_tokens=estimate["input_tokens"] + estimate["output_tokens"] + 50)
+    run_stats = {}
+    in_tokens, _, _, results = scrape_urls(["a", "b", "c"], ["title"], MODEL, run_stats, budget=budget)
+    assert run_stats["pages_skipped"] == 2
+    assert len(saved) == 1 and len(results) == 1
+    # The reservation was settled to the usage that was billed
+    assert budget.summary()["tokens_used"] == estimate["input_tokens"] + 10 == in_tokens + 10
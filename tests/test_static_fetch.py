@@ -0,0 +1,32 @@
+from static_fetch import html_to_markdown, js_dependence
+
+BASE = "https://shop.test/list"
+TEXT = "<p>" + "Server-rendered header and footer text. " * 10 + "</p>"
+
+def test_headings_links_and_list_items():
+    html = ("<html><body><h2>Widgets</h2><!-- comment --><ul>"
+            "<li><a href='/w/1'>Blue Widget</a> <b>$10</b></li><li>Red<br>Widget</li></ul></body></html>")
+    assert html_to_markdown(html, BASE) == "## Widgets\n\n- [Blue Widget](https://shop.test/w/1) **$10**\n\n- Red\n  Widget"
+
+def test_table_rows_and_images():
+    html = "<table><tr><th>Name</th><th>Price</th></tr><tr><td>Widget</td><td>$10</td></tr></table><img src='/a.png' alt='A'>"
+    assert html_to_markdown(html, BASE) == "| Name | Price |\n\n| Widget | $10 |\n\n![A](https://shop.test/a.png)"
+
+def test_scripts_are_skipped():
+    assert html_to_markdown("<body><script>var x = 1;</script><p>Hello</p></body>", BASE) == "Hello"
+
+def test_server_rendered_page_is_static():
+    html = f"<body>{TEXT}</body>"
+    assert js_dependence(html, html_to_markdown(html, BASE)) is None
+
+def test_empty_body_needs_a_browser():
+    html = "<body><p>Loading</p></body>"
+    assert js_dependence(html, html_to_markdown(html, BASE)) == "empty body"
+
+def test_empty_app_root_needs_a_browser_despite_surrounding_text():
+    html = f"<body><header>{TEXT}</header><div id=\"root\"></div><footer>{TEXT}</footer></body>"
+    assert js_dependence(html, html_to_markdown(html, BASE)) == "empty app root"
+
+def test_javascript_notice_needs_a_browser_despite_surrounding_text():
+    html = f"<body>{TEXT}<noscript>Please enable JavaScript to view the listings.</noscript></body>"
+    assert js_dependence(html, html_to_markdown(html, BASE)) == "requires JavaScript"
@@ -0,0 +1,96 @@
+import pytest
+from storage import SQLiteBackend, Storage
+
+def sqlite_backend(tmp_path):
+    return SQLiteBackend(str(tmp_path / "scraped_data.sqlite"))
+
+class CountingBackend:
+    def __init__(self, backend):
+        self.backend = backend
+        self.reads = []
+        self.upserts = []
+        self.fail = False
+
+    def read_rows(self, unique_names, columns):
+        self.reads.append(list(unique_names))
+        return self.backend.read_rows(unique_names, columns)
+
+    def find_latest(self, column, value, columns, order_by):
+        return self.backend.find_latest(column, value, columns, order_by)
+
+    def upsert_rows(self, rows):
+        if self.fail:
+            raise ConnectionError("backend down")
+        self.upserts.append(rows)
+        self.backend.upsert_rows(rows)
+
+def storage(tmp_path, batch_size=3):
+    backend = CountingBackend(sqlite_backend(tmp_path))
+    return Storage(backend, batch_size=batch_size, flush_interval=3600), backend
+
+def test_sqlite_round_trip(tmp_path):
+    backend = sqlite_backend(tmp_path)
+    backend.upsert_rows([{"unique_name": "a", "url": "https://shop.test/a", "formatted_data": {"listings": [{"title": "x"}]}}])
+    backend.upsert_rows([{"unique_name": "a", "raw_data": "# Page"}])
+    row = backend.read_rows(["a", "missing"], ["url", "raw_data", "formatted_data"])
+    # JSON columns come back decoded and an upsert keeps the columns it doesn't set
+    assert row == {"a": {"unique_name": "a", "url": "https://shop.test/a", "raw_data": "# Page",
+                         "formatted_data": {"listings": [{"title": "x"}]}}}
+
+def test_sqlite_rejects_unknown_columns(tmp_path):
+    backend = sqlite_backend(tmp_path)
+    with pytest.raises(ValueError):
+        backend.read_rows(["a"], ["url; DROP TABLE scraped_data"])
+    with pytest.raises(ValueError):
+        backend.upsert_rows([{"unique_name": "a", "price": "10"}])
+
+def test_sqlite_find_latest(tmp_path):
+    backend = sqlite_backend(tmp_path)
+    backend.upsert_rows([{"unique_name": "old", "url_key": "k", "fetched_at": "2024-01-01"},
+                         {"unique_name": "new", "url_key": "k", "fetched_at": "2024-02-01"},
+                         {"unique_name": "other", "url_key": "j", "fetched_at": "2024-03-01"}])
+    assert backend.find_latest("url_key", "k", ["fetched_at"], "fetched_at")["unique_name"] == "new"
+    assert backend.find_latest("url_key", "none", ["fetched_at"], "fetched_at") is None
+
+def test_writes_are_merged_and_flushed_in_batches(tmp_path):
+    store, backend = storage(tmp_path)
+    store.write("a", {"url": "https://shop.test/a"})
+    store.write("a", {"raw_data": "# A"})
+    store.write("b", {"url": "https://shop.test/b"})
+    assert backend.upserts == []
+    store.write("c", {"url": "https://shop.test/c"})
+    assert len(backend.upserts) == 1
+    assert {"unique_name": "a", "url": "https://shop.test/a", "raw_data": "# A"} in backend.upserts[0]
+    assert len(backend.upserts[0]) == 3
+
+def test_reads_see_pending_writes(tmp_path):
+    store, backend = storage(tmp_path)
+    backend.backend.upsert_rows([{"unique_name": "a", "url": "https://shop.test/a", "raw_data": "old"}])
+    store.write("a", {"raw_data": "new"})
+    store.write("b", {"url": "https://shop.test/b"})
+    assert store.read("a", "raw_data") == "new"
+    rows = store.read_many(["a", "b", "c"], ["url", "raw_data"])
+    assert rows["a"] == {"unique_name": "a", "url": "https://shop.test/a", "raw_data": "new"}
+    assert "c" not in rows
+    # Names fully answered by pending writes are not read from the backend
+    assert store.read_many(["b"], ["url"]) == {"b": {"unique_name": "b", "url": "https://shop.test/b"}}
+    assert backend.reads == [["a", "b", "c"]]
+    store.flush()
+
+def test_failed_flush_keeps_the_writes(tmp_path):
+    store, backend = storage(tmp_path)
+    store.write("a", {"raw_data": "first"})
+    backend.fail = True
+    with pytest.raises(ConnectionError):
+        store.flush()
+    store.write("a", {"url": "https://shop.test/a"})
+    backend.fail = False
+    store.flush()
+    assert backend.backend.read_rows(["a"], ["url", "raw_data"])["a"]["raw_data"] == "first"
+    assert store.pending == {}
+
+def test_find_latest_flushes_matching_writes(tmp_path):
+    store, backend = storage(tmp_path)
+    store.write("a", {"url_key": "k", "fetched_at": "2024-01-01"})
+    assert store.find_latest("url_key", "k", ["fetched_at"], "fetched_at")["unique_name"] == "a"
+    assert len(backend.upserts) == 1
@@ -0,0 +1,18 @@
+from utils import get_domain, normalize_url
+
+def test_trivially_different_spellings_share_a_key():
+    key = normalize_url("https://shop.test/items?page=2&sort=price")
+    assert normalize_url("HTTPS://Shop.TEST:443/items/?sort=price&page=2#top") == key
+    assert normalize_url("  https://shop.test/items?page=2&utm_source=mail&sort=price&fbclid=abc ") == key
+
+def test_meaningful_differences_are_kept():
+    assert normalize_url("http://shop.test:8080/items") == "http://shop.test:8080/items"
+    assert normalize_url("http://shop.test/items") != normalize_url("https://shop.test/items")
+    assert normalize_url("https://shop.test/items?page=2") != normalize_url("https://shop.test/items?page=3")
+
+def test_empty_path_and_blank_values():
+    assert normalize_url("https://shop.test") == "https://shop.test/"
+    assert normalize_url("https://shop.test/?q=&a=1") == "https://shop.test/?a=1&q="
+
+def test_get_domain_is_lower_cased():
+    assert get_domain("https://Shop.TEST/items") == "shop.test"
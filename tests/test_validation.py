@@ -0,0 +1,59 @@
+import json
+import pytest
+from validation import _fill_missing, repair_json
+
+def repaired(text):
+    return json.loads(repair_json(text))
+
+def test_valid_json_is_unchanged():
+    assert repaired('{"listings": [{"a": "x"}]}') == {"listings": [{"a": "x"}]}
+
+def test_code_fences():
+    assert repaired('```json\n{"listings": []}\n```') == {"listings": []}
+
+def test_surrounding_prose():
+    assert repaired('Here are the listings: {"listings": [{"a": "x"}]} Hope this helps!') == {"listings": [{"a": "x"}]}
+
+def test_trailing_commas():
+    assert repaired('{"listings": [{"a": "x", }, {"a": "y"},],}') == {"listings": [{"a": "x"}, {"a": "y"}]}
+
+def test_braces_inside_strings():
+    assert repaired('{"listings": [{"a": "x}]{,"}]}') == {"listings": [{"a": "x}]{,"}]}
+
+@pytest.mark.parametrize("text", [
+    '{"listings": [{"a": "x", "b": "y"}, {"a": "z", "b": "w',  # inside a value
+    '{"listings": [{"a": "x", "b": "y"}, {"a": "z", "b"',     # inside a key
+    '{"listings": [{"a": "x", "b": "y"}, {"a": "z",',         # between the fields of a listing
+    '{"listings": [{"a": "x", "b": "y"}, {',                  # at the start of a listing
+    '{"listings": [{"a": "x", "b": "y"},',                    # between listings
+    '{"listings": [{"a": "x", "b": "y"}',                     # after a listing
+])
+def test_truncation_keeps_only_complete_listings(text):
+    assert repaired(text) == {"listings": [{"a": "x", "b": "y"}]}
+
+def test_truncation_before_the_first_listing():
+    assert repaired('{"listings": [') == {"listings": []}
+    assert repaired('{"listings": [{"a": "x') == {"listings": []}
+
+def test_truncation_inside_a_nested_object():
+    text = '{"listings": [{"a": "x", "b": {"c": "1"}}, {"a": "y", "b": {"c": "2'
+    assert repaired(text) == {"listings": [{"a": "x", "b": {"c": "1"}}]}
+
+def test_truncation_inside_a_nested_array():
+    text = '{"pages": [{"page": "1", "listings": [{"a": "x"}, {"a": "y'
+    assert repaired(text) == {"pages": [{"page": "1", "listings": [{"a": "x"}]}]}
+
+def test_truncation_in_a_list_of_strings():
+    assert repaired('{"page_urls": ["https://a.test/1", "https://a.test/2", "https://a.te') == \
+        {"page_urls": ["https://a.test/1", "https://a.test/2"]}
+
+def test_top_level_array():
+    assert repaired('[{"a": "x"}, {"a": "y"') == [{"a": "x"}]
+
+def test_missing_listing_fields_are_filled():
+    schema = {"properties": {"listings": {"items": {"$ref": "#/$defs/Listing"}, "type": "array"}},
+              "required": ["listings"],
+              "$defs": {"Listing": {"properties": {"title": {"type": "string"}, "price": {"type": "string"}},
+                                    "required": ["title", "price"], "type": "object"}}}
+    data = {"listings": [{"title": "a"}, {"title": "b", "price": "$1"}]}
+    assert _fill_missing(data, schema) == {"listings": [{"title": "a", "price": ""}, {"title": "b", "price": "$1"}]}
@@ -0,0 +1,45 @@
+import sqlite3
+import pipeline
+import worker
+from worker import SQLiteQueue, process_batch
+
+def make_page(url):
+    return {"url": url, "unique_name": url.rsplit("/", 1)[-1], "parsed_data": {"listings": []}, "pagination_data": None,
+            "input_tokens": 10, "output_tokens": 5, "cost": 0.01, "error": None,
+            "pagination_input_tokens": 0, "pagination_output_tokens": 0, "pagination_cost": 0.0}
+
+def test_queue_claims_and_leases(tmp_path):
+    queue = SQLiteQueue(str(tmp_path / "jobs.sqlite"))
+    queue.enqueue("job", ["https://a.test/1", "https://a.test/2", "https://a.test/1"], {"model": "m"})
+    assert [item["url"] for item in queue.claim("w1", 5, 60)] == ["https://a.test/1", "https://a.test/2"]
+    assert queue.claim("w2", 5, 60) == []
+    assert not queue.finish("w2", "job", "https://a.test/1", "done")
+    assert queue.finish("w1", "job", "https://a.test/1", "done")
+    queue.release("w1")
+    assert worker.progress(queue.items("job"))["pending"] == 1
+
+def test_lost_leases_are_not_saved_and_unprocessed_items_are_requeued(tmp_path, monkeypatch):
+    path = str(tmp_path / "jobs.sqlite")
+    queue = SQLiteQueue(path)
+    urls = ["https://a.test/1", "https://a.test/2", "https://a.test/3"]
+    queue.enqueue("job", urls, {"model": "m"})
+    items = queue.claim("w1", 5, 60)
+    # Another worker took over the first item after w1's lease expired
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE work_items SET worker_id = 'w2' WHERE url = ?", (urls[0],))
+    saved = []
+
+    def fake_pipeline(urls, *args, before_save=None, **kwargs):
+        for url in urls[:2]:  # the last URL is never returned
+            page = make_page(url)
+            if before_save(page):
+                saved.append(url)
+            yield page
+
+    monkeypatch.setattr(pipeline, "run_pipeline", fake_pipeline)
+    process_batch(queue, "w1", "job", items)
+    status = {item["url"]: (item["status"], item["worker_id"]) for item in queue.items("job")}
+    assert saved == [urls[1]]
+    assert status[urls[0]] == ("leased", "w2")
+    assert status[urls[1]] == ("done", "w1")
+    assert status[urls[2]][0] == "pending"
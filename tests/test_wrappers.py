@@ -0,0 +1,55 @@
+import asyncio
+import wrappers
+from assets import WRAPPER_MAX_INDUCTIONS
+from wrappers import TemplateSession, apply_template, induce_template, validate_rows
+
+FIELDS = ["title", "price"]
+
+def page(numbers):
+    items = "".join(f"<li class='item'><a class='title' href='/w/{n}'>Widget {n}</a>"
+                    f"<span class='price'>${n}.99</span></li>" for n in numbers)
+    return f"<html><body><h1>Shop</h1><ul class='results'>{items}</ul><footer>About us</footer></body></html>"
+
+def listings(numbers):
+    return [{"title": f"Widget {n}", "price": f"${n}.99"} for n in numbers]
+
+def test_template_reproduces_the_listings_on_sibling_pages():
+    template = induce_template(page(range(1, 6)), "https://shop.test/p1", listings(range(1, 6)), FIELDS)
+    assert template is not None and template["records"] == 5
+    rows = apply_template(template, page(range(6, 10)), "https://shop.test/p2")
+    assert rows == listings(range(6, 10))
+    assert validate_rows(template, rows)
+
+def test_link_fields_use_the_href():
+    found = [{**listing, "url": f"https://shop.test/w/{n}"} for n, listing in zip(range(1, 4), listings(range(1, 4)))]
+    template = induce_template(page(range(1, 4)), "https://shop.test/p1", found, FIELDS + ["url"])
+    assert template["fields"]["url"]["attr"] == "href"
+    assert apply_template(template, page([7]), "https://shop.test/p2")[0]["url"] == "https://shop.test/w/7"
+
+def test_listings_not_on_the_page_learn_nothing():
+    assert induce_template(page(range(1, 4)), "https://shop.test/p1", listings(range(50, 53)), FIELDS) is None
+
+def test_pages_without_records_fail_validation():
+    template = induce_template(page(range(1, 6)), "https://shop.test/p1", listings(range(1, 6)), FIELDS)
+    assert not validate_rows(template, apply_template(template, "<html><body><p>Sold out</p></body></html>", "https://shop.test/p3"))
+
+def test_failed_inductions_are_capped_and_later_pages_run_concurrently(monkeypatch):
+    monkeypatch.setattr(wrappers, "load_template", lambda domain, fields: None)
+    monkeypatch.setattr(wrappers, "induce_template", lambda *args: None)
+    running = peak = 0
+
+    async def llm_extract():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return {"listings": []}, {"input_tokens": 1, "output_tokens": 1}, 0.0
+
+    async def run():
+        session = TemplateSession(FIELDS)
+        await asyncio.gather(*(session.extract(f"https://shop.test/p{n}", "<html></html>", llm_extract) for n in range(10)))
+        return session.inductions["shop.test"]
+
+    assert asyncio.run(run()) == WRAPPER_MAX_INDUCTIONS
+    assert peak > 1
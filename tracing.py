@@ -0,0 +1,179 @@
+"""
+Lightweight tracing and metrics for the scraping pipeline.
+
+Code wraps its stages in spans:
+
+    with span("fetch", url=url) as s:
+        ...
+        s.set(bytes=len(markdown))
+
+Stages used: fetch, storage_read, storage_write, prompt_build, token_count, completion, parse.
+Spans nest through contextvars, so they follow asyncio tasks and asyncio.to_thread.
+Finished spans
+- are kept in a bounded in-memory buffer and can be exported as OpenTelemetry (OTLP/JSON)
+  style traces (export_trace, write_trace),
+- feed per-stage Prometheus metrics (render_prometheus, served at /metrics by api.py),
+- are totalled per stage for every trace started with trace(), for the UI's time breakdown.
+No tracing library is required.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from assets import TRACE_MAX_SPANS, TRACE_DIR, TRACE_BUCKETS
+
+SERVICE_NAME = "scrape-master"
+
+_current = contextvars.ContextVar("current_span", default=None)
+_lock = threading.Lock()
+_finished = deque(maxlen=TRACE_MAX_SPANS)
+_breakdowns = {}
+_histograms = defaultdict(lambda: [0] * (len(TRACE_BUCKETS) + 1))
+_sums = defaultdict(float)
+_counters = defaultdict(float)
+
+class Span:
+    """One timed operation with attributes (url, model, bytes, tokens, ...)."""
+    def __init__(self, name: str, trace_id: str, parent_id: str, attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = {}
+        self.status = "OK"
+        self.start_ns = time.time_ns()
+        self.duration = 0.0
+        self.set(**attributes)
+
+    def set(self, **attributes) -> None:
+        """Adds attributes (None values are ignored)."""
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+def current_span():
+    return _current.get()
+
+def set_attributes(**attributes) -> None:
+    """Adds attributes to the innermost active span, if any."""
+    active = _current.get()
+    if active is not None:
+        active.set(**attributes)
+
+def _record(finished: Span) -> None:
+    with _lock:
+        _finished.append(finished)
+        if finished.trace_id in _breakdowns and finished.parent_id is not None:
+            _breakdowns[finished.trace_id][finished.name] += finished.duration
+        buckets = _histograms[finished.name]
+        for i, bound in enumerate(TRACE_BUCKETS):
+            if finished.duration <= bound:
+                buckets[i] += 1
+        buckets[-1] += 1
+        _sums[finished.name] += finished.duration
+        for key in ("bytes", "input_tokens", "output_tokens", "tokens"):
+            if isinstance(finished.attributes.get(key), (int, float)):
+                _counters[(finished.name, key)] += finished.attributes[key]
+        if finished.status != "OK":
+            _counters[(finished.name, "errors")] += 1
+
+@contextmanager
+def span(name: str, **attributes):
+    """Times the enclosed block as a child of the current span (or as a new trace)."""
+    parent = _current.get()
+    active = Span(name, parent.trace_id if parent else os.urandom(16).hex(), parent.span_id if parent else None, attributes)
+    token = _current.set(active)
+    start = time.perf_counter()
+    try:
+        yield active
+    except BaseException as e:
+        active.status = "ERROR"
+        active.set(error=str(e) or type(e).__name__)
+        raise
+    finally:
+        active.duration = time.perf_counter() - start
+        _current.reset(token)
+        _record(active)
+
+@contextmanager
+def trace(name: str, **attributes):
+    """Starts a new trace; the time of its spans is totalled per stage (see breakdown)."""
+    token = _current.set(None)
+    try:
+        with span(name, **attributes) as root:
+            with _lock:
+                _breakdowns[root.trace_id] = defaultdict(float)
+            try:
+                yield root
+            finally:
+                with _lock:
+                    _breakdowns.pop(root.trace_id, None)
+    finally:
+        _current.reset(token)
+
+def breakdown(trace_id: str) -> dict:
+    """Cumulative seconds per stage so far in a trace started with trace(). Concurrent spans add up."""
+    with _lock:
+        return {name: round(seconds, 3) for name, seconds in sorted(_breakdowns.get(trace_id, {}).items())}
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def export_trace(trace_id: str = None) -> dict:
+    """
+    Finished spans (of one trace, or all buffered ones) in the OTLP/JSON trace format,
+    ready for an OpenTelemetry collector's /v1/traces endpoint.
+    """
+    with _lock:
+        spans = [s for s in _finished if trace_id is None or s.trace_id == trace_id]
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{
+            "scope": {"name": "tracing"},
+            "spans": [{
+                "traceId": s.trace_id,
+                "spanId": s.span_id,
+                **({"parentSpanId": s.parent_id} if s.parent_id else {}),
+                "name": s.name,
+                "kind": 1,
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(s.start_ns + int(s.duration * 1e9)),
+                "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in s.attributes.items()],
+                "status": {"code": 1 if s.status == "OK" else 2},
+            } for s in spans],
+        }],
+    }]}
+
+def write_trace(trace_id: str, name: str) -> str:
+    """Writes one trace to TRACE_DIR/<name>.json and returns the path."""
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    path = os.path.join(TRACE_DIR, f"{name}.json")
+    with open(path, "w") as f:
+        json.dump(export_trace(trace_id), f)
+    return path
+
+def render_prometheus() -> str:
+    """Per-stage duration histograms and byte/token/error counters in the Prometheus text format."""
+    lines = [
+        "# HELP scrape_stage_duration_seconds Time spent per pipeline stage.",
+        "# TYPE scrape_stage_duration_seconds histogram",
+    ]
+    with _lock:
+        for stage, buckets in sorted(_histograms.items()):
+            for bound, count in zip(TRACE_BUCKETS, buckets):
+                lines.append(f'scrape_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'scrape_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {buckets[-1]}')
+            lines.append(f'scrape_stage_duration_seconds_sum{{stage="{stage}"}} {_sums[stage]:.6f}')
+            lines.append(f'scrape_stage_duration_seconds_count{{stage="{stage}"}} {buckets[-1]}')
+        lines.append("# HELP scrape_stage_total Bytes, tokens and errors per pipeline stage.")
+        lines.append("# TYPE scrape_stage_total counter")
+        for (stage, kind), value in sorted(_counters.items()):
+            lines.append(f'scrape_stage_total{{stage="{stage}",kind="{kind}"}} {value:g}')
+    return "\n".join(lines) + "\n"
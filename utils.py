@@ -1,4 +1,6 @@
 from datetime import datetime
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+import asyncio
 import re
 
 def generate_unique_name(url: str) -> str:
@@ -8,3 +10,40 @@ def generate_unique_name(url: str) -> str:
     timestamp = datetime.now().strftime('%Y_%m_%d__%H_%M_%S_%f')
     domain = re.sub(r'\W+', '_', url.split('//')[-1].split('/')[0])
     return f"{domain}_{timestamp}"
+
+def get_domain(url: str) -> str:
+    """
+    Returns the lower-cased host of a URL (used for per-domain limits).
+    """
+    return urlparse(url).netloc.lower()
+
+def run_async(coro):
+    """
+    Runs a coroutine to completion on a fresh event loop and returns its result.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "mc_cid", "mc_eid")
+
+def normalize_url(url: str) -> str:
+    """
+    Normalizes a URL so that trivially different spellings share one cache key:
+    lower-cased scheme and host, no default port, no fragment, no tracking
+    parameters, sorted query string and no trailing slash.
+    """
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower() or "http"
+    host = (parsed.hostname or "").lower()
+    if parsed.port and (scheme, parsed.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parsed.port}"
+    path = parsed.path.rstrip("/") or "/"
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+        if not k.lower().startswith(TRACKING_PARAMS)
+    )
+    return urlunparse((scheme, host, path, "", urlencode(query), ""))
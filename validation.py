@@ -0,0 +1,183 @@
+"""
+Validation, local repair and targeted retries for structured LLM output.
+
+Every extraction or pagination response is validated against its response format
+(DynamicListingsContainer or PaginationModel) before it is cached or saved:
+- almost-valid output (code fences, prose around the JSON, trailing commas, truncated
+  JSON, numbers or nulls where strings are expected, listings missing a field) is repaired
+  locally; a missing field is stored as "" rather than losing the page,
+- output that still doesn't validate raises InvalidResponse, and only that call (one page
+  or one chunk) is retried, with capped exponential backoff.
+Counts are recorded in run_stats: responses_repaired, invalid_responses, retries, validation_failures.
+"""
+import asyncio
+import json
+import random
+import re
+from pydantic import ValidationError
+from tracing import span
+from assets import VALIDATION_MAX_RETRIES, VALIDATION_BACKOFF_BASE, VALIDATION_BACKOFF_MAX
+
+_FENCE = re.compile(r"^```[A-Za-z]*\s*|\s*```$")
+
+class InvalidResponse(ValueError):
+    """
+    An LLM response that doesn't match its schema. Carries the token counts and cost
+    of the attempts that produced it, so failed calls are still accounted for.
+    """
+    def __init__(self, message: str, token_counts: dict = None, cost: float = 0.0):
+        super().__init__(message)
+        self.token_counts = token_counts or {}
+        self.cost = cost
+
+def _count(run_stats: dict, key: str, amount: int = 1) -> None:
+    if run_stats is not None:
+        run_stats[key] = run_stats.get(key, 0) + amount
+
+def repair_json(text: str) -> str:
+    """
+    Best-effort fix of almost-valid JSON: strips code fences and surrounding prose,
+    drops trailing commas, and closes JSON that was cut off mid-way after its last
+    complete array element (a partly written listing would fail validation anyway).
+    """
+    text = _FENCE.sub("", text.strip())
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return text
+    out = []
+    stack = []
+    in_string = escape = False
+    safe = (0, [])  # (length of out, open brackets) where the JSON can be cut and closed: between array elements
+    for ch in text[min(starts):]:
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch in "}]":
+            while out and out[-1] in " \t\r\n,":
+                out.pop()
+            if not stack or ch != stack[-1]:
+                break
+            stack.pop()
+            out.append(ch)
+            if not stack:
+                return "".join(out)
+            if stack[-1] == "]":
+                safe = (len(out), list(stack))
+            continue
+        if ch == "," and stack and stack[-1] == "]":
+            safe = (len(out), list(stack))
+        out.append(ch)
+        if ch == '"':
+            in_string = True
+        elif ch == "{":
+            stack.append("}")
+        elif ch == "[":
+            stack.append("]")
+            safe = (len(out), list(stack))
+    length, stack = safe
+    return "".join(out[:length]).rstrip().rstrip(",") + "".join(reversed(stack))
+
+def _stringify_values(data):
+    """Listing values the model returned as numbers, booleans or null become strings."""
+    if isinstance(data, dict):
+        return {key: _stringify_values(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_stringify_values(item) for item in data]
+    if data is None:
+        return ""
+    if isinstance(data, (int, float, bool)):
+        return str(data)
+    return data
+
+def _fill_missing(data, schema: dict, defs: dict = None):
+    """Required string fields missing from the data (e.g. a listing without a price) become ""."""
+    defs = schema.get("$defs", {}) if defs is None else defs
+    if "$ref" in schema:
+        schema = defs.get(schema["$ref"].rsplit("/", 1)[-1], {})
+    if isinstance(data, list) and isinstance(schema.get("items"), dict):
+        return [_fill_missing(item, schema["items"], defs) for item in data]
+    properties = schema.get("properties")
+    if isinstance(data, dict) and isinstance(properties, dict):
+        filled = {key: _fill_missing(value, properties[key], defs) if key in properties else value
+                  for key, value in data.items()}
+        for key in schema.get("required", []):
+            if key not in filled and properties.get(key, {}).get("type") == "string":
+                filled[key] = ""
+        return filled
+    return data
+
+def validate_response(content, response_format, run_stats: dict = None) -> dict:
+    """
+    Parses and validates one response against `response_format` (a pydantic model),
+    repairing it locally if needed. Returns the validated data as a dict.
+    Raises InvalidResponse if it can't be repaired.
+    """
+    with span("parse", schema=response_format.__name__, bytes=len(content) if isinstance(content, str) else None) as s:
+        validated, repaired = _validate(content, response_format)
+        s.set(repaired=repaired)
+    if repaired:
+        _count(run_stats, "responses_repaired")
+    return validated
+
+def _validate(content, response_format):
+    repaired = False
+    if hasattr(content, "model_dump"):
+        data = content.model_dump()
+    elif isinstance(content, str):
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError:
+            try:
+                data = json.loads(repair_json(content))
+                repaired = True
+            except json.JSONDecodeError as e:
+                raise InvalidResponse(f"Response is not valid JSON: {e}")
+    else:
+        data = content
+
+    try:
+        validated = response_format.model_validate(data)
+    except ValidationError:
+        try:
+            validated = response_format.model_validate(_fill_missing(_stringify_values(data), response_format.model_json_schema()))
+            repaired = True
+        except ValidationError as e:
+            raise InvalidResponse(f"Response does not match {response_format.__name__}: {e.error_count()} errors")
+    return validated.model_dump(), repaired
+
+def add_token_counts(total: dict, token_counts: dict) -> dict:
+    for key, value in token_counts.items():
+        total[key] = total.get(key, 0) + value
+    return total
+
+async def with_retries(make_call, label: str, run_stats: dict = None, max_retries: int = VALIDATION_MAX_RETRIES):
+    """
+    Awaits make_call() (which returns (parsed, token_counts, cost)) and calls it again when it
+    raises InvalidResponse, up to `max_retries` times with capped exponential backoff.
+    Token counts and cost of the failed attempts are added to the result. When every attempt
+    fails, the last InvalidResponse is raised with the totals of all attempts.
+    """
+    spent_counts = {}
+    spent_cost = 0.0
+    for attempt in range(max_retries + 1):
+        try:
+            parsed, token_counts, cost = await make_call()
+            return parsed, add_token_counts(add_token_counts({}, token_counts), spent_counts), cost + spent_cost
+        except InvalidResponse as e:
+            _count(run_stats, "invalid_responses")
+            add_token_counts(spent_counts, e.token_counts)
+            spent_cost += e.cost
+            if attempt == max_retries:
+                _count(run_stats, "validation_failures")
+                print(f"WARNING: Giving up on {label} after {attempt + 1} invalid responses: {e}")
+                raise InvalidResponse(str(e), spent_counts, spent_cost)
+            delay = min(VALIDATION_BACKOFF_MAX, VALIDATION_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"WARNING: Invalid response for {label} ({e}), retrying in {delay:.1f}s")
+            _count(run_stats, "retries")
+            await asyncio.sleep(delay)
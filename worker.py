@@ -0,0 +1,348 @@
+"""
+Worker processes that share jobs through a work queue with leases.
+
+A job submitted with "distributed" (jobs.py) puts one work item per URL in the work_items
+table instead of scraping in the submitting process. Any number of workers, on this machine
+or others, claim batches of items and run them through the streaming pipeline (fetch,
+extraction and saving, as in a local job):
+- a claim leases the items to the worker for WORKER_LEASE_SECONDS,
+- a heartbeat thread extends the leases while the batch runs,
+- items whose lease expired (the worker crashed or hung) are claimed again by another worker,
+  up to WORKER_MAX_ATTEMPTS times, then marked failed,
+- a worker records an item's outcome before saving its result, and only saves it if it
+  still held the item, so a re-claimed item is saved once,
+- items of a batch that the pipeline didn't return are put back in the queue.
+
+The queue is a SQLite table next to the jobs table (one machine, many processes), or a
+Supabase/Postgres table for workers on several machines (STORAGE_BACKEND, see README):
+
+    python cli.py worker --processes 4
+"""
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from api_management import get_supabase_client
+from assets import (JOBS_DB_PATH, WORKER_BATCH_SIZE, WORKER_LEASE_SECONDS, WORKER_HEARTBEAT_INTERVAL,
+                    WORKER_MAX_ATTEMPTS, WORKER_POLL_INTERVAL)
+
+TABLE = "work_items"
+COUNTED = ("pending", "leased", "done", "failed", "cancelled")
+
+class SQLiteQueue:
+    """work_items in a local SQLite file; claims are single UPDATE ... RETURNING statements."""
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {TABLE} (
+                    job_id TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    worker_id TEXT,
+                    lease_expires_at REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    unique_name TEXT,
+                    input_tokens INTEGER NOT NULL DEFAULT 0,
+                    output_tokens INTEGER NOT NULL DEFAULT 0,
+                    cost REAL NOT NULL DEFAULT 0,
+                    pagination_input_tokens INTEGER NOT NULL DEFAULT 0,
+                    pagination_output_tokens INTEGER NOT NULL DEFAULT 0,
+                    pagination_cost REAL NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (job_id, url)
+                )
+            """)
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_status_idx ON {TABLE} (status, lease_expires_at)")
+            # Queues created before the pagination usage was recorded separately
+            columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({TABLE})")}
+            for column, kind in (("pagination_input_tokens", "INTEGER"), ("pagination_output_tokens", "INTEGER"),
+                                 ("pagination_cost", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE {TABLE} ADD COLUMN {column} {kind} NOT NULL DEFAULT 0")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, job_id: str, urls: list, params: dict) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT OR IGNORE INTO {TABLE} (job_id, url, params, status, created_at, updated_at) VALUES (?, ?, ?, 'pending', ?, ?)",
+                [(job_id, url, json.dumps(params), now, now) for url in dict.fromkeys(urls)],
+            )
+
+    def claim(self, worker_id: str, limit: int, lease_seconds: float, max_attempts: int = WORKER_MAX_ATTEMPTS) -> list:
+        """Leases up to `limit` pending or expired items to the worker. Returns them as dicts."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE {TABLE} SET status = 'failed', error = 'lease expired ' || attempts || ' times', updated_at = ? "
+                "WHERE status = 'leased' AND lease_expires_at < ? AND attempts >= ?",
+                (now, now, max_attempts),
+            )
+            rows = conn.execute(
+                f"UPDATE {TABLE} SET status = 'leased', worker_id = ?, lease_expires_at = ?, attempts = attempts + 1, updated_at = ? "
+                f"WHERE rowid IN (SELECT rowid FROM {TABLE} WHERE status = 'pending' OR (status = 'leased' AND lease_expires_at < ?) "
+                "ORDER BY created_at LIMIT ?) RETURNING *",
+                (worker_id, now + lease_seconds, now, now, limit),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def heartbeat(self, worker_id: str, lease_seconds: float) -> int:
+        """Extends the leases of all items the worker holds. Returns how many it still holds."""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE {TABLE} SET lease_expires_at = ?, updated_at = ? WHERE worker_id = ? AND status = 'leased'",
+                (now + lease_seconds, now, worker_id),
+            )
+        return cursor.rowcount
+
+    def finish(self, worker_id: str, job_id: str, url: str, status: str, **fields) -> bool:
+        """Sets the outcome of an item if the worker still holds it. Returns False if it lost the lease."""
+        fields.update(status=status, updated_at=time.time())
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE {TABLE} SET {assignments} WHERE job_id = ? AND url = ? AND worker_id = ? AND status = 'leased'",
+                (*fields.values(), job_id, url, worker_id),
+            )
+        return cursor.rowcount > 0
+
+    def release(self, worker_id: str) -> None:
+        """Puts the items a stopping worker still holds back in the queue."""
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE {TABLE} SET status = 'pending', worker_id = NULL, lease_expires_at = NULL, "
+                "attempts = attempts - 1, updated_at = ? WHERE worker_id = ? AND status = 'leased'",
+                (time.time(), worker_id),
+            )
+
+    def cancel(self, job_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE {TABLE} SET status = 'cancelled', updated_at = ? WHERE job_id = ? AND status IN ('pending', 'leased')",
+                (time.time(), job_id),
+            )
+
+    def items(self, job_id: str) -> list:
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT * FROM {TABLE} WHERE job_id = ? ORDER BY created_at", (job_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+class SupabaseQueue:
+    """
+    work_items in Supabase/Postgres, for workers on several machines. Claims go through the
+    claim_work_items function (SELECT ... FOR UPDATE SKIP LOCKED, see README).
+    """
+    def __init__(self, client):
+        self.client = client
+
+    def enqueue(self, job_id: str, urls: list, params: dict) -> None:
+        now = time.time()
+        rows = [{"job_id": job_id, "url": url, "params": json.dumps(params), "status": "pending",
+                 "attempts": 0, "created_at": now, "updated_at": now} for url in dict.fromkeys(urls)]
+        self.client.table(TABLE).upsert(rows, on_conflict="job_id,url", ignore_duplicates=True).execute()
+
+    def claim(self, worker_id: str, limit: int, lease_seconds: float, max_attempts: int = WORKER_MAX_ATTEMPTS) -> list:
+        response = self.client.rpc("claim_work_items", {"p_worker": worker_id, "p_limit": limit,
+                                                        "p_lease": lease_seconds, "p_max_attempts": max_attempts}).execute()
+        return response.data or []
+
+    def heartbeat(self, worker_id: str, lease_seconds: float) -> int:
+        now = time.time()
+        response = self.client.table(TABLE).update({"lease_expires_at": now + lease_seconds, "updated_at": now}) \
+            .eq("worker_id", worker_id).eq("status", "leased").execute()
+        return len(response.data or [])
+
+    def finish(self, worker_id: str, job_id: str, url: str, status: str, **fields) -> bool:
+        fields.update(status=status, updated_at=time.time())
+        response = self.client.table(TABLE).update(fields).eq("job_id", job_id).eq("url", url) \
+            .eq("worker_id", worker_id).eq("status", "leased").execute()
+        return bool(response.data)
+
+    def release(self, worker_id: str) -> None:
+        # attempts is left as is: PostgREST updates can't reference the current value
+        self.client.table(TABLE).update({"status": "pending", "worker_id": None, "lease_expires_at": None,
+                                         "updated_at": time.time()}) \
+            .eq("worker_id", worker_id).eq("status", "leased").execute()
+
+    def cancel(self, job_id: str) -> None:
+        self.client.table(TABLE).update({"status": "cancelled", "updated_at": time.time()}) \
+            .eq("job_id", job_id).in_("status", ["pending", "leased"]).execute()
+
+    def items(self, job_id: str) -> list:
+        response = self.client.table(TABLE).select("*").eq("job_id", job_id).order("created_at").execute()
+        return response.data or []
+
+def get_work_queue():
+    """
+    The work queue of the selected storage backend: SQLite with STORAGE_BACKEND=sqlite,
+    otherwise Supabase (None if it is not configured).
+    """
+    if os.getenv("STORAGE_BACKEND", "supabase").lower() == "sqlite":
+        return SQLiteQueue()
+    client = get_supabase_client()
+    return SupabaseQueue(client) if client is not None else None
+
+def progress(items: list) -> dict:
+    """Counts of a job's items per status."""
+    counts = {status: 0 for status in COUNTED}
+    for item in items:
+        counts[item["status"]] = counts.get(item["status"], 0) + 1
+    return counts
+
+class _Heartbeat:
+    """Extends a worker's leases every WORKER_HEARTBEAT_INTERVAL seconds while a batch runs."""
+    def __init__(self, queue, worker_id: str, lease_seconds: float):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="lease-heartbeat")
+
+    def _run(self) -> None:
+        while not self.stopped.wait(WORKER_HEARTBEAT_INTERVAL):
+            try:
+                self.queue.heartbeat(self.worker_id, self.lease_seconds)
+            except Exception as e:
+                print(f"WARNING: Heartbeat of {self.worker_id} failed: {e}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+def _spent(queue, job_id: str) -> dict:
+    """Tokens and cost already used by a job's finished items, so budgets hold across workers."""
+    done = [item for item in queue.items(job_id) if item["status"] == "done"]
+    return {"input_tokens": sum(item["input_tokens"] for item in done),
+            "output_tokens": sum(item["output_tokens"] for item in done)}, sum(item["cost"] for item in done)
+
+def process_batch(queue, worker_id: str, job_id: str, items: list, lease_seconds: float = WORKER_LEASE_SECONDS) -> dict:
+    """
+    Runs the claimed items of one job through the pipeline and records each outcome in the
+    queue before the page is saved. Fetch failures and errors are re-queued (until
+    WORKER_MAX_ATTEMPTS), pages skipped by the job's budget are done, and results of items whose
+    lease was lost are discarded. Returns the run_stats of the batch.
+    """
+    from pipeline import run_pipeline
+    from accounting import Budget
+
+    params = json.loads(items[0]["params"])
+    fields = params.get("fields") or []
+    indication = params.get("pagination_details", "") if params.get("use_pagination") else None
+    budget = None
+    if params.get("max_tokens") or params.get("max_cost"):
+        budget = Budget(params.get("max_tokens"), params.get("max_cost"))
+        budget.charge(*_spent(queue, job_id))
+    attempts = {item["url"]: item["attempts"] for item in items}
+    run_stats = {}
+
+    def record(page) -> bool:
+        """Records a page's outcome; False (don't save it) if the worker no longer holds the item."""
+        error = run_stats.get("failures", {}).get(page["url"]) or page["error"]
+        usage = {"unique_name": page["unique_name"], "input_tokens": page["input_tokens"],
+                 "output_tokens": page["output_tokens"], "cost": page["cost"], "error": error,
+                 "pagination_input_tokens": page["pagination_input_tokens"],
+                 "pagination_output_tokens": page["pagination_output_tokens"],
+                 "pagination_cost": page["pagination_cost"]}
+        attempt = attempts.pop(page["url"], 0)
+        if error and not error.startswith("skipped"):
+            status = "failed" if attempt >= WORKER_MAX_ATTEMPTS else "pending"
+        else:
+            status = "done"
+        held = queue.finish(worker_id, job_id, page["url"], status, **usage)
+        if not held:
+            print(f"WARNING: {worker_id} lost the lease on {page['url']}, its result is discarded")
+        return held
+
+    def requeue(error: str) -> None:
+        for url, attempt in attempts.items():
+            queue.finish(worker_id, job_id, url, "failed" if attempt >= WORKER_MAX_ATTEMPTS else "pending", error=error)
+
+    with _Heartbeat(queue, worker_id, lease_seconds):
+        try:
+            for _ in run_pipeline(list(attempts), fields, params["model"], indication, run_stats=run_stats,
+                                  budget=budget, use_templates=params.get("use_templates", False),
+                                  fetch_profile=params.get("fetch_profile"), pack_pages=params.get("pack_pages", False),
+                                  before_save=record):
+                pass
+        except Exception as e:
+            print(f"ERROR: Batch of job {job_id} failed on {worker_id}: {e}")
+            requeue(str(e))
+        else:
+            if attempts:
+                print(f"WARNING: {len(attempts)} items of job {job_id} were not processed by {worker_id}, re-queued")
+                requeue("not processed")
+    return run_stats
+
+def run_worker(worker_id: str = None, batch_size: int = WORKER_BATCH_SIZE, lease_seconds: float = WORKER_LEASE_SECONDS,
+               once: bool = False) -> None:
+    """
+    Claims and processes batches until interrupted (or, with `once`, until the queue is empty).
+    Items still held when the worker stops are released for other workers.
+    """
+    queue = get_work_queue()
+    if queue is None:
+        raise RuntimeError("No work queue: set STORAGE_BACKEND=sqlite or configure Supabase")
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    print(f"INFO: Worker {worker_id} started")
+    try:
+        while True:
+            items = queue.claim(worker_id, batch_size, lease_seconds)
+            if not items:
+                if once:
+                    break
+                time.sleep(WORKER_POLL_INTERVAL)
+                continue
+            jobs = {}
+            for item in items:
+                jobs.setdefault(item["job_id"], []).append(item)
+            for job_id, job_items in jobs.items():
+                print(f"INFO: Worker {worker_id} processing {len(job_items)} URLs of job {job_id}")
+                process_batch(queue, worker_id, job_id, job_items, lease_seconds)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        queue.release(worker_id)
+        print(f"INFO: Worker {worker_id} stopped")
+
+def run_workers(processes: int, **options) -> None:
+    """Runs `processes` workers in separate processes (each with its own browser) until interrupted."""
+    if processes <= 1:
+        run_worker(**options)
+        return
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    for i in range(processes):
+        kwargs = dict(options, worker_id=f"{options['worker_id']}-{i}") if options.get("worker_id") else options
+        workers.append(context.Process(target=run_worker, kwargs=kwargs, name=f"scrape-worker-{i}"))
+    for process in workers:
+        process.start()
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        for process in workers:
+            process.join()
@@ -0,0 +1,289 @@
+"""
+Wrapper induction: learn CSS selectors from one LLM extraction and reuse them on sibling pages.
+
+Pages of one site (e.g. page 1, 2, 3 of a listing) usually share a template. When templates
+are enabled for a run, the listings the LLM returns for the first page of a domain are
+aligned back to that page's HTML:
+- the element holding each value is located (by text, or by href/src for URLs),
+- the smallest element holding all values of a listing is the record; the most common
+  record selector (tag and classes) becomes the template's record selector,
+- each field gets the most common selector path (and attribute) relative to the record.
+The template is kept only if it reproduces the LLM's listings on that page. Sibling pages
+are then extracted from their HTML with the template, without calling the LLM; the LLM is
+used again (and the template re-learned) only when a page fails validation.
+Templates are stored per domain and field set in a local SQLite file (WRAPPER_DB_PATH).
+"""
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import List
+from urllib.parse import urljoin
+from utils import get_domain
+from assets import (WRAPPER_DB_PATH, WRAPPER_MIN_AGREEMENT, WRAPPER_MIN_FILL_RATE,
+                    WRAPPER_MIN_RECORD_SHARE, WRAPPER_MAX_INDUCTIONS)
+
+CSS_CLASS = re.compile(r"^[A-Za-z_][\w-]*$")
+URL_VALUE = re.compile(r"^(https?:)?//|^/")
+
+@contextmanager
+def _connect():
+    os.makedirs(os.path.dirname(WRAPPER_DB_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(WRAPPER_DB_PATH, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS templates (
+            domain TEXT NOT NULL,
+            fields_key TEXT NOT NULL,
+            template TEXT NOT NULL,
+            learned_from TEXT,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (domain, fields_key)
+        )
+    """)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def _fields_key(fields: List[str]) -> str:
+    return json.dumps(sorted(fields))
+
+def load_template(domain: str, fields: List[str]):
+    """Returns the stored template for a domain and field set, or None."""
+    with _connect() as conn:
+        row = conn.execute("SELECT template FROM templates WHERE domain = ? AND fields_key = ?",
+                           (domain, _fields_key(fields))).fetchone()
+    return json.loads(row[0]) if row else None
+
+def save_template(domain: str, fields: List[str], template: dict, learned_from: str) -> None:
+    with _connect() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO templates (domain, fields_key, template, learned_from, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (domain, _fields_key(fields), json.dumps(template), learned_from, time.time()),
+        )
+
+def _norm(text) -> str:
+    return " ".join(str(text or "").split()).lower()
+
+def _step(tag) -> str:
+    """Selector step for one element: tag, up to two stable classes, and its position if ambiguous."""
+    classes = [c for c in tag.get("class", []) if CSS_CLASS.match(c) and not re.search(r"\d", c)][:2]
+    step = tag.name + "".join(f".{c}" for c in classes)
+    if tag.parent is not None:
+        siblings = [s for s in tag.parent.find_all(tag.name, recursive=False)
+                    if all(c in s.get("class", []) for c in classes)]
+        if len(siblings) > 1:
+            step += f":nth-of-type({tag.parent.find_all(tag.name, recursive=False).index(tag) + 1})"
+    return step
+
+def _record_selector(tag, depth: int = 3) -> str:
+    """Tag and classes of a record, prefixed with its parents' while it has no class (up to `depth` levels)."""
+    classes = [c for c in tag.get("class", []) if CSS_CLASS.match(c) and not re.search(r"\d", c)][:2]
+    selector = tag.name + "".join(f".{c}" for c in classes)
+    if not classes and depth > 1 and tag.parent is not None and tag.parent.name not in (None, "[document]", "html"):
+        selector = _record_selector(tag.parent, depth - 1) + " > " + selector
+    return selector
+
+def _text(element, texts: dict) -> str:
+    """Normalized text of an element, memoized per induction in `texts`."""
+    if id(element) not in texts:
+        texts[id(element)] = _norm(element.get_text())
+    return texts[id(element)]
+
+def _locate(root, value: str, base_url: str, texts: dict):
+    """The deepest element under root holding `value`, as (element, attribute) or (None, None)."""
+    if URL_VALUE.search(value):
+        for attr in ("href", "src"):
+            for element in root.find_all(attrs={attr: True}):
+                if element[attr] == value or urljoin(base_url, element[attr]) == value:
+                    return element, attr
+    target = _norm(value)
+    if not target:
+        return None, None
+    exact = contains = None
+    for element in root.find_all(True):
+        text = _text(element, texts)
+        if text == target:
+            exact = element  # find_all is in document order, so later matches are deeper
+        elif target in text and (contains is None or len(text) <= len(_text(contains, texts))):
+            contains = element
+    return (exact or contains), ("text" if (exact or contains) is not None else None)
+
+def _path(record, element) -> str:
+    steps = []
+    while element is not None and element is not record:
+        steps.append(_step(element))
+        element = element.parent
+    return " > ".join(reversed(steps))
+
+def _record_of(anchor, listing: dict, fields: List[str], texts: dict):
+    """The lowest ancestor of `anchor` whose text holds the most values of the listing."""
+    values = [_norm(listing.get(field)) for field in fields if _norm(listing.get(field))]
+    best, best_count = anchor, -1
+    for element in [anchor, *anchor.parents]:
+        if element.name in (None, "[document]", "html", "body"):
+            break
+        text = _text(element, texts)
+        count = sum(value in text for value in values)
+        if count > best_count:
+            best, best_count = element, count
+        if count == len(values):
+            break
+    return best
+
+def induce_template(html: str, base_url: str, listings: list, fields: List[str]):
+    """
+    Learns a template from a page and the listings the LLM extracted from it.
+    Returns {"record", "fields": {field: {"path", "attr"}}, "fill_rates", "records"} or None.
+    """
+    from bs4 import BeautifulSoup
+    listings = [listing for listing in listings if isinstance(listing, dict) and any(_norm(v) for v in listing.values())]
+    if not listings or not html:
+        return None
+    soup = BeautifulSoup(html, "html.parser")
+    body = soup.body or soup
+    texts = {}
+
+    # The most distinctive field (fewest repeated values) anchors each listing in the DOM.
+    distinct = {field: len({_norm(listing.get(field)) for listing in listings}) for field in fields}
+    anchor_field = max(fields, key=lambda field: distinct[field])
+    records = []
+    for listing in listings:
+        anchor, _ = _locate(body, str(listing.get(anchor_field) or ""), base_url, texts)
+        if anchor is not None:
+            records.append((_record_of(anchor, listing, fields, texts), listing))
+    if not records:
+        return None
+    record_selector, count = Counter(_record_selector(record) for record, _ in records).most_common(1)[0]
+    if count < WRAPPER_MIN_RECORD_SHARE * len(listings):
+        return None
+
+    rules = {}
+    for field in fields:
+        found = Counter()
+        for record, listing in records:
+            if _record_selector(record) != record_selector or not _norm(listing.get(field)):
+                continue
+            element, attr = _locate(record, str(listing[field]), base_url, texts)
+            if element is not None:
+                found[(_path(record, element), attr)] += 1
+        if found:
+            (path, attr), _ = found.most_common(1)[0]
+            rules[field] = {"path": path, "attr": attr}
+        else:
+            rules[field] = None
+    template = {"record": record_selector, "fields": rules}
+    rows = apply_template(template, html, base_url)
+    if not rows:
+        return None
+    template["fill_rates"] = {field: sum(bool(row[field]) for row in rows) / len(rows) for field in fields}
+    template["records"] = len(rows)
+    if min(_recall(rows, listings, fields), _precision(rows, listings, fields)) < WRAPPER_MIN_AGREEMENT:
+        return None
+    return template
+
+def apply_template(template: dict, html: str, base_url: str) -> list:
+    """Extracts one {field: value} row per record of the page with a template."""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "html.parser")
+    rows = []
+    for record in soup.select(template["record"]):
+        row = {}
+        for field, rule in template["fields"].items():
+            element = None
+            if rule is not None:
+                element = record.select_one(f":scope > {rule['path']}") if rule["path"] else record
+            if element is None:
+                row[field] = ""
+            elif rule["attr"] == "text":
+                row[field] = " ".join(element.get_text().split())
+            else:
+                row[field] = urljoin(base_url, element.get(rule["attr"], ""))
+        if any(row.values()):
+            rows.append(row)
+    return rows
+
+def _matches(row: dict, listing: dict, fields: List[str]) -> bool:
+    """A template row matches an LLM listing when each of its values contains the listing's value."""
+    return all(_norm(listing.get(field)) in _norm(row.get(field)) for field in fields)
+
+def _recall(rows: list, listings: list, fields: List[str]) -> float:
+    """Share of the LLM's listings that the template reproduced."""
+    return sum(any(_matches(row, listing, fields) for row in rows) for listing in listings) / len(listings)
+
+def _precision(rows: list, listings: list, fields: List[str]) -> float:
+    """Share of the template's rows that the LLM also extracted."""
+    return sum(any(_matches(row, listing, fields) for listing in listings) for row in rows) / len(rows)
+
+def validate_rows(template: dict, rows: list) -> bool:
+    """
+    True if a page's rows look like the ones the template was learned from: at least one
+    record, and every field that was usually filled is still filled on WRAPPER_MIN_FILL_RATE of them.
+    """
+    if not rows:
+        return False
+    for field, learned_rate in template.get("fill_rates", {}).items():
+        if learned_rate >= 0.5 and sum(bool(row.get(field)) for row in rows) / len(rows) < WRAPPER_MIN_FILL_RATE:
+            return False
+    return True
+
+class TemplateSession:
+    """
+    Template use during one run (created per event loop). The first page of a domain without
+    a template is extracted by the LLM while sibling pages wait, so they can use what it learned.
+    After WRAPPER_MAX_INDUCTIONS failed attempts for a domain, its pages no longer wait.
+    Counts are recorded in run_stats: template_pages, template_failures, templates_learned.
+    """
+    def __init__(self, fields: List[str]):
+        self.fields = list(fields)
+        self.locks = defaultdict(asyncio.Lock)
+        self.inductions = Counter()
+
+    def _learn(self, domain: str, url: str, html: str, parsed, run_stats: dict) -> None:
+        listings = parsed.get("listings", []) if isinstance(parsed, dict) else []
+        template = induce_template(html, url, listings, self.fields)
+        if template is None:
+            print(f"INFO: Could not learn a template for {domain} from {url}")
+            return
+        save_template(domain, self.fields, template, url)
+        print(f"INFO: Learned a template for {domain} from {url} ({template['records']} records)")
+        if run_stats is not None:
+            run_stats["templates_learned"] = run_stats.get("templates_learned", 0) + 1
+
+    async def extract(self, url: str, html: str, llm_extract, run_stats: dict = None):
+        """
+        Extracts one page with the domain's template, or with `llm_extract` (an async callable
+        returning (parsed, token_counts, cost)) when there is none or the page fails validation.
+        Returns (parsed, token_counts, cost).
+        """
+        if not html:
+            return await llm_extract()
+        domain = get_domain(url)
+        template = await asyncio.to_thread(load_template, domain, self.fields)
+        if template is None and self.inductions[domain] < WRAPPER_MAX_INDUCTIONS:
+            async with self.locks[domain]:
+                template = await asyncio.to_thread(load_template, domain, self.fields)
+                # Pages that waited for the last allowed (failed) induction go on without the lock
+                if template is None and self.inductions[domain] < WRAPPER_MAX_INDUCTIONS:
+                    self.inductions[domain] += 1
+                    parsed, token_counts, cost = await llm_extract()
+                    await asyncio.to_thread(self._learn, domain, url, html, parsed, run_stats)
+                    return parsed, token_counts, cost
+        if template is not None:
+            rows = await asyncio.to_thread(apply_template, template, html, url)
+            if validate_rows(template, rows):
+                if run_stats is not None:
+                    run_stats["template_pages"] = run_stats.get("template_pages", 0) + 1
+                return {"listings": rows}, {"input_tokens": 0, "output_tokens": 0}, 0.0
+            print(f"INFO: Template for {domain} failed on {url}, using the LLM")
+            if run_stats is not None:
+                run_stats["template_failures"] = run_stats.get("template_failures", 0) + 1
+        parsed, token_counts, cost = await llm_extract()
+        if template is not None:
+            await asyncio.to_thread(self._learn, domain, url, html, parsed, run_stats)
+        return parsed, token_counts, cost